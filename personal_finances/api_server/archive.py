@@ -0,0 +1,271 @@
+"""
+Archival of old transactions.
+
+``archive_transactions`` moves the executed transactions older than
+``ARCHIVE_AFTER_MONTHS`` whole months out of ``Transaction`` into one
+``TransactionArchive`` per account and month. Its ``data`` holds every
+column as a list, compressed with zlib. Transference legs and invoice
+transactions stay, other rows point to them. Account balances are stored,
+so moving rows changes none.
+
+``TransactionHistory`` reads the transaction lists through to the archive:
+past the archive horizon it merges the live rows with the archived ones,
+decompressing only the months a page reaches. ``read_through`` picks it
+for the sync and async lists alike, ``archived_transaction`` finds a single
+archived row.
+"""
+
+import json
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from heapq import merge
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction as dbtnsac
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from personal_finances.api_server.dashboard import invalidate_dashboard
+from personal_finances.api_server.models import (Category, Subcategory,
+    Transaction, TransactionArchive)
+
+COLUMNS = (
+    'id', 'name', 'date_time', 'value', 'type', 'repeat', 'total_parts',
+    'part_number', 'category_id', 'subcategory_id',
+)
+
+def archive_cutoff(now=None):
+    """Start of the oldest month kept in ``Transaction``."""
+    month = timezone.localtime(now).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    return month - relativedelta(months=settings.ARCHIVE_AFTER_MONTHS)
+
+def encode(transactions):
+    columns = {name: [] for name in COLUMNS}
+    for transaction in transactions:
+        for name in COLUMNS:
+            columns[name].append(getattr(transaction, name))
+    columns['date_time'] = [
+        date_time.isoformat() for date_time in columns['date_time']]
+    columns['value'] = [str(value) for value in columns['value']]
+    return zlib.compress(json.dumps(columns).encode())
+
+def decode(data, account_id=None):
+    """Unsaved ``Transaction`` instances of an archive ``data``."""
+    columns = json.loads(zlib.decompress(data))
+    columns['date_time'] = map(
+        datetime.fromisoformat, columns['date_time'])
+    columns['value'] = map(Decimal, columns['value'])
+    return [
+        Transaction(
+            account_id=account_id,
+            status=Transaction.EXECUTED,
+            **dict(zip(COLUMNS, row))
+        )
+        for row in zip(*(columns[name] for name in COLUMNS))
+    ]
+
+def archivable(alias, cutoff):
+    return Transaction.objects.using(alias).filter(
+        status=Transaction.EXECUTED,
+        is_transference=False,
+        creditcardinvoice__isnull=True,
+        date_time__lt=cutoff
+    )
+
+def add_to_archive(alias, account_id, month, transactions):
+    archives = TransactionArchive.objects.using(alias).select_for_update()
+    archive = archives.filter(account_id=account_id, month=month).first()
+    if archive is None:
+        archive = TransactionArchive(account_id=account_id, month=month)
+    else:
+        transactions = transactions + decode(archive.data, account_id)
+    transactions.sort(key=lambda t: (t.date_time, t.id), reverse=True)
+    archive.first_date_time = transactions[-1].date_time
+    archive.last_date_time = transactions[0].date_time
+    for type, prefix in (
+            (Transaction.INCOME, 'income'), (Transaction.EXPENSE, 'expense')):
+        values = [t.value for t in transactions if t.type == type]
+        setattr(archive, f'{prefix}_count', len(values))
+        setattr(archive, f'{prefix}_total', sum(values, Decimal(0)))
+    archive.data = encode(transactions)
+    archive.save(using=alias)
+
+def archive_transactions(alias, cutoff, chunk_size=500):
+    """Move the archivable transactions of ``alias`` older than ``cutoff``.
+
+    Works by account and month, ``chunk_size`` rows per transaction.
+    Yields how many transactions each chunk moved.
+    """
+    transactions = archivable(alias, cutoff)
+    months = transactions.annotate(
+        month=TruncMonth('date_time')
+    ).order_by().values_list(
+        'account_id', 'account__user_id', 'month').distinct()
+    for account_id, user_id, month_start in list(months):
+        month_rows = transactions.filter(
+            account_id=account_id,
+            date_time__gte=month_start,
+            date_time__lt=month_start + relativedelta(months=1)
+        )
+        while True:
+            with dbtnsac.atomic(using=alias):
+                rows = list(month_rows.order_by('id')[:chunk_size])
+                if not rows:
+                    break
+                add_to_archive(alias, account_id, month_start.date(), rows)
+                Transaction.objects.using(alias).filter(
+                    id__in=[row.id for row in rows]).delete()
+            invalidate_dashboard(user_id)
+            yield len(rows)
+
+class TransactionHistory:
+    """Transactions of a list, live and archived, newest first.
+
+    A sequence for Django's paginator. ``transactions`` is the filtered
+    live queryset and ``archives`` the ``TransactionArchive`` of the same
+    accounts. Rows from ``cutoff`` on are all live, so pages before it are
+    read as before; older ones merge the live rows older than ``cutoff``
+    with the archived ones.
+    """
+    def __init__(self, transactions, archives, cutoff, type=None,
+            begin=None, end=None):
+        self.transactions = transactions
+        self.archives = archives.defer('data')
+        self.cutoff = cutoff
+        self.type = type
+        self.begin = begin
+        self.end = end
+        if begin:
+            self.archives = self.archives.filter(last_date_time__gte=begin)
+        if end:
+            self.archives = self.archives.filter(first_date_time__lte=end)
+        self._count = None
+        self._recent_count = None
+
+    def matches(self, transaction):
+        return (
+            (not self.type or transaction.type == self.type)
+            and (not self.begin or transaction.date_time >= self.begin)
+            and (not self.end or transaction.date_time <= self.end)
+        )
+
+    def within_period(self, archive):
+        return (
+            (not self.begin or archive.first_date_time >= self.begin)
+            and (not self.end or archive.last_date_time <= self.end)
+        )
+
+    def archived_count(self):
+        count = 0
+        partial = []
+        for archive in self.archives:
+            if not self.within_period(archive):
+                partial.append(archive.pk)
+            elif self.type == Transaction.INCOME:
+                count += archive.income_count
+            elif self.type == Transaction.EXPENSE:
+                count += archive.expense_count
+            else:
+                count += archive.income_count + archive.expense_count
+        if partial:
+            for data in TransactionArchive.objects.using(
+                    self.archives.db).filter(pk__in=partial).values_list(
+                    'data', flat=True):
+                count += sum(map(self.matches, decode(data)))
+        return count
+
+    def count(self):
+        if self._count is None:
+            self._archived = self.archived_count()
+            self._count = self.transactions.count() + self._archived
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def archived(self, limit):
+        """The first ``limit`` archived transactions, newest first."""
+        rows = []
+        last_month = None
+        months = self.archives.order_by('-month').values_list('pk', 'month')
+        for archive, month in list(months):
+            # Every account of the month, its rows interleave
+            if len(rows) >= limit and month != last_month:
+                break
+            last_month = month
+            data, account_id = TransactionArchive.objects.using(
+                self.archives.db).values_list('data', 'account_id').get(
+                pk=archive)
+            rows.extend(filter(self.matches, decode(data, account_id)))
+        rows.sort(key=lambda t: (t.date_time, t.id), reverse=True)
+        return rows[:limit]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        self.count()
+        start, stop = index.start or 0, index.stop
+        if not self._archived:
+            return list(self.transactions[start:stop])
+        if self._recent_count is None:
+            self._recent_count = self.transactions.filter(
+                date_time__gte=self.cutoff).count()
+        recent = self._recent_count
+        if stop <= recent:
+            return list(self.transactions[start:stop])
+        page = list(self.transactions[start:recent]) if start < recent else []
+        old_stop = stop - recent
+        older = merge(
+            self.transactions.filter(date_time__lt=self.cutoff)[:old_stop],
+            self.archived(old_stop),
+            key=lambda t: (t.date_time, t.id),
+            reverse=True
+        )
+        older = list(older)[max(start - recent, 0):old_stop]
+        clear_missing_categories(older)
+        return page + older
+
+def read_through(transactions, archives, type=None, begin=None, end=None):
+    """List ``transactions``, with the archived ones when the period
+    reaches past the archive horizon.
+    """
+    cutoff = archive_cutoff()
+    if begin is not None and begin >= cutoff:
+        return transactions
+    return TransactionHistory(
+        transactions,
+        archives,
+        cutoff,
+        type=type if type in (Transaction.INCOME, Transaction.EXPENSE)
+            else None,
+        begin=begin,
+        end=end
+    )
+
+def archived_transaction(archives, id):
+    """The transaction ``id`` in ``archives``, or None."""
+    rows = archives.order_by('pk').values_list('data', 'account_id')
+    for data, account_id in rows.iterator(chunk_size=10):
+        for transaction in decode(data, account_id):
+            if transaction.id == id:
+                clear_missing_categories([transaction])
+                return transaction
+    return None
+
+def clear_missing_categories(transactions, alias=None):
+    """Unset the categories deleted after their transactions were archived.
+    """
+    archived = [t for t in transactions if t._state.adding]
+    for model, field in (
+            (Category, 'category_id'), (Subcategory, 'subcategory_id')):
+        ids = {getattr(t, field) for t in archived} - {None}
+        if not ids:
+            continue
+        existing = set(model.objects.using(alias).filter(
+            id__in=ids).values_list('id', flat=True))
+        for transaction in archived:
+            if getattr(transaction, field) not in existing:
+                setattr(transaction, field, None)
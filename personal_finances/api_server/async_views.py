@@ -0,0 +1,142 @@
+"""
+Async versions of the read endpoints.
+
+They run on the async ORM, so under an ASGI server a worker keeps serving
+other requests while one waits on the database or on a slow client.
+Authentication, permission and throttling follow the DRF settings used by
+the sync views.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db.models import Sum as dbsum
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from personal_finances.api_server import archive
+from personal_finances.api_server.instrumentation import TimedJSONRenderer
+from personal_finances.api_server.models import (Account, Category,
+    Transaction, TransactionArchive)
+from personal_finances.api_server.pagination import (
+    AsyncPageNumberCustomPagination)
+from personal_finances.serializers import (AccountSerializer,
+    CategorySerializer, PeriodSerializer, TransactionSerializer)
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(
+        TimedJSONRenderer().render(data),
+        status=status_code,
+        content_type='application/json'
+    )
+
+def initial(request):
+    """Authenticate, check permissions and throttle a DRF request."""
+    request.user
+    for permission_class in api_settings.DEFAULT_PERMISSION_CLASSES:
+        if not permission_class().has_permission(request, None):
+            if not request.successful_authenticator:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied()
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            raise exceptions.Throttled(throttle.wait())
+
+def async_api_view(handler):
+    """Run an async GET handler with the DRF request checks."""
+    @functools.wraps(handler)
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return render(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status.HTTP_405_METHOD_NOT_ALLOWED
+            )
+        request = Request(
+            request,
+            authenticators=[
+                auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+            ]
+        )
+        try:
+            await sync_to_async(initial)(request)
+            data, status_code = await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = render({'detail': exc.detail}, exc.status_code)
+            if isinstance(exc, (exceptions.NotAuthenticated,
+                    exceptions.AuthenticationFailed)):
+                response['WWW-Authenticate'] = (
+                    request.authenticators[0].authenticate_header(request))
+            if isinstance(exc, exceptions.Throttled) and exc.wait:
+                response['Retry-After'] = str(int(exc.wait))
+            return response
+        return render(data, status_code)
+    return view
+
+@async_api_view
+async def account_list(request):
+    accounts = [
+        account async for account in Account.objects.filter(
+            user=request.user)
+    ]
+    return AccountSerializer(accounts, many=True).data, status.HTTP_200_OK
+
+@async_api_view
+async def category_list(request):
+    categories = Category.objects.filter(user=request.user)
+    of_type = request.query_params.get('of_type')
+    if of_type:
+        categories = categories.filter(of_type=of_type)
+    data = CategorySerializer(
+        [category async for category in categories], many=True).data
+    if data:
+        return data, status.HTTP_200_OK
+    return data, status.HTTP_404_NOT_FOUND
+
+@async_api_view
+async def transaction_list(request):
+    transactions = Transaction.objects.filter(account__user=request.user)
+    transaction_type = request.query_params.get('type')
+    if transaction_type == Transaction.INCOME:
+        transactions = Transaction.incomes.filter(account__user=request.user)
+    if transaction_type == Transaction.EXPENSE:
+        transactions = Transaction.expenses.filter(account__user=request.user)
+    archives = TransactionArchive.objects.filter(account__user=request.user)
+    account_id = request.query_params.get('account_id')
+    if account_id:
+        transactions = transactions.filter(account__id=account_id)
+        archives = archives.filter(account__id=account_id)
+    begin_at = end_at = None
+    if (request.query_params.get('begin_at')
+            or request.query_params.get('end_at')):
+        period_srz = PeriodSerializer(data=request.query_params)
+        if not period_srz.is_valid():
+            return period_srz.errors, status.HTTP_400_BAD_REQUEST
+        begin_at = period_srz.validated_data['begin_at']
+        end_at = period_srz.validated_data['end_at']
+        transactions = transactions.filter(
+            date_time__gte=begin_at, date_time__lte=end_at)
+    transactions = archive.read_through(
+        transactions, archives, transaction_type, begin_at, end_at)
+    pagination = AsyncPageNumberCustomPagination()
+    if isinstance(transactions, archive.TransactionHistory):
+        # Merging with the archive runs on the sync ORM
+        page = await sync_to_async(pagination.paginate_queryset)(
+            transactions, request)
+    else:
+        page = await pagination.apaginate_queryset(transactions, request)
+    return (
+        pagination.get_paginated_data(
+            TransactionSerializer(page, many=True).data),
+        status.HTTP_200_OK
+    )
+
+@async_api_view
+async def total_balance(request):
+    accounts = await Account.objects.filter(
+        user=request.user
+    ).aaggregate(dbsum('balance'))
+    return {'total_balance': accounts['balance__sum']}, status.HTTP_200_OK
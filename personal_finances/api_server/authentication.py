@@ -0,0 +1,155 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import router
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from personal_finances.api_server import cache
+from personal_finances.api_server.cache import token_cache
+from personal_finances.api_server.instrumentation import timed
+
+# What authentication and permissions read, with the names for greetings,
+# in model order as ``from_db`` wants. Other fields, the password hash among
+# them, are never cached.
+USER_FIELDS = [
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in (
+        'id', 'username', 'first_name', 'last_name', 'is_active',
+        'is_staff', 'is_superuser')
+]
+
+def get_shared_cache():
+    if settings.TOKEN_SHARED_CACHE:
+        return caches[settings.TOKEN_SHARED_CACHE]
+    return None
+
+def shared_cache_key(key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'auth_token_{digest}'
+
+def revoked_key(key):
+    return f'{shared_cache_key(key)}_revoked'
+
+def token_expires_at(token):
+    """Epoch second when the token stops being valid, None if never."""
+    if settings.TOKEN_TTL is None:
+        return None
+    return token.created.timestamp() + settings.TOKEN_TTL
+
+def is_token_expired(token):
+    expires_at = token_expires_at(token)
+    return expires_at is not None and expires_at <= time.time()
+
+def get_revocation_cache():
+    return cache.get_shared_cache(settings.TOKEN_REVOCATION_CACHE)
+
+def invalidate_token(key):
+    """Drop the cached lookups of a token deleted from the database."""
+    token_cache.delete(key)
+    # Read by every worker before trusting a copy loaded earlier
+    get_revocation_cache().set(revoked_key(key), time.time(), max(
+        settings.TOKEN_CACHE_TTL, settings.TOKEN_SHARED_CACHE_TTL))
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(shared_cache_key(key))
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user=user_id).values_list(
+            'key', flat=True):
+        invalidate_token(key)
+
+def rotate_token(user):
+    """Replace the token of a user by a new one and return it."""
+    keys = list(Token.objects.filter(user=user).values_list('key', flat=True))
+    Token.objects.filter(user=user).delete()
+    for key in keys:
+        invalidate_token(key)
+    return Token.objects.create(user=user)
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches token to user lookups.
+
+    Entries live in a bounded per-process LRU and, when
+    ``TOKEN_SHARED_CACHE`` names a cache alias, in that shared cache too.
+    An entry never lives past the expiry of its token. Revoking a token
+    through ``invalidate_token`` drops it from both layers and records the
+    revocation in the shared ``TOKEN_REVOCATION_CACHE``, which every worker
+    checks before using an entry loaded before it.
+    """
+    def authenticate(self, request):
+        with timed('auth'):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = self.get_shared_entry(key)
+        if entry is not None and self.is_revoked(key, entry):
+            token_cache.delete(key)
+            entry = None
+        if entry is None:
+            entry = self.load_entry(key)
+        expires_at = entry['expires_at']
+        if expires_at is not None and expires_at <= time.time():
+            invalidate_token(key)
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        user = User.from_db(entry['db'], USER_FIELDS, entry['user'])
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        token = Token.from_db(
+            entry['db'], ['key', 'user_id', 'created'],
+            [key, user.pk, entry['created']]
+        )
+        token.user = user
+        return (user, token)
+
+    def get_shared_entry(self, key):
+        shared_cache = get_shared_cache()
+        if shared_cache is None:
+            return None
+        entry = shared_cache.get(shared_cache_key(key))
+        if entry is not None:
+            token_cache.set(key, entry, ttl=self.get_entry_ttl(
+                entry, settings.TOKEN_CACHE_TTL))
+        return entry
+
+    def is_revoked(self, key, entry):
+        revoked_at = get_revocation_cache().get(revoked_key(key))
+        return revoked_at is not None and entry['loaded_at'] <= revoked_at
+
+    def load_entry(self, key):
+        # Read from the primary so a token issued by login is found before
+        # the replicas catch up
+        loaded_at = time.time()
+        try:
+            token = Token.objects.db_manager(
+                router.db_for_write(Token)).select_related('user').get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        entry = {
+            'db': token._state.db,
+            'created': token.created,
+            'expires_at': token_expires_at(token),
+            'loaded_at': loaded_at,
+            'user': [getattr(token.user, name) for name in USER_FIELDS],
+        }
+        token_cache.set(key, entry, ttl=self.get_entry_ttl(
+            entry, settings.TOKEN_CACHE_TTL))
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            shared_cache.set(
+                shared_cache_key(key),
+                entry,
+                self.get_entry_ttl(entry, settings.TOKEN_SHARED_CACHE_TTL)
+            )
+        return entry
+
+    def get_entry_ttl(self, entry, ttl):
+        if entry['expires_at'] is None:
+            return ttl
+        return max(0, min(ttl, entry['expires_at'] - time.time()))
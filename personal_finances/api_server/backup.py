@@ -0,0 +1,256 @@
+"""
+Online backup of the SQLite databases.
+
+``backup_database`` copies a live database with SQLite's backup API, a
+few pages per step with a sleep in between. In WAL mode it first opens a
+read transaction on the source: the copy is of that snapshot, so writers
+never restart it and are never blocked by it. In rollback journal mode
+each step briefly holds the shared lock, which writers wait for on
+``busy_timeout``.
+
+``WalArchiver`` keeps the frames written to the WAL for point in time
+recovery. Each ``archive`` call takes the write lock only to read the
+frames committed since the last call into memory, then gzips them into a
+segment file with writers going on. Between calls it holds a read
+transaction, so the WAL can not be restarted over frames it has not copied
+yet.
+
+``restore_database`` copies a backup and replays, in order, the segments
+written after that backup started up to a point in time. ``verify_database``
+checks the result.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+
+WAL_HEADER_SIZE = 32
+FRAME_HEADER_SIZE = 24
+
+class BackupError(Exception):
+    pass
+
+def journal_mode(connection):
+    return connection.execute('PRAGMA journal_mode').fetchone()[0].lower()
+
+def backup_database(source, target, pages=64, sleep=0.01):
+    """Copy the database file ``source`` to ``target`` while in use.
+
+    Writes a ``.json`` next to ``target`` with the time the copy started,
+    which ``restore_database`` needs to pick the WAL segments to replay.
+    """
+    target = Path(target)
+    if target.exists():
+        raise BackupError(f'{target} already exists')
+    started_at = time.time_ns()
+    with closing(sqlite3.connect(source, isolation_level=None)) as src, \
+            closing(sqlite3.connect(target, isolation_level=None)) as dst:
+        if journal_mode(src) == 'wal':
+            src.execute('BEGIN')
+            src.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        src.backup(dst, pages=pages, sleep=sleep)
+        if src.in_transaction:
+            src.execute('ROLLBACK')
+        # A standalone file, without -wal and -shm companions
+        dst.execute('PRAGMA journal_mode = DELETE').fetchall()
+    Path(f'{target}.json').write_text(json.dumps({
+        'source': str(source),
+        'started_at': started_at,
+    }))
+    return target
+
+def backup_started_at(backup):
+    try:
+        return json.loads(Path(f'{backup}.json').read_text())['started_at']
+    except FileNotFoundError:
+        raise BackupError(f'{backup}.json is missing, made by backup_db')
+
+def read_wal_header(data):
+    magic, version, page_size, sequence, salt1, salt2 = struct.unpack_from(
+        '>6I', data)
+    if magic not in (0x377f0682, 0x377f0683):
+        raise BackupError('not a WAL file')
+    return page_size, (salt1, salt2)
+
+def committed_frames(data, offset, page_size, salts):
+    """End of the frames of ``data`` from ``offset`` up to the last commit.
+
+    Frames left behind by an older WAL generation carry other salts.
+    """
+    frame_size = FRAME_HEADER_SIZE + page_size
+    end = offset
+    while offset + frame_size <= len(data):
+        pgno, commit, salt1, salt2 = struct.unpack_from('>4I', data, offset)
+        if (salt1, salt2) != salts:
+            break
+        offset += frame_size
+        if commit:
+            end = offset
+    return end
+
+class WalArchiver:
+    """Copy the WAL frames of ``database`` into segments in ``directory``.
+
+    The position reached is kept in ``state.json``, so a new archiver goes
+    on where the last one stopped.
+    """
+    def __init__(self, database, directory, busy_timeout=5000):
+        self.database = Path(database)
+        self.wal = Path(f'{database}-wal')
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.directory / 'state.json'
+        self.state = {'salts': None, 'offset': WAL_HEADER_SIZE}
+        if self.state_path.exists():
+            self.state = json.loads(self.state_path.read_text())
+        self.writer = sqlite3.connect(
+            database, isolation_level=None, timeout=busy_timeout / 1000)
+        if journal_mode(self.writer) != 'wal':
+            self.writer.close()
+            raise BackupError(f'{database} is not in WAL mode')
+        self.reader = sqlite3.connect(database, isolation_level=None)
+
+    def archive(self):
+        """Copy the frames committed since the last call.
+
+        Returns how many bytes of frames were archived.
+        """
+        self.writer.execute('BEGIN IMMEDIATE')
+        try:
+            frames = self.read_frames()
+            # A snapshot at the end of what was read keeps those frames
+            # and the following ones from being overwritten
+            if self.reader.in_transaction:
+                self.reader.execute('ROLLBACK')
+            self.reader.execute('BEGIN')
+            self.reader.execute(
+                'SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        finally:
+            self.writer.execute('ROLLBACK')
+        if frames is None:
+            return 0
+        return self.write_segment(*frames)
+
+    def read_frames(self):
+        """The WAL header, its salts, the offset reached and the frames
+        committed from there, or None without a WAL.
+        """
+        try:
+            with open(self.wal, 'rb') as wal:
+                header = wal.read(WAL_HEADER_SIZE)
+                if len(header) < WAL_HEADER_SIZE:
+                    return None
+                page_size, salts = read_wal_header(header)
+                offset = self.state['offset']
+                if list(salts) != self.state['salts']:
+                    # The WAL restarted, every frame of the old one was
+                    # copied before
+                    offset = WAL_HEADER_SIZE
+                wal.seek(offset)
+                data = wal.read()
+        except FileNotFoundError:
+            return None
+        end = committed_frames(data, 0, page_size, salts)
+        return header, salts, offset, data[:end]
+
+    def write_segment(self, header, salts, offset, frames):
+        if frames:
+            segment = self.directory / f'{time.time_ns()}.wal.gz'
+            with gzip.open(segment, 'wb') as output:
+                output.write(header)
+                output.write(frames)
+                output.flush()
+                os.fsync(output.fileno())
+        self.state = {'salts': list(salts), 'offset': offset + len(frames)}
+        self.state_path.write_text(json.dumps(self.state))
+        return len(frames)
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+def segments(directory, since=None, until=None):
+    """Segment files of ``directory`` written between the given times."""
+    found = []
+    for path in Path(directory).glob('*.wal.gz'):
+        written_at = int(path.name.split('.')[0])
+        if since is not None and written_at < since:
+            continue
+        if until is not None and written_at > until:
+            continue
+        found.append((written_at, path))
+    return [path for written_at, path in sorted(found)]
+
+def replay_segment(database, segment):
+    with gzip.open(segment, 'rb') as wal:
+        data = wal.read()
+    page_size, salts = read_wal_header(data)
+    frame_size = FRAME_HEADER_SIZE + page_size
+    with open(database, 'r+b') as output:
+        for offset in range(WAL_HEADER_SIZE, len(data), frame_size):
+            pgno, commit = struct.unpack_from('>2I', data, offset)
+            output.seek((pgno - 1) * page_size)
+            output.write(data[
+                offset + FRAME_HEADER_SIZE:offset + frame_size])
+            if commit:
+                output.truncate(commit * page_size)
+
+def restore_database(backup, target, wal_directory=None, until=None):
+    """Restore ``backup`` to ``target``, then replay the archived WAL.
+
+    ``until`` is an aware datetime, the segments written after it are left
+    out. Returns how many segments were replayed.
+    """
+    target = Path(target)
+    if target.exists():
+        raise BackupError(f'{target} already exists')
+    shutil.copyfile(backup, target)
+    replayed = []
+    if wal_directory:
+        replayed = segments(
+            wal_directory,
+            since=backup_started_at(backup),
+            until=until and int(until.timestamp() * 1e9)
+        )
+        for segment in replayed:
+            replay_segment(target, segment)
+        with closing(sqlite3.connect(target, isolation_level=None)) as db:
+            db.execute('PRAGMA journal_mode = DELETE').fetchall()
+    return len(replayed)
+
+def verify_database(path):
+    """Integrity problems of the database ``path`` and its table sizes."""
+    uri = f'{Path(path).resolve().as_uri()}?mode=ro'
+    with closing(sqlite3.connect(uri, uri=True)) as db:
+        try:
+            problems = [
+                row[0] for row in db.execute('PRAGMA integrity_check')
+                if row[0] != 'ok'
+            ]
+            problems.extend(
+                f'{table} row {rowid} references a missing {parent}'
+                for table, rowid, parent, fkid in db.execute(
+                    'PRAGMA foreign_key_check')
+            )
+            tables = [row[0] for row in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+                " AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+            counts = {
+                table: db.execute(
+                    f'SELECT count(*) FROM "{table}"').fetchone()[0]
+                for table in tables
+            }
+        except sqlite3.DatabaseError as error:
+            return [str(error)], {}
+    return problems, counts
+
+def backup_name(alias, now=None):
+    now = now or datetime.now(timezone.utc)
+    return f'{alias}-{now:%Y%m%dT%H%M%SZ}.sqlite3'
@@ -0,0 +1,849 @@
+"""
+Load benchmark of the API.
+
+``Seeder`` fills the database with generated users and their finances
+through ``bulk_create``. ``run`` then sends requests to every route of
+``apiurlpatterns`` from threads of this process, at each concurrency level,
+and reports throughput and latency percentiles per endpoint.
+"""
+
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, time as dtime, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import Client
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from personal_finances.api_server.authentication import (is_token_expired,
+    rotate_token)
+from personal_finances.api_server.models import (Account, Category,
+    CreditCard, CreditCardExpense, CreditCardInvoice, Subcategory,
+    Transaction, Transference, UserExtras)
+from personal_finances.api_server.sharding import (chunked, shard_for_user,
+    use_shard, user_atomic)
+from personal_finances.api_server.throttling import PremiumUserRateThrottle
+from personal_finances.api_server.urls import apiurlpatterns
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_ADMIN = 'bench_admin'
+BENCH_PASSWORD = 'bench-password'
+API_PREFIX = '/v1/'
+
+# Users seeded inside one transaction, bounds the memory used by the seeder
+USERS_PER_CHUNK = 50
+
+CATEGORY_NAMES = {
+    Category.INCOME: ['Salary', 'Freelance', 'Investments', 'Gifts'],
+    Category.EXPENSE: [
+        'Groceries', 'Rent', 'Transport', 'Health', 'Leisure', 'Education',
+        'Utilities', 'Restaurants', 'Clothing', 'Travel'
+    ],
+}
+ACCOUNT_NAMES = ['Checking', 'Savings', 'Wallet', 'Investments', 'Business']
+CARD_LABELS = ['visa', 'mastercard', 'elo', 'amex']
+
+class Seeder:
+    """Generate users with accounts, transactions, cards and transferences.
+
+    Values follow log-normal distributions, incomes are fewer and larger
+    than expenses, dates spread over the last ``months`` with a few
+    scheduled in the future, and account balances match the executed
+    transactions.
+    """
+    def __init__(self, accounts=3, transactions=100, cards=1, categories=8,
+            months=12, batch_size=1000, seed=None):
+        self.accounts = accounts
+        self.transactions = transactions
+        self.cards = cards
+        self.categories = categories
+        self.months = months
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+        self.counts = Counter()
+
+    def seed(self, users):
+        existing = set(User.objects.filter(
+            username__startswith=BENCH_USER_PREFIX
+        ).values_list('username', flat=True))
+        usernames = itertools.islice(
+            (
+                f'{BENCH_USER_PREFIX}{number}'
+                for number in itertools.count()
+                if f'{BENCH_USER_PREFIX}{number}' not in existing
+            ),
+            users
+        )
+        password = make_password(BENCH_PASSWORD)
+        created = self.create(User, [
+            User(username=username, password=password)
+            for username in usernames
+        ])
+        self.create(Token, [
+            Token(key=Token.generate_key(), user=user) for user in created])
+        self.create(UserExtras, [UserExtras(user=user) for user in created])
+        if not User.objects.filter(username=BENCH_ADMIN).exists():
+            User.objects.create_user(
+                username=BENCH_ADMIN,
+                password=BENCH_PASSWORD,
+                is_staff=True
+            )
+        by_shard = defaultdict(list)
+        for user in created:
+            by_shard[shard_for_user(user.id)].append(user)
+        for alias, shard_users in by_shard.items():
+            with use_shard(alias):
+                for chunk in chunked(shard_users, USERS_PER_CHUNK):
+                    with user_atomic():
+                        self.seed_users(chunk)
+        return created
+
+    def create(self, model, objs):
+        self.counts[model.__name__] += len(objs)
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def seed_users(self, users):
+        categories = self.seed_categories(users)
+        accounts = self.create(Account, [
+            Account(
+                user=user,
+                name=ACCOUNT_NAMES[number % len(ACCOUNT_NAMES)],
+                initial_value=self.amount(7, 1)
+            )
+            for user in users
+            for number in range(self.accounts)
+        ])
+        user_accounts = defaultdict(list)
+        for account in accounts:
+            user_accounts[account.user_id].append(account)
+        cards = self.create(CreditCard, [
+            CreditCard(
+                account=self.rng.choice(user_accounts[user.id]),
+                name=f'Card {number + 1}',
+                label=self.rng.choice(CARD_LABELS),
+                due_day=self.rng.randint(1, 28),
+                invoice_day=self.rng.randint(1, 28),
+                limit=self.rng.choice([1000, 2000, 5000, 10000, 20000])
+            )
+            for user in users
+            for number in range(self.cards)
+        ])
+        transactions = []
+        transfers = []
+        for user in users:
+            for account in user_accounts[user.id]:
+                transactions.extend(
+                    self.random_transaction(account, categories[user.id])
+                    for _ in range(self.transactions)
+                )
+            if len(user_accounts[user.id]) < 2:
+                continue
+            for _ in range(self.accounts * self.transactions // 20):
+                transfers.append(self.random_transfer(user_accounts[user.id]))
+        invoices = [
+            self.random_invoice(card, month, categories[card.account.user_id])
+            for card in cards
+            for month in range(self.months)
+        ]
+        transactions.extend(itertools.chain.from_iterable(transfers))
+        transactions.extend(invoice.expense for invoice, expenses in invoices)
+        self.create(Transaction, transactions)
+        self.create(Transference, [
+            Transference(from_transaction=from_t, to_transaction=to_t)
+            for from_t, to_t in transfers
+        ])
+        self.create(
+            CreditCardInvoice, [invoice for invoice, expenses in invoices])
+        self.create(CreditCardExpense, [
+            CreditCardExpense(invoice=invoice, **expense)
+            for invoice, expenses in invoices
+            for expense in expenses
+        ])
+        CreditCard.objects.filter(
+            id__in=[card.id for card in cards]).reconcile_used_limit()
+        self.update_balances(accounts, transactions)
+
+    def seed_categories(self, users):
+        income_count = max(1, self.categories // 4)
+        categories = self.create(Category, [
+            Category(
+                user=user,
+                of_type=of_type,
+                name=CATEGORY_NAMES[of_type][
+                    number % len(CATEGORY_NAMES[of_type])]
+            )
+            for user in users
+            for number, of_type in enumerate(
+                [Category.INCOME] * income_count
+                + [Category.EXPENSE] * (self.categories - income_count)
+            )
+        ])
+        subcategories = self.create(Subcategory, [
+            Subcategory(category=category, name=f'{category.name} {number}')
+            for category in categories
+            if category.of_type == Category.EXPENSE
+            for number in range(self.rng.randint(0, 3))
+        ])
+        by_category = defaultdict(list)
+        for subcategory in subcategories:
+            by_category[subcategory.category_id].append(subcategory)
+        by_user = defaultdict(lambda: defaultdict(list))
+        for category in categories:
+            by_user[category.user_id][category.of_type].append(
+                (category, by_category[category.id]))
+        return by_user
+
+    def amount(self, mu, sigma):
+        value = min(max(self.rng.lognormvariate(mu, sigma), 0.01), 99999)
+        return Decimal(f'{value:.2f}')
+
+    def random_datetime(self):
+        days = self.months * 30
+        return self.now + timedelta(
+            days=self.rng.uniform(-days, days * 0.05))
+
+    def random_category(self, categories, of_type):
+        if not categories[of_type] or self.rng.random() < 0.1:
+            return None, None
+        category, subcategories = self.rng.choice(categories[of_type])
+        if subcategories and self.rng.random() < 0.5:
+            return category, self.rng.choice(subcategories)
+        return category, None
+
+    def random_transaction(self, account, categories):
+        if self.rng.random() < 0.2:
+            of_type, value = Transaction.INCOME, self.amount(7.5, 0.5)
+        else:
+            of_type, value = Transaction.EXPENSE, self.amount(3.5, 1)
+        category, subcategory = self.random_category(categories, of_type)
+        date_time = self.random_datetime()
+        repeat = self.rng.choices(
+            [Transaction.ONE_TIME, Transaction.MONTHLY, Transaction.DIVIDED],
+            weights=[85, 10, 5]
+        )[0]
+        total_parts = part_number = None
+        if repeat == Transaction.DIVIDED:
+            total_parts = self.rng.randint(2, 12)
+            part_number = self.rng.randint(1, total_parts)
+        return Transaction(
+            account=account,
+            name=(subcategory or category or account).name[:30],
+            date_time=date_time,
+            value=value,
+            type=of_type,
+            status=self.status_at(date_time),
+            repeat=repeat,
+            total_parts=total_parts,
+            part_number=part_number,
+            category=category,
+            subcategory=subcategory
+        )
+
+    def random_transfer(self, accounts):
+        from_account, to_account = self.rng.sample(accounts, 2)
+        value = self.amount(5, 1)
+        date_time = self.random_datetime()
+        return tuple(
+            Transaction(
+                account=account,
+                name=f'Transfer to {to_account.name}',
+                date_time=date_time,
+                value=value,
+                type=of_type,
+                status=self.status_at(date_time),
+                is_transference=True
+            )
+            for account, of_type in (
+                (from_account, Transaction.EXPENSE),
+                (to_account, Transaction.INCOME)
+            )
+        )
+
+    def random_invoice(self, card, month, categories):
+        """Invoice of ``month`` months ago with its expenses, not saved."""
+        cycle, period_begin, period_end, due_at = card.invoice_period(
+            timezone.localdate(self.now) - relativedelta(months=month))
+        begin_at = timezone.make_aware(datetime.combine(period_begin, dtime()))
+        seconds = (period_end - period_begin).days * 86400 + 86399
+        expenses = []
+        for _ in range(self.rng.randint(2, 12)):
+            category, subcategory = self.random_category(
+                categories, Category.EXPENSE)
+            expenses.append({
+                'name': (category or card).name[:30],
+                'date_time': min(
+                    begin_at + timedelta(
+                        seconds=self.rng.uniform(0, seconds)),
+                    self.now
+                ),
+                'value': self.amount(3.5, 1),
+                'category': category,
+                'subcategory': subcategory,
+            })
+        expense = Transaction(
+            account=card.account,
+            name=f'{card.name} invoice',
+            date_time=due_at,
+            value=sum(item['value'] for item in expenses),
+            type=Transaction.EXPENSE,
+            status=self.status_at(due_at),
+            repeat=Transaction.ONE_TIME
+        )
+        invoice = CreditCardInvoice(
+            credit_card=card,
+            expense=expense,
+            period_begin=period_begin,
+            period_end=period_end,
+            cycle=cycle
+        )
+        return invoice, expenses
+
+    def status_at(self, date_time):
+        if date_time > self.now:
+            return Transaction.PENDING
+        return Transaction.EXECUTED
+
+    def update_balances(self, accounts, transactions):
+        for account in accounts:
+            account.balance = account.initial_value
+        for transaction in transactions:
+            if transaction.status != Transaction.EXECUTED:
+                continue
+            if transaction.type == Transaction.INCOME:
+                transaction.account.balance += transaction.value
+            else:
+                transaction.account.balance -= transaction.value
+        Account.objects.bulk_update(
+            accounts, ['balance'], batch_size=self.batch_size)
+
+class BenchUser:
+    """Ids a seeded user owns, used to build the benchmark requests."""
+    def __init__(self, user, admin_token, rng):
+        self.user = user
+        self.token = bench_token(user)
+        self.admin_token = admin_token
+        self.rng = rng
+        self.shard = shard_for_user(user.id)
+        with use_shard(self.shard):
+            self.accounts = list(Account.objects.filter(
+                user=user).values_list('id', flat=True))
+            self.categories = list(Category.objects.filter(
+                user=user).values_list('id', 'of_type'))
+            self.subcategories = list(Subcategory.objects.filter(
+                category__user=user).values_list('id', flat=True))
+            self.transactions = list(Transaction.objects.filter(
+                account__user=user, is_transference=False
+            ).values_list('id', flat=True)[:500])
+            self.cards = list(CreditCard.objects.filter(
+                account__user=user).values_list('id', flat=True))
+            self.expenses = list(CreditCardExpense.objects.filter(
+                invoice__credit_card__account__user=user
+            ).values_list('invoice__credit_card_id', 'id')[:500])
+            self.invoices = list(CreditCardInvoice.objects.filter(
+                credit_card__account__user=user
+            ).values_list('credit_card_id', 'id'))
+
+    def choice(self, ids):
+        return self.rng.choice(ids)
+
+    def category(self, of_type=None):
+        return self.choice([
+            category for category, category_type in self.categories
+            if of_type in (None, category_type)
+        ])
+
+SCENARIOS = []
+
+# Routes left out of the benchmark, they invalidate the token being used
+SKIPPED_ROUTES = {
+    'delete-token/': 'deletes the token of the benchmark user',
+    'rotate-token/': 'replaces the token of the benchmark user',
+    'change-password/': 'deletes the token of the benchmark user',
+}
+
+def scenario(route, method, admin=False):
+    """Register a request builder for a route of ``apiurlpatterns``.
+
+    The builder receives a ``BenchUser`` and returns the path, relative to
+    the API prefix, and the JSON body of one request. Builders run before
+    the timed part, so they may create the rows a request consumes.
+    """
+    def register(build):
+        SCENARIOS.append((route, method, admin, build))
+        return build
+    return register
+
+@scenario('', 'get')
+def home(user):
+    return '', None
+
+@scenario('login/', 'post')
+def login(user):
+    return 'login/', {
+        'username': user.user.username, 'password': BENCH_PASSWORD}
+
+@scenario('account/', 'get')
+def account_list(user):
+    return 'account/', None
+
+@scenario('account/', 'post')
+def account_create(user):
+    return 'account/', {'name': 'Benchmark', 'initial_value': '100.00'}
+
+@scenario('account/<int:id>/', 'get')
+def account_detail(user):
+    return f'account/{user.choice(user.accounts)}/', None
+
+@scenario('account/<int:id>/', 'patch')
+def account_update(user):
+    return f'account/{user.choice(user.accounts)}/', {'name': 'Renamed'}
+
+@scenario('account/<int:id>/', 'delete')
+def account_delete(user):
+    with use_shard(user.shard):
+        account = Account.objects.create(user=user.user, name='Benchmark')
+    return f'account/{account.id}/', None
+
+@scenario('category/', 'get')
+def category_list(user):
+    return 'category/', None
+
+@scenario('category/tree/', 'get')
+def category_tree(user):
+    return 'category/tree/', None
+
+@scenario('category/', 'post')
+def category_create(user):
+    return 'category/', {'name': 'Benchmark', 'of_type': Category.EXPENSE}
+
+@scenario('category/<int:id>/', 'get')
+def category_detail(user):
+    return f'category/{user.category()}/', None
+
+@scenario('category/<int:id>/', 'patch')
+def category_update(user):
+    return f'category/{user.category()}/', {'name': 'Renamed'}
+
+@scenario('category/<int:id>/', 'delete')
+def category_delete(user):
+    with use_shard(user.shard):
+        category = Category.objects.create(
+            user=user.user, name='Benchmark', of_type=Category.EXPENSE)
+    return f'category/{category.id}/', None
+
+@scenario('subcategory/', 'get')
+def subcategory_list(user):
+    return 'subcategory/', None
+
+@scenario('subcategory/', 'post')
+def subcategory_create(user):
+    return 'subcategory/', {
+        'name': 'Benchmark', 'category': user.category(Category.EXPENSE)}
+
+@scenario('subcategory/<int:id>/', 'get')
+def subcategory_detail(user):
+    return f'subcategory/{user.choice(user.subcategories)}/', None
+
+@scenario('subcategory/<int:id>/', 'patch')
+def subcategory_update(user):
+    return (
+        f'subcategory/{user.choice(user.subcategories)}/',
+        {'name': 'Renamed'}
+    )
+
+@scenario('subcategory/<int:id>/', 'delete')
+def subcategory_delete(user):
+    with use_shard(user.shard):
+        subcategory = Subcategory.objects.create(
+            name='Benchmark', category_id=user.category(Category.EXPENSE))
+    return f'subcategory/{subcategory.id}/', None
+
+@scenario('transaction/', 'get')
+def transaction_list(user):
+    return 'transaction/', None
+
+@scenario('transaction/', 'post')
+def transaction_create(user):
+    return 'transaction/', {
+        'account': user.choice(user.accounts),
+        'name': 'Benchmark',
+        'value': '10.00',
+        'type': Transaction.EXPENSE,
+    }
+
+@scenario('transaction/<int:id>/', 'get')
+def transaction_detail(user):
+    return f'transaction/{user.choice(user.transactions)}/', None
+
+@scenario('transaction/<int:id>/', 'patch')
+def transaction_update(user):
+    return (
+        f'transaction/{user.choice(user.transactions)}/',
+        {'name': 'Renamed'}
+    )
+
+@scenario('transaction/<int:id>/', 'delete')
+def transaction_delete(user):
+    with use_shard(user.shard):
+        transaction = Transaction.objects.create(
+            account_id=user.choice(user.accounts),
+            name='Benchmark',
+            value=Decimal('10.00'),
+            type=Transaction.EXPENSE,
+            status=Transaction.PENDING
+        )
+    return f'transaction/{transaction.id}/', None
+
+@scenario('credit-card/', 'get')
+def credit_card_list(user):
+    return 'credit-card/', None
+
+@scenario('credit-card/', 'post')
+def credit_card_create(user):
+    return 'credit-card/', {
+        'account': user.choice(user.accounts),
+        'name': 'Benchmark',
+        'label': 'visa',
+        'due_day': 10,
+        'invoice_day': 1,
+        'limit': 1000,
+    }
+
+@scenario('credit-card/<int:id>/', 'get')
+def credit_card_detail(user):
+    return f'credit-card/{user.choice(user.cards)}/', None
+
+@scenario('credit-card/<int:id>/', 'patch')
+def credit_card_update(user):
+    return f'credit-card/{user.choice(user.cards)}/', {'label': 'visa'}
+
+@scenario('credit-card/<int:id>/', 'delete')
+def credit_card_delete(user):
+    with use_shard(user.shard):
+        card = CreditCard.objects.create(
+            account_id=user.choice(user.accounts),
+            name='Benchmark',
+            label='visa',
+            due_day=10,
+            invoice_day=1,
+            limit=1000
+        )
+    return f'credit-card/{card.id}/', None
+
+@scenario('credit-card/<int:credit_card_id>/expense/', 'get')
+def credit_card_expense_list(user):
+    return f'credit-card/{user.choice(user.cards)}/expense/', None
+
+@scenario('credit-card/<int:credit_card_id>/expense/', 'post')
+def credit_card_expense_create(user):
+    return f'credit-card/{user.choice(user.cards)}/expense/', {
+        'name': 'Benchmark',
+        'value': '10.00',
+        'date_time': timezone.now().isoformat(),
+    }
+
+@scenario('credit-card/<int:credit_card_id>/expense/<int:id>/', 'get')
+def credit_card_expense_detail(user):
+    card_id, expense_id = user.choice(user.expenses)
+    return f'credit-card/{card_id}/expense/{expense_id}/', None
+
+@scenario('credit-card/<int:credit_card_id>/expense/<int:id>/', 'patch')
+def credit_card_expense_update(user):
+    card_id, expense_id = user.choice(user.expenses)
+    return (
+        f'credit-card/{card_id}/expense/{expense_id}/',
+        {'name': 'Renamed'}
+    )
+
+@scenario('credit-card/<int:credit_card_id>/expense/<int:id>/', 'delete')
+def credit_card_expense_delete(user):
+    card_id, invoice_id = user.choice(user.invoices)
+    with use_shard(user.shard):
+        with user_atomic():
+            invoice = CreditCardInvoice.objects.get(id=invoice_id)
+            Transaction.objects.filter(id=invoice.expense_id).update(
+                value=F('value') + Decimal('10.00'))
+            expense = CreditCardExpense.objects.create(
+                invoice=invoice,
+                name='Benchmark',
+                date_time=timezone.now(),
+                value=Decimal('10.00')
+            )
+    return f'credit-card/{card_id}/expense/{expense.id}/', None
+
+@scenario('credit-card/<int:credit_card_id>/invoice/', 'get')
+def credit_card_invoice_list(user):
+    return f'credit-card/{user.choice(user.cards)}/invoice/', None
+
+@scenario('credit-card/<int:credit_card_id>/invoice/<int:id>/', 'get')
+def credit_card_invoice_detail(user):
+    card_id, invoice_id = user.choice(user.invoices)
+    return f'credit-card/{card_id}/invoice/{invoice_id}/', None
+
+@scenario('transference/', 'get')
+def transference_list(user):
+    return 'transference/', None
+
+@scenario('transference/', 'post')
+def transference_create(user):
+    if len(user.accounts) > 1:
+        from_account, to_account = user.rng.sample(user.accounts, 2)
+    else:
+        from_account = to_account = user.choice(user.accounts)
+    return 'transference/', {
+        'name': 'Benchmark',
+        'from_account': from_account,
+        'to_account': to_account,
+        'value': '0.01',
+        'date_time': timezone.now().isoformat(),
+        'executed': False,
+    }
+
+@scenario('transference/bulk/', 'post')
+def transference_bulk_create(user):
+    return 'transference/bulk/', [
+        transference_create(user)[1] for _ in range(10)]
+
+@scenario('total-balance/', 'get')
+def total_balance(user):
+    return 'total-balance/', None
+
+@scenario('dashboard/', 'get')
+def dashboard(user):
+    return 'dashboard/', None
+
+@scenario('export/', 'get')
+def export(user):
+    return 'export/', None
+
+@scenario('batch/', 'post')
+def batch(user):
+    return 'batch/', [
+        {'path': 'transaction/?page=1'},
+        {'path': 'transaction/?page=2'},
+        {'path': f'credit-card/{user.choice(user.cards)}/expense/'},
+    ]
+
+@scenario('metrics/', 'get', admin=True)
+def metrics(user):
+    return 'metrics/', None
+
+@scenario('user-extras/', 'post', admin=True)
+def user_extras_create(user):
+    extra_user = User.objects.create_user(
+        username=f'bench_extras_{user.rng.getrandbits(64):x}')
+    return 'user-extras/', {'user': extra_user.id, 'type': UserExtras.PREMIUM}
+
+@scenario('user-extras/user/<int:user_id>/', 'patch', admin=True)
+def user_extras_update(user):
+    return (
+        f'user-extras/user/{user.user.id}/',
+        {'type': UserExtras.STARNDARD}
+    )
+
+@scenario('async/account/', 'get')
+def async_account_list(user):
+    return 'async/account/', None
+
+@scenario('async/category/', 'get')
+def async_category_list(user):
+    return 'async/category/', None
+
+@scenario('async/transaction/', 'get')
+def async_transaction_list(user):
+    return 'async/transaction/', None
+
+@scenario('async/total-balance/', 'get')
+def async_total_balance(user):
+    return 'async/total-balance/', None
+
+@scenario('^user/$', 'get', admin=True)
+def user_list(user):
+    return 'user/', None
+
+@scenario('^user/$', 'post', admin=True)
+def user_create(user):
+    return 'user/', {
+        'username': f'bench_created_{user.rng.getrandbits(64):x}',
+        'password': BENCH_PASSWORD,
+    }
+
+@scenario('^user/(?P<pk>[^/.]+)/$', 'get')
+def user_detail(user):
+    return f'user/{user.user.id}/', None
+
+@scenario('^user/(?P<pk>[^/.]+)/$', 'patch')
+def user_update(user):
+    return f'user/{user.user.id}/', {'first_name': 'Bench'}
+
+@scenario('^user/(?P<pk>[^/.]+)/$', 'delete', admin=True)
+def user_delete(user):
+    created = User.objects.create_user(
+        username=f'bench_deleted_{user.rng.getrandbits(64):x}')
+    return f'user/{created.id}/', None
+
+def routes():
+    return [str(pattern.pattern) for pattern in apiurlpatterns]
+
+def uncovered_routes():
+    covered = {route for route, method, admin, build in SCENARIOS}
+    return [
+        route for route in routes()
+        if route not in covered and route not in SKIPPED_ROUTES
+    ]
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return 0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+def load_bench_users(rng):
+    admin = User.objects.filter(username=BENCH_ADMIN).first()
+    users = User.objects.filter(
+        username__startswith=BENCH_USER_PREFIX).order_by('id')
+    if admin is None or not users.exists():
+        return []
+    admin_token = bench_token(admin)
+    return [BenchUser(user, admin_token, rng) for user in users]
+
+def bench_token(user):
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and is_token_expired(token):
+        token = rotate_token(user)
+    return token.key
+
+def run_scenario(scenario, bench_users, concurrency, requests):
+    """Send ``requests`` requests of a scenario from ``concurrency`` threads."""
+    route, method, admin, build = scenario
+    prepared = []
+    for number in range(requests):
+        user = bench_users[number % len(bench_users)]
+        path, data = build(user)
+        prepared.append((
+            API_PREFIX + path,
+            json.dumps(data) if data is not None else '',
+            user.admin_token if admin else user.token
+        ))
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def worker(items):
+        client = Client(raise_request_exception=False)
+        for path, body, token in items:
+            started = time.perf_counter()
+            response = client.generic(
+                method.upper(),
+                path,
+                body,
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Token {token}'
+            )
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code < 400:
+                    latencies.append(elapsed)
+                else:
+                    errors[response.status_code] += 1
+
+    threads = [
+        threading.Thread(target=worker, args=(prepared[index::concurrency],))
+        for index in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': dict(errors),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+def run(concurrency_levels, requests, only=None, seed=None, log=None):
+    """Benchmark every scenario at every concurrency level.
+
+    Throttle rates are lifted for the run so they do not cap the
+    measurement, the throttling code itself still runs on every request.
+    Failed requests are counted by status code instead of logged.
+    """
+    rng = random.Random(seed)
+    bench_users = load_bench_users(rng)
+    if not bench_users:
+        raise ValueError('no benchmark users, run seed_benchmark first')
+    report = {
+        'meta': {
+            'started_at': timezone.now().isoformat(),
+            'concurrency': list(concurrency_levels),
+            'requests': requests,
+            'users': len(bench_users),
+        },
+        'results': {},
+        'skipped': dict(SKIPPED_ROUTES),
+        'uncovered': uncovered_routes(),
+    }
+    rates = PremiumUserRateThrottle.THROTTLE_RATES
+    PremiumUserRateThrottle.THROTTLE_RATES = {
+        scope: '1000000/s' for scope in rates}
+    request_logger = logging.getLogger('django.request')
+    log_level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        for scenario in SCENARIOS:
+            route, method, admin, build = scenario
+            name = f'{method.upper()} {route}'
+            if only and name not in only:
+                continue
+            report['results'][name] = {}
+            for concurrency in concurrency_levels:
+                try:
+                    result = run_scenario(
+                        scenario, bench_users, concurrency, requests)
+                except IndexError:
+                    # rng.choice() over ids the seeded data does not have
+                    del report['results'][name]
+                    report['skipped'][name] = 'no seeded rows to request'
+                    break
+                report['results'][name][str(concurrency)] = result
+                if log:
+                    log(name, concurrency, result)
+    finally:
+        PremiumUserRateThrottle.THROTTLE_RATES = rates
+        request_logger.setLevel(log_level)
+    return report
+
+def compare(previous, current):
+    """Yield one line per endpoint and level measured in both reports."""
+    for name, levels in current['results'].items():
+        for concurrency, result in levels.items():
+            before = previous['results'].get(name, {}).get(concurrency)
+            if before is None:
+                continue
+            change = (
+                result['throughput'] / before['throughput'] - 1
+                if before['throughput'] else 0
+            )
+            yield (
+                f'{name} @{concurrency}:'
+                f' {before["throughput"]:.1f} -> {result["throughput"]:.1f}'
+                f' req/s ({change:+.1%}),'
+                f' p95 {before["p95"] * 1000:.1f} ->'
+                f' {result["p95"] * 1000:.1f} ms'
+            )
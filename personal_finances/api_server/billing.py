@@ -0,0 +1,90 @@
+"""
+Closing and settlement of the credit card invoices.
+
+``close_invoices`` freezes the total of the open invoices whose period
+ended, ``settle_invoices`` pays the closed ones that are due: it executes
+their transactions and takes their totals from the account balances and
+the card used limits. Both work on one shard at a time in chunks, each
+chunk in its own short transaction, and select invoices by status, so an
+interrupted run resumes where it stopped.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as dbtnsac
+from django.db.models import (Case, DecimalField, F, OuterRef, Subquery,
+    Value, When)
+
+from personal_finances.api_server.dashboard import invalidate_dashboards
+from personal_finances.api_server.models import (Account, CreditCard,
+    CreditCardInvoice, Transaction)
+
+def add_by_id(queryset, field, amounts):
+    """Add ``amounts``, by primary key, to ``field`` with one UPDATE."""
+    amounts = {id: amount for id, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    queryset.filter(id__in=amounts).update(**{field: F(field) + Case(
+        *(When(id=id, then=Value(amount)) for id, amount in amounts.items()),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )})
+
+def close_invoices(alias, today, chunk_size=500):
+    """Close the open invoices of ``alias`` with periods ended by ``today``.
+
+    Yields how many invoices each chunk closed.
+    """
+    invoices = CreditCardInvoice.objects.using(alias).filter(
+        status=CreditCardInvoice.OPEN, period_end__lt=today)
+    while True:
+        with dbtnsac.atomic(using=alias):
+            rows = list(invoices.order_by('id').values_list(
+                'id', 'credit_card__account__user_id')[:chunk_size])
+            if not rows:
+                return
+            invoices.filter(id__in=[row[0] for row in rows]).update(
+                status=CreditCardInvoice.CLOSED,
+                closed_total=Subquery(Transaction.objects.filter(
+                    id=OuterRef('expense_id')).values('value'))
+            )
+        invalidate_dashboards(row[1] for row in rows)
+        yield len(rows)
+
+def settle_invoices(alias, now, chunk_size=500):
+    """Pay the closed invoices of ``alias`` due at ``now``.
+
+    Each chunk updates the balances of all its accounts and the used limits
+    of all its cards with one statement each. Invoices whose transaction
+    was already executed by hand are only marked paid. Yields how many
+    invoices each chunk paid.
+    """
+    invoices = CreditCardInvoice.objects.using(alias).filter(
+        status=CreditCardInvoice.CLOSED, expense__date_time__lte=now)
+    while True:
+        with dbtnsac.atomic(using=alias):
+            rows = list(invoices.order_by('id').values_list(
+                'id', 'credit_card_id', 'closed_total', 'expense_id',
+                'expense__status', 'expense__account_id',
+                'expense__account__user_id'
+            )[:chunk_size])
+            if not rows:
+                return
+            balances = defaultdict(Decimal)
+            used_limits = defaultdict(Decimal)
+            expenses = []
+            for (id, card_id, total, expense_id, status, account_id,
+                    user_id) in rows:
+                if status == Transaction.PENDING:
+                    expenses.append(expense_id)
+                    balances[account_id] -= total
+                    used_limits[card_id] -= total
+            Transaction.objects.using(alias).filter(id__in=expenses).update(
+                status=Transaction.EXECUTED)
+            add_by_id(Account.objects.using(alias), 'balance', balances)
+            add_by_id(
+                CreditCard.objects.using(alias), 'used_limit', used_limits)
+            invoices.filter(id__in=[row[0] for row in rows]).update(
+                status=CreditCardInvoice.PAID)
+        invalidate_dashboards(row[6] for row in rows)
+        yield len(rows)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+
+class LRUCache:
+    """Bounded per-process cache with least recently used eviction.
+
+    Entries expire ``ttl`` seconds after being set. Access is guarded by a
+    lock so one instance can be shared by the threads of a worker.
+    """
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at <= self.timer():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (value, self.timer() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+def get_shared_cache(alias):
+    """Cache ``alias``, refused when it lives in the memory of a process.
+    """
+    cache = caches[alias]
+    if isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured(
+            f'cache {alias} must be shared by the workers, not in memory')
+    return cache
+
+
+user_tier_cache = LRUCache(
+    maxsize=settings.THROTTLE_TIER_CACHE_SIZE,
+    ttl=settings.THROTTLE_TIER_CACHE_TTL
+)
+
+token_cache = LRUCache(
+    maxsize=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL
+)
+
+user_shard_cache = LRUCache(
+    maxsize=settings.USER_SHARD_CACHE_SIZE,
+    ttl=settings.USER_SHARD_CACHE_TTL
+)
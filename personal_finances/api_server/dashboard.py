@@ -0,0 +1,113 @@
+"""
+Dashboard of a user, what the app shows at launch in one response.
+
+Each section is one query. With ``DASHBOARD_WORKERS`` set the sections run
+on a thread pool, every thread with its own database connection; SQLite
+only reads concurrently with the WAL journal of the production profile.
+Dashboards are cached per user for ``DASHBOARD_CACHE_TTL`` seconds in the
+shared ``DASHBOARD_CACHE``. They are dropped by ``DashboardCacheMiddleware``
+when the user writes and by the batch jobs writing their rows.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from personal_finances.api_server.cache import get_shared_cache
+from personal_finances.api_server.models import (Account, Category,
+    CreditCard, Transaction)
+from personal_finances.api_server.pagination import PageNumberCustomPagination
+from personal_finances.serializers import (AccountStatsSerializer,
+    CategorySerializer, CreditCardSerializer, TransactionSerializer)
+
+UPCOMING_SIZE = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def dashboard_key(user_id):
+    return f'dashboard_{user_id}'
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DASHBOARD_WORKERS,
+                thread_name_prefix='dashboard'
+            )
+        return _executor
+
+def run_in_thread(query):
+    close_old_connections()
+    return list(query)
+
+def run_queries(queries):
+    """Evaluate ``queries``, a dict of querysets, into lists by name.
+
+    The shard and replica routing of the request is carried to the threads
+    through a copy of its context.
+    """
+    if not settings.DASHBOARD_WORKERS:
+        return {name: list(query) for name, query in queries.items()}
+    executor = get_executor()
+    futures = {
+        name: executor.submit(copy_context().run, run_in_thread, query)
+        for name, query in queries.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+def build_dashboard(user):
+    now = timezone.localtime()
+    month_begin = now.replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    transactions = Transaction.objects.filter(account__user=user)
+    results = run_queries({
+        'accounts': Account.objects.filter(user=user).with_stats(
+            month_begin, month_begin + relativedelta(months=1)),
+        'categories': Category.objects.filter(user=user),
+        'credit_cards': CreditCard.objects.filter(account__user=user),
+        'transactions': transactions[:PageNumberCustomPagination.page_size],
+        'upcoming': transactions.filter(
+            status=Transaction.PENDING, date_time__gte=now
+        ).order_by('date_time')[:UPCOMING_SIZE],
+    })
+    accounts = results['accounts']
+    return {
+        'message': 'Personal finances API.'
+            f' Welcome {user.get_full_name()}',
+        'total_balance': sum(account.balance for account in accounts),
+        'month_income': sum(account.period_income for account in accounts),
+        'month_expense': sum(
+            account.period_expense for account in accounts),
+        'accounts': AccountStatsSerializer(accounts, many=True).data,
+        'categories': CategorySerializer(
+            results['categories'], many=True).data,
+        'credit_cards': CreditCardSerializer(
+            results['credit_cards'], many=True).data,
+        'transactions': TransactionSerializer(
+            results['transactions'], many=True).data,
+        'upcoming': TransactionSerializer(
+            results['upcoming'], many=True).data,
+    }
+
+def get_dashboard(user):
+    cache = get_shared_cache(settings.DASHBOARD_CACHE)
+    dashboard = cache.get(dashboard_key(user.pk))
+    if dashboard is None:
+        dashboard = build_dashboard(user)
+        cache.set(
+            dashboard_key(user.pk), dashboard, settings.DASHBOARD_CACHE_TTL)
+    return dashboard
+
+def invalidate_dashboard(user_id):
+    get_shared_cache(settings.DASHBOARD_CACHE).delete(dashboard_key(user_id))
+
+def invalidate_dashboards(user_ids):
+    get_shared_cache(settings.DASHBOARD_CACHE).delete_many(
+        [dashboard_key(user_id) for user_id in set(user_ids)])
@@ -0,0 +1,69 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from personal_finances.api_server.sharding import (SHARDED_MODELS,
+    get_current_shard, is_sharded)
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Allow reads inside the block to be served by a read replica."""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+class ShardRouter:
+    """Send user data to the shard of the user being served.
+
+    Only active with more than one entry in ``DATABASE_SHARDS``. Objects
+    loaded from a shard keep using it for their related lookups.
+    """
+    sharded_models = {model for model, lookup in SHARDED_MODELS}
+
+    def db_for_read(self, model, **hints):
+        if model not in self.sharded_models or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if type(instance) in self.sharded_models and instance._state.db:
+            return instance._state.db
+        return get_current_shard()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not is_sharded():
+            return None
+        databases = {*settings.DATABASE_SHARDS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+class ReplicaRouter:
+    """Send writes to the primary and, when allowed, reads to a replica.
+
+    Reads only go to one of ``DATABASE_REPLICAS`` inside ``replica_reads``,
+    which ``ReplicaRoutingMiddleware`` opens for safe-method requests, and
+    never while the primary is inside an atomic block.
+    """
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,114 @@
+"""
+Deletion of accounts and users in the background.
+
+Deleting an account with a long history through the CASCADE collector
+loads every dependent row and deletes them all in one transaction. The
+API only marks what to delete instead: an account loses its user, which
+hides it and everything under it from the user lookups, and a user gets
+a ``UserDeletion`` and is deactivated. ``purge_deleted`` then removes the
+rows in dependency order, in chunks each in its own short transaction,
+so an interrupted run resumes where it stopped.
+"""
+
+from django.contrib.auth.models import User
+from django.db import transaction as dbtnsac
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from personal_finances.api_server.authentication import invalidate_token
+from personal_finances.api_server.dashboard import invalidate_dashboard
+from personal_finances.api_server.models import (Account, Category,
+    CreditCard, CreditCardExpense, CreditCardInvoice, Subcategory,
+    Transaction, TransactionArchive, Transference, UserDeletion)
+from personal_finances.api_server.sharding import shard_for_user
+
+# Rows under an account in dependency order with the lookup to it
+ACCOUNT_ROWS = (
+    (CreditCardExpense, 'invoice__credit_card__account'),
+    (CreditCardInvoice, 'credit_card__account'),
+    (CreditCard, 'account'),
+    # The leg in the other account is kept as a plain transaction, see
+    # delete_rows
+    (Transference, 'from_transaction__account'),
+    (Transference, 'to_transaction__account'),
+    (Transaction, 'account'),
+    (TransactionArchive, 'account'),
+    (Account, 'pk'),
+)
+
+# Rows of a user left once their accounts are gone
+USER_ROWS = (
+    (Subcategory, 'category__user'),
+    (Category, 'user'),
+)
+
+def mark_accounts_deleted(accounts):
+    """Hide ``accounts`` until they are purged. Returns how many."""
+    return accounts.update(user=None, deleted_at=timezone.now())
+
+def mark_user_deleted(user):
+    mark_accounts_deleted(Account._base_manager.using(
+        shard_for_user(user.pk)).filter(user=user.pk))
+    keys = list(Token.objects.filter(user=user).values_list(
+        'key', flat=True))
+    with dbtnsac.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        Token.objects.filter(user=user).delete()
+        UserDeletion.objects.get_or_create(user=user)
+    # Once deleted, a lookup racing the invalidation can not cache them
+    for key in keys:
+        invalidate_token(key)
+    invalidate_dashboard(user.pk)
+
+def delete_rows(model, alias, ids):
+    if model is Transference:
+        # Both legs lose the flag with the transference, the one in the
+        # deleted account goes next
+        Transaction._base_manager.using(alias).filter(
+            Q(transference_to__in=ids) | Q(transference_from__in=ids)
+        ).update(is_transference=False)
+    model._base_manager.using(alias).filter(pk__in=ids).delete()
+
+def delete_in_chunks(model, alias, chunk_size, **lookup):
+    """Delete the rows of ``model`` matching ``lookup`` on ``alias``.
+
+    Yields how many rows each chunk deleted.
+    """
+    rows = model._base_manager.using(alias).filter(**lookup)
+    while True:
+        with dbtnsac.atomic(using=alias):
+            ids = list(rows.order_by('pk').values_list(
+                'pk', flat=True)[:chunk_size])
+            if not ids:
+                return
+            delete_rows(model, alias, ids)
+        yield len(ids)
+
+def purge_account(account_id, alias, chunk_size=500):
+    for model, lookup in ACCOUNT_ROWS:
+        yield from delete_in_chunks(
+            model, alias, chunk_size, **{lookup: account_id})
+
+def purge_accounts(alias, chunk_size=500):
+    """Remove the accounts of ``alias`` marked deleted with their rows."""
+    deleted = Account._base_manager.using(alias).filter(
+        deleted_at__isnull=False).order_by('pk').values_list('pk', flat=True)
+    for account_id in list(deleted):
+        yield from purge_account(account_id, alias, chunk_size)
+
+def purge_users(chunk_size=500):
+    """Remove the users marked deleted with all their rows."""
+    for user_id in list(UserDeletion.objects.order_by(
+            'requested_at').values_list('user_id', flat=True)):
+        alias = shard_for_user(user_id)
+        # Transactions go before the categories they point to, which
+        # would otherwise be loaded to be set null
+        yield from purge_accounts(alias, chunk_size)
+        for model, lookup in USER_ROWS:
+            yield from delete_in_chunks(
+                model, alias, chunk_size, **{lookup: user_id})
+        with dbtnsac.atomic():
+            User.objects.filter(pk=user_id).delete()
+        invalidate_dashboard(user_id)
+        yield 1
@@ -0,0 +1,181 @@
+"""
+Export and import of all the data of a user.
+
+An export is a zip with one NDJSON file per model, rows in dependency
+order with their primary keys, and a ``manifest.json`` written last with
+the row counts. ``export_user`` yields it in pieces while it reads the
+rows with ``iterator()``, so neither side holds more than a chunk: the
+zip is written with data descriptors, which needs no seeking back.
+Archived transactions are exported as plain ones, without the categories
+deleted since they were archived.
+
+``import_user`` reads the same files back with ``bulk_create``, keeping
+the primary keys like ``move_user`` does. It refuses to overwrite rows or
+to leave references to missing ones.
+"""
+
+import io
+import json
+import zipfile
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError, connections
+from django.db import transaction as dbtnsac
+from django.utils import timezone
+
+from personal_finances.api_server.archive import (clear_missing_categories,
+    decode)
+from personal_finances.api_server.models import (Account, Category,
+    CreditCard, CreditCardExpense, CreditCardInvoice, Subcategory,
+    Transaction, TransactionArchive, Transference)
+from personal_finances.api_server.sharding import (chunked, shard_for_user,
+    user_rows)
+
+FORMAT_VERSION = 1
+
+# Exported models in dependency order with the lookup to their owner
+EXPORTED_MODELS = (
+    (Account, 'user'),
+    (Category, 'user'),
+    (Subcategory, 'category__user'),
+    (Transaction, 'account__user'),
+    (CreditCard, 'account__user'),
+    (CreditCardInvoice, 'credit_card__account__user'),
+    (CreditCardExpense, 'invoice__credit_card__account__user'),
+    (Transference, 'from_transaction__account__user'),
+)
+
+# Bytes gathered before a piece of the export is yielded
+PIECE_SIZE = 1 << 16
+
+class ImportConflict(Exception):
+    pass
+
+class StreamBuffer:
+    """Write only file gathering what ``ZipFile`` writes until drained."""
+    def __init__(self):
+        self.pieces = []
+        self.size = 0
+        self.position = 0
+
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        self.size += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.pieces)
+        self.pieces = []
+        self.size = 0
+        return data
+
+def encode_value(value):
+    # Unlike DjangoJSONEncoder, keeps the microseconds of datetimes
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def file_name(model):
+    return f'{model._meta.model_name}.ndjson'
+
+def columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+def export_rows(model, lookup, user_id, alias, chunk_size):
+    yield from user_rows(model, lookup, user_id, alias).order_by(
+        'pk').values(*columns(model)).iterator(chunk_size=chunk_size)
+    if model is Transaction:
+        archives = user_rows(
+            TransactionArchive, 'account__user', user_id, alias)
+        names = columns(Transaction)
+        for data, account_id in archives.order_by('pk').values_list(
+                'data', 'account_id').iterator(chunk_size=10):
+            transactions = decode(data, account_id)
+            clear_missing_categories(transactions, alias)
+            for transaction in transactions:
+                yield {name: getattr(transaction, name) for name in names}
+
+def export_user(user_id, alias=None, chunk_size=2000):
+    """Yield the zipped export of ``user_id`` in pieces."""
+    if alias is None:
+        alias = shard_for_user(user_id)
+    buffer = StreamBuffer()
+    counts = {}
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for model, lookup in EXPORTED_MODELS:
+            count = 0
+            with archive.open(
+                    file_name(model), 'w', force_zip64=True) as member:
+                for row in export_rows(
+                        model, lookup, user_id, alias, chunk_size):
+                    member.write(json.dumps(
+                        row, default=encode_value).encode() + b'\n')
+                    count += 1
+                    if buffer.size >= PIECE_SIZE:
+                        yield buffer.drain()
+            counts[file_name(model)] = count
+        archive.writestr('manifest.json', json.dumps({
+            'version': FORMAT_VERSION,
+            'user': user_id,
+            'exported_at': timezone.now(),
+            'counts': counts,
+        }, default=encode_value))
+    yield buffer.drain()
+
+def import_rows(archive, model, lookup, user_id, alias, chunk_size):
+    rows = model._base_manager.using(alias)
+    count = 0
+    with archive.open(file_name(model)) as member:
+        lines = io.TextIOWrapper(member, encoding='utf-8')
+        for chunk in chunked(lines, chunk_size):
+            objs = [model(**json.loads(line)) for line in chunk]
+            if lookup == 'user':
+                for obj in objs:
+                    obj.user_id = user_id
+            if rows.filter(pk__in=[o.pk for o in objs]).exists():
+                raise ImportConflict(
+                    f'{model.__name__} ids of the export already used on'
+                    f' {alias}')
+            rows.bulk_create(objs)
+            count += len(objs)
+    return count
+
+def import_user(file, user_id=None, chunk_size=2000):
+    """Insert the rows of an export, for ``user_id`` if given.
+
+    Everything is inserted in one transaction. Returns the row counts by
+    file.
+    """
+    counts = {}
+    with zipfile.ZipFile(file) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+        if manifest['version'] != FORMAT_VERSION:
+            raise ImportConflict(
+                f'export format {manifest["version"]} is not supported')
+        if user_id is None:
+            user_id = manifest['user']
+        alias = shard_for_user(user_id)
+        try:
+            with dbtnsac.atomic(using=alias):
+                for model, lookup in EXPORTED_MODELS:
+                    counts[file_name(model)] = import_rows(
+                        archive, model, lookup, user_id, alias, chunk_size)
+                # SQLite checks the foreign keys on commit, without naming
+                # the rows
+                connections[alias].check_constraints(table_names=[
+                    model._meta.db_table for model, lookup in EXPORTED_MODELS
+                ])
+        except IntegrityError as e:
+            raise ImportConflict(
+                f'the export references rows missing on {alias}: {e}')
+    return counts
@@ -0,0 +1,130 @@
+"""
+Per-request timing of the phases of the API.
+
+``TimingMiddleware`` starts a ``RequestTimings`` for the sampled requests.
+While one is active, ``timed`` blocks and the database execute wrapper add
+their durations to it: authentication, throttling, SQL queries,
+serialization and rendering. Outside of sampled requests they only cost a
+context variable lookup.
+"""
+
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger('personal_finances.performance')
+
+PHASES = ('auth', 'throttle', 'db', 'serialize', 'render')
+
+_current = ContextVar('request_timings', default=None)
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.queries = 0
+        self.active = set()
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        metrics = [
+            f'{phase};dur={self.phases[phase] * 1000:.2f}'
+            for phase in PHASES if phase in self.phases
+        ]
+        if self.queries:
+            metrics.append(f'queries;desc="{self.queries} queries"')
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+    def as_dict(self, total):
+        return {
+            **{
+                f'{phase}_ms': round(self.phases[phase] * 1000, 2)
+                for phase in PHASES
+            },
+            'queries': self.queries,
+            'total_ms': round(total * 1000, 2),
+        }
+
+def get_current_timings():
+    return _current.get()
+
+@contextmanager
+def measure_request():
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def timed(phase):
+    """Add the duration of the block to ``phase`` of the current request.
+
+    Nested blocks of the same phase count once.
+    """
+    timings = _current.get()
+    if timings is None or phase in timings.active:
+        yield
+        return
+    timings.active.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases[phase] += time.perf_counter() - started
+        timings.active.discard(phase)
+
+def query_timer(execute, sql, params, many, context):
+    """Database execute wrapper counting and timing the queries."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.phases['db'] += time.perf_counter() - started
+        timings.queries += 1
+
+def install_query_timer(connection, **kwargs):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+def install_query_timers():
+    """Time the queries of this thread's connections and of new ones."""
+    for alias in connections:
+        install_query_timer(connections[alias])
+
+connection_created.connect(install_query_timer)
+
+def log_request(request, response, timings, total):
+    match = getattr(request, 'resolver_match', None)
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'route': match.route if match else None,
+        'status': response.status_code,
+        **timings.as_dict(total),
+    }))
+
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,317 @@
+"""
+Prometheus metrics of the API.
+
+Metrics are kept in a ``MetricsRegistry`` and exposed in the Prometheus
+text format by the ``metrics/`` route. With ``METRICS_DIR`` set, every
+process writes its values to its own memory mapped file in that directory
+and the exposition sums the files, so one scrape covers all the workers
+of a gunicorn server. Without it values live in the memory of the process.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+from personal_finances.api_server.cache import (token_cache,
+    user_shard_cache, user_tier_cache)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class LocalStore:
+    """Metric values in the memory of this process."""
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+class MmapValues:
+    """Float values by key in a memory mapped file written by one process.
+
+    The file starts with the number of bytes in use. Each entry is the
+    length of its key, the key and the value as a double aligned to 8
+    bytes. The used size is written after an entry, so readers in other
+    processes never see a partial one.
+    """
+    initial_size = 1 << 16
+
+    def __init__(self, path):
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            size = self.initial_size
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = struct.unpack_from('i', self._map, 0)[0] or 8
+        self._positions = {
+            key: position for key, value, position in read_entries(
+                self._map, self._used)
+        }
+
+    def add(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        value = struct.unpack_from('d', self._map, position)[0]
+        struct.pack_into('d', self._map, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        key_end = self._used + 4 + len(encoded)
+        position = key_end + (-key_end % 8)
+        if position + 8 > len(self._map):
+            self._grow(position + 8)
+        struct.pack_into('i', self._map, self._used, len(encoded))
+        self._map[self._used + 4:key_end] = encoded
+        struct.pack_into('d', self._map, position, 0.0)
+        self._used = position + 8
+        struct.pack_into('i', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+def read_entries(data, used=None):
+    if used is None:
+        used = struct.unpack_from('i', data, 0)[0]
+    position = 8
+    while position < used:
+        length = struct.unpack_from('i', data, position)[0]
+        key_end = position + 4 + length
+        value_position = key_end + (-key_end % 8)
+        key = bytes(data[position + 4:key_end]).decode()
+        yield key, struct.unpack_from('d', data, value_position)[0], (
+            value_position)
+        position = value_position + 8
+
+class MmapStore:
+    """Metric values shared by the processes using the same directory."""
+    def __init__(self, directory, identifier=None):
+        self.directory = Path(directory)
+        self.identifier = identifier
+        self._values = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            if self._values is None or self._pid != os.getpid():
+                # First write, or first one after a fork
+                self._pid = os.getpid()
+                self._values = MmapValues(
+                    self.directory / f'{self.identifier or self._pid}.db')
+            self._values.add(key, amount)
+
+    def collect(self):
+        totals = defaultdict(float)
+        for path in self.directory.glob('*.db'):
+            data = path.read_bytes()
+            if len(data) < 8:
+                continue
+            for key, value, position in read_entries(data):
+                totals[key] += value
+        return dict(totals)
+
+class Metric:
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def key(self, suffix, labels):
+        if set(labels) - {'le'} != set(self.labelnames):
+            raise ValueError(
+                f'{self.name} takes the labels {self.labelnames}')
+        return json.dumps([self.name, suffix, sorted(labels.items())])
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.store.add(self.key('', labels), amount)
+
+    def samples(self, values):
+        for labels, value in sorted(values.get('', {}).items()):
+            yield self.name, labels, value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(),
+            buckets=()):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        bucket = next(le for le in self.buckets if value <= le)
+        store = self.registry.store
+        store.add(self.key('bucket', {**labels, 'le': bucket}), 1)
+        store.add(self.key('sum', labels), value)
+        store.add(self.key('count', labels), 1)
+
+    def samples(self, values):
+        counts = defaultdict(dict)
+        for labels, value in values.get('bucket', {}).items():
+            labels = dict(labels)
+            le = labels.pop('le')
+            counts[tuple(sorted(labels.items()))][le] = value
+        for labels in sorted(values.get('count', {})):
+            cumulative = 0
+            for le in self.buckets:
+                cumulative += counts[labels].get(le, 0)
+                yield f'{self.name}_bucket', labels + (
+                    ('le', format_value(le)),), cumulative
+            yield f'{self.name}_sum', labels, values['sum'][labels]
+            yield f'{self.name}_count', labels, values['count'][labels]
+
+class MetricsRegistry:
+    def __init__(self, store=None):
+        self.metrics = {}
+        self._store = store
+
+    @property
+    def store(self):
+        if self._store is None:
+            if settings.METRICS_DIR:
+                self._store = MmapStore(settings.METRICS_DIR)
+            else:
+                self._store = LocalStore()
+        return self._store
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=()):
+        return self.register(Histogram(
+            self, name, documentation, labelnames, buckets))
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def exposition(self):
+        """All metrics in the Prometheus text format."""
+        values = defaultdict(lambda: defaultdict(dict))
+        for key, value in self.store.collect().items():
+            name, suffix, labels = json.loads(key)
+            values[name][suffix][tuple(map(tuple, labels))] = value
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for sample, labels, value in metric.samples(values[name]):
+                lines.append(
+                    f'{sample}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    'http_requests_total',
+    'Requests answered, by route pattern, method and status.',
+    ['route', 'method', 'status']
+)
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds',
+    'Time to answer a request, by route pattern and method.',
+    ['route', 'method'],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+)
+DB_QUERIES = registry.histogram(
+    'db_queries_per_request',
+    'SQL queries made to answer a request, by route pattern.',
+    ['route'],
+    buckets=[0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+)
+DB_DURATION = registry.histogram(
+    'db_duration_per_request_seconds',
+    'Time spent in SQL queries to answer a request, by route pattern.',
+    ['route'],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1]
+)
+THROTTLED = registry.counter(
+    'throttle_rejections_total',
+    'Requests refused by PremiumUserRateThrottle, by throttle scope.',
+    ['scope']
+)
+CACHE_HITS = registry.counter(
+    'local_cache_hits_total',
+    'Hits of the per-process LRU caches.',
+    ['cache']
+)
+CACHE_MISSES = registry.counter(
+    'local_cache_misses_total',
+    'Misses of the per-process LRU caches.',
+    ['cache']
+)
+
+LOCAL_CACHES = {
+    'token': token_cache,
+    'throttle_tier': user_tier_cache,
+    'user_shard': user_shard_cache,
+}
+
+_cache_seen = {}
+_cache_lock = threading.Lock()
+
+def record_request(request, response, timings, total):
+    match = getattr(request, 'resolver_match', None)
+    # Unresolved paths share one label value to bound the cardinality
+    route = match.route if match else 'unmatched'
+    REQUESTS.inc(
+        route=route, method=request.method, status=response.status_code)
+    REQUEST_DURATION.observe(total, route=route, method=request.method)
+    DB_QUERIES.observe(timings.queries, route=route)
+    DB_DURATION.observe(timings.phases['db'], route=route)
+    record_cache_stats()
+
+def record_cache_stats():
+    """Add what the local caches counted since the last call."""
+    with _cache_lock:
+        for name, cache in LOCAL_CACHES.items():
+            hits, misses = cache.hits, cache.misses
+            seen_hits, seen_misses = _cache_seen.get(name, (0, 0))
+            # A cleared cache starts counting from zero again
+            if hits < seen_hits or misses < seen_misses:
+                seen_hits = seen_misses = 0
+            if hits > seen_hits:
+                CACHE_HITS.inc(hits - seen_hits, cache=name)
+            if misses > seen_misses:
+                CACHE_MISSES.inc(misses - seen_misses, cache=name)
+            _cache_seen[name] = (hits, misses)
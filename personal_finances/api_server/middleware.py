@@ -0,0 +1,239 @@
+import hashlib
+import random
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+    sync_to_async)
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from personal_finances.api_server.authentication import (
+    CachedTokenAuthentication)
+from personal_finances.api_server.cache import get_shared_cache
+from personal_finances.api_server.dashboard import invalidate_dashboard
+from personal_finances.api_server.db_routers import replica_reads
+from personal_finances.api_server.instrumentation import (
+    install_query_timers, log_request, measure_request)
+from personal_finances.api_server.metrics import record_request
+from personal_finances.api_server.sharding import (get_user_shard,
+    is_sharded, use_shard)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+class TimingMiddleware:
+    """Measure where requests spend their time.
+
+    With ``METRICS_ENABLED`` every request is measured and recorded in the
+    Prometheus metrics. A ``PERF_SAMPLE_RATE`` fraction of the requests
+    is also reported: their phases go to a ``Server-Timing`` header when
+    ``PERF_SERVER_TIMING`` is set, and requests slower than
+    ``PERF_LOG_THRESHOLD_MS`` are logged as one JSON line to the
+    ``personal_finances.performance`` logger.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sampled = self.sampled()
+        if not sampled and not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        install_query_timers()
+        with measure_request() as timings:
+            response = self.get_response(request)
+        self.report(request, response, timings, sampled)
+        return response
+
+    async def __acall__(self, request):
+        sampled = self.sampled()
+        if not sampled and not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        with measure_request() as timings:
+            response = await self.get_response(request)
+        self.report(request, response, timings, sampled)
+        return response
+
+    def sampled(self):
+        rate = settings.PERF_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def report(self, request, response, timings, sampled):
+        total = timings.total
+        if settings.METRICS_ENABLED:
+            record_request(request, response, timings, total)
+        if not sampled:
+            return
+        if settings.PERF_SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing(total)
+        if total * 1000 >= settings.PERF_LOG_THRESHOLD_MS:
+            log_request(request, response, timings, total)
+
+class ReplicaRoutingMiddleware:
+    """Serve safe-method requests from read replicas.
+
+    After a successful write the client, identified by its Authorization
+    header, is pinned to the primary for ``REPLICA_PIN_SECONDS`` so it reads
+    its own writes while the replicas catch up. Pins are kept in the shared
+    ``REPLICA_PIN_CACHE``, whichever worker serves the next read.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        pin_key = self.get_pin_key(request)
+        if request.method in SAFE_METHODS:
+            if pin_key and get_shared_cache(
+                    settings.REPLICA_PIN_CACHE).get(pin_key):
+                return self.get_response(request)
+            with replica_reads():
+                return self.get_response(request)
+        response = self.get_response(request)
+        self.pin(request, pin_key, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        pin_key = self.get_pin_key(request)
+        if request.method in SAFE_METHODS:
+            if pin_key and await get_shared_cache(
+                    settings.REPLICA_PIN_CACHE).aget(pin_key):
+                return await self.get_response(request)
+            with replica_reads():
+                return await self.get_response(request)
+        response = await self.get_response(request)
+        await sync_to_async(self.pin)(request, pin_key, response)
+        return response
+
+    def pin(self, request, pin_key, response):
+        # Batches of reads are POSTed but write nothing
+        if getattr(request, 'read_only', False):
+            return
+        if pin_key and response.status_code < 400:
+            get_shared_cache(settings.REPLICA_PIN_CACHE).set(
+                pin_key, True, settings.REPLICA_PIN_SECONDS)
+
+    def get_pin_key(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if not authorization:
+            return None
+        digest = hashlib.sha256(authorization.encode()).hexdigest()
+        return f'replica_pin_{digest}'
+
+class ShardRoutingMiddleware:
+    """Route the user data queries of a request to the shard of its user.
+
+    The user is found through the token authentication cache, so DRF
+    authenticating the same token afterwards costs no extra query. The
+    writes of a user being moved to another shard are answered with 503
+    until the move ends.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_sharded():
+            return self.get_response(request)
+        shard, moving = self.get_shard(request)
+        if moving:
+            return self.moving_response()
+        if shard is None:
+            return self.get_response(request)
+        with use_shard(shard):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not is_sharded():
+            return await self.get_response(request)
+        shard, moving = await sync_to_async(self.get_shard)(request)
+        if moving:
+            return self.moving_response()
+        if shard is None:
+            return await self.get_response(request)
+        with use_shard(shard):
+            return await self.get_response(request)
+
+    def get_shard(self, request):
+        """Shard of the user and whether the request is a refused write."""
+        user_id = self.get_user_id(request)
+        if user_id is None:
+            return None, False
+        shard, copy_alias = get_user_shard(user_id)
+        return shard, bool(copy_alias) and request.method not in SAFE_METHODS
+
+    def moving_response(self):
+        response = JsonResponse(
+            {'detail': 'Your data is being moved, retry shortly.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = '5'
+        return response
+
+    def get_user_id(self, request):
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if credentials is None:
+            return None
+        return credentials[0].pk
+
+class DashboardCacheMiddleware:
+    """Drop the cached dashboard of a user after each of their writes."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user_id = self.get_written_user_id(request, response)
+        if user_id is not None:
+            invalidate_dashboard(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self.get_written_user_id(request, response)
+        if user_id is not None:
+            await sync_to_async(invalidate_dashboard)(user_id)
+        return response
+
+    def get_written_user_id(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return None
+        if getattr(request, 'read_only', False):
+            return None
+        # Set by DRF once the token is authenticated
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
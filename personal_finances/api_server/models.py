@@ -1,16 +1,81 @@
+from datetime import datetime, time, timedelta
 from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from personal_finances.api_server.cache import user_tier_cache
+
+class AccountQuerySet(models.QuerySet):
+    def with_stats(self, begin, end):
+        """Annotate the executed income and expense between ``begin`` and
+        ``end``, the transaction count and last date and the pending total.
+
+        Counts and dates include the archived transactions, the period
+        totals only the live ones, so ``begin`` should be after the
+        archive horizon.
+        """
+        archives = TransactionArchive.objects.filter(
+            account=models.OuterRef('pk')).order_by().values('account')
+        executed_in_period = models.Q(
+            transaction__status=Transaction.EXECUTED,
+            transaction__date_time__gte=begin,
+            transaction__date_time__lt=end
+        )
+        zero = models.Value(Decimal(0))
+        return self.annotate(
+            period_income=Coalesce(models.Sum(
+                'transaction__value',
+                filter=executed_in_period & models.Q(
+                    transaction__type=Transaction.INCOME)
+            ), zero),
+            period_expense=Coalesce(models.Sum(
+                'transaction__value',
+                filter=executed_in_period & models.Q(
+                    transaction__type=Transaction.EXPENSE)
+            ), zero),
+            transaction_count=models.Count('transaction') + Coalesce(
+                models.Subquery(archives.annotate(count=models.Sum(
+                    models.F('income_count') + models.F('expense_count')
+                )).values('count')),
+                0
+            ),
+            last_transaction_at=Coalesce(
+                models.Max('transaction__date_time'),
+                models.Subquery(archives.annotate(
+                    last=models.Max('last_date_time')).values('last'))
+            ),
+            pending_total=Coalesce(models.Sum(
+                models.Case(
+                    models.When(
+                        transaction__type=Transaction.INCOME,
+                        then=models.F('transaction__value')
+                    ),
+                    default=-models.F('transaction__value')
+                ),
+                filter=models.Q(transaction__status=Transaction.PENDING)
+            ), zero),
+        )
+
 class Account(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Accounts may live on another shard than the users table, see
+    # api_server/sharding.py. Deleted accounts lose their user, hiding
+    # their rows, until purge_deleted removes them, see
+    # api_server/deletion.py
+    user = models.ForeignKey(
+        User, null=True, on_delete=models.CASCADE, db_constraint=False)
+    deleted_at = models.DateTimeField(null=True)
     name = models.CharField(max_length=40)
     description = models.CharField(null=True, max_length=120)
     initial_value = models.DecimalField(
         max_digits=12, decimal_places=2, default=Decimal(0))
     balance = models.DecimalField(
         max_digits=12, decimal_places=2, default=Decimal(0))
+    
+    objects = AccountQuerySet.as_manager()
 
 class Category(models.Model):
     INCOME = 'i'
@@ -19,7 +84,8 @@ class Category(models.Model):
         (INCOME, 'income'),
         (EXPENSE, 'expense')
     )
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_constraint=False)
     name = models.CharField(max_length=30)
     of_type = models.CharField(max_length=1, choices=OF_TYPE_CHOICES)
 
@@ -85,7 +151,32 @@ class Transaction(models.Model):
     transferences = TransferenceManager()
     
     class Meta:
-        ordering = ['-date_time']
+        # The id breaks ties, as in the merge with the archive
+        ordering = ['-date_time', '-id']
+        indexes = [models.Index(fields=['date_time'])]
+
+def unpaid_expenses_total():
+    """Expression of the expenses total in the unpaid invoices of a card."""
+    expenses = CreditCardExpense.objects.filter(
+        invoice__credit_card=models.OuterRef('pk'),
+        invoice__expense__status=Transaction.PENDING
+    ).order_by().values('invoice__credit_card').annotate(
+        total=models.Sum('value')).values('total')
+    return Coalesce(
+        models.Subquery(expenses), Decimal(0),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2)
+    )
+
+class CreditCardQuerySet(models.QuerySet):
+    def reconcile_used_limit(self):
+        """Recompute ``used_limit`` of the cards whose counter drifted.
+
+        Returns how many cards were updated.
+        """
+        drifted = self.annotate(computed=unpaid_expenses_total()).exclude(
+            used_limit=models.F('computed')).values('pk')
+        return self.filter(pk__in=drifted).update(
+            used_limit=unpaid_expenses_total())
 
 class CreditCard(models.Model):
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -94,15 +185,70 @@ class CreditCard(models.Model):
     due_day = models.IntegerField()
     invoice_day = models.IntegerField()
     limit = models.IntegerField()
+    # Expenses in unpaid invoices, kept up to date by the expense views
+    # and fixed by reconcile_card_limits
+    used_limit = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal(0))
+    
+    objects = CreditCardQuerySet.as_manager()
+    
+    @property
+    def available_limit(self):
+        return self.limit - self.used_limit
+    
+    def invoice_period(self, date):
+        """Cycle, first and last days and due time of the invoice of ``date``.
+
+        An invoice closes on the first ``invoice_day`` after ``date`` and is
+        due on the first ``due_day`` after closing. Its cycle is the first
+        day of the month it closes in.
+        """
+        closing = date + relativedelta(day=self.invoice_day)
+        if closing <= date:
+            closing = date + relativedelta(months=1, day=self.invoice_day)
+        due_date = closing + relativedelta(day=self.due_day)
+        if due_date <= closing:
+            due_date = closing + relativedelta(months=1, day=self.due_day)
+        return (
+            closing.replace(day=1),
+            closing + relativedelta(months=-1, day=self.invoice_day),
+            closing - timedelta(days=1),
+            timezone.make_aware(datetime.combine(due_date, time()))
+        )
 
 class CreditCardInvoice(models.Model):
+    OPEN = 'o'
+    CLOSED = 'c'
+    PAID = 'p'
+    STATUS_CHOICES = (
+        (OPEN, 'open'),
+        (CLOSED, 'closed'),
+        (PAID, 'paid')
+    )
+    
     credit_card = models.ForeignKey(CreditCard, on_delete=models.CASCADE)
     expense = models.OneToOneField(Transaction, on_delete=models.CASCADE)
     period_begin = models.DateField()
     period_end = models.DateField()
+    # Invoices made before cycles were stored have none until
+    # backfill_invoice_cycles runs
+    cycle = models.DateField(null=True)
+    # Closed and paid by the close_invoices job, see api_server/billing.py
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=OPEN)
+    closed_total = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True)
     
     class Meta:
         ordering = ['-period_begin']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['credit_card', 'cycle'], name='unique_invoice_cycle')
+        ]
+        indexes = [
+            models.Index(fields=['credit_card', '-period_begin']),
+            models.Index(fields=['status', 'period_end']),
+        ]
 
 class CreditCardExpense(models.Model):
     PENDING = 'i'
@@ -137,10 +283,42 @@ class CreditCardExpense(models.Model):
         Subcategory, null=True, on_delete=models.SET_NULL)
     invoice = models.ForeignKey(
         CreditCardInvoice, on_delete=models.CASCADE)
+    # Parts of a divided purchase after the first one point to it
+    first_part = models.ForeignKey(
+        'self',
+        null=True,
+        on_delete=models.CASCADE,
+        related_name='other_parts'
+    )
     
     class Meta:
         ordering = ['-date_time']
 
+class TransactionArchive(models.Model):
+    """Executed transactions of one account and month moved out of
+    ``Transaction`` by archive_transactions, see api_server/archive.py.
+
+    ``data`` holds their columns compressed, the other fields sum them up.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    month = models.DateField()
+    first_date_time = models.DateTimeField()
+    last_date_time = models.DateTimeField()
+    income_count = models.IntegerField(default=0)
+    expense_count = models.IntegerField(default=0)
+    income_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal(0))
+    expense_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal(0))
+    data = models.BinaryField()
+    
+    class Meta:
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'month'], name='unique_archive_month')
+        ]
+
 class Transference(models.Model):
     from_transaction = models.OneToOneField(
         Transaction,
@@ -164,4 +342,24 @@ class UserExtras(models.Model):
     )
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     type = models.CharField(
-        max_length=1, choices=TYPE_CHOICES, default=STARNDARD)
\ No newline at end of file
+        max_length=1, choices=TYPE_CHOICES, default=STARNDARD)
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        user_tier_cache.delete(self.user_id)
+    
+    def delete(self, *args, **kwargs):
+        user_tier_cache.delete(self.user_id)
+        return super().delete(*args, **kwargs)
+
+class UserDeletion(models.Model):
+    """User whose data is waiting to be purged by purge_deleted."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    requested_at = models.DateTimeField(default=timezone.now)
+
+class UserShard(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    alias = models.CharField(max_length=40)
+    # Shard holding a second copy of the rows while the user is moved, the
+    # writes of the user are refused while it is set
+    copy_alias = models.CharField(max_length=40, blank=True)
\ No newline at end of file
@@ -1,8 +1,45 @@
+from django.core.paginator import InvalidPage, Page
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageNumberCustomPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 200
+
+
+class InvoiceCursorPagination(CursorPagination):
+    ordering = '-period_begin'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class AsyncPageNumberCustomPagination(PageNumberCustomPagination):
+    """Page number pagination for views using the async ORM."""
+    async def apaginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * page_size
+        object_list = [
+            obj async for obj in queryset[bottom:bottom + page_size]]
+        self.page = Page(object_list, number, paginator)
+        return object_list
+
+    def get_paginated_data(self, data):
+        return {
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
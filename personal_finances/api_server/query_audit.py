@@ -0,0 +1,114 @@
+"""
+SQL audit of the API routes.
+
+Every benchmark scenario is sent once per dataset size while the queries
+of all databases are captured. A route is reported
+when its query count grows with the data, a sign of per-object queries,
+or when SQLite plans one of its queries as a full table scan.
+"""
+
+import json
+import re
+from contextlib import ExitStack
+
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from personal_finances.api_server.benchmark import API_PREFIX, SCENARIOS
+from personal_finances.api_server.cache import (token_cache,
+    user_shard_cache, user_tier_cache)
+
+# Full scans a route needs by design, listing every user for an admin
+ALLOWED_SCANS = {
+    ('get', '^user/$'): {'auth_user'},
+}
+
+_full_scan = re.compile(r'^SCAN (\w+)')
+
+def explain(connection, sql):
+    """Detail lines of the SQLite query plan of ``sql``."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+def full_scans(plan):
+    return [
+        match.group(1) for match in map(_full_scan.match, plan)
+        if match and match.group(1) != 'CONSTANT'
+    ]
+
+def profile_request(scenario, bench_user):
+    """Send one request of a scenario and record its queries.
+
+    Authentication, throttle tier and shard caches are cleared first, so
+    each record counts the same cold lookups.
+    """
+    route, method, admin, build = scenario
+    path, data = build(bench_user)
+    token = bench_user.admin_token if admin else bench_user.token
+    for local_cache in (token_cache, user_tier_cache, user_shard_cache):
+        local_cache.clear()
+    client = Client(raise_request_exception=False)
+    with ExitStack() as stack:
+        captures = {
+            alias: stack.enter_context(
+                CaptureQueriesContext(connections[alias]))
+            for alias in connections
+        }
+        response = client.generic(
+            method.upper(),
+            API_PREFIX + path,
+            json.dumps(data) if data is not None else '',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {token}'
+        )
+    queries = []
+    for alias, capture in captures.items():
+        connection = connections[alias]
+        for query in capture.captured_queries:
+            plan = []
+            if (connection.vendor == 'sqlite'
+                    and query['sql'].lstrip().upper().startswith('SELECT')):
+                plan = explain(connection, query['sql'])
+            queries.append({'sql': query['sql'], 'plan': plan})
+    return {
+        'path': path,
+        'status': response.status_code,
+        'queries': len(queries),
+        'scans': sorted({
+            table for query in queries for table in full_scans(query['plan'])
+        }),
+        'sql': queries,
+    }
+
+def audit(bench_user):
+    """Profile every scenario once as ``bench_user``."""
+    return {
+        f'{scenario[1].upper()} {scenario[0]}': profile_request(
+            scenario, bench_user)
+        for scenario in SCENARIOS
+    }
+
+def regressions(audits):
+    """Describe the routes whose queries grow with the data or full scan.
+
+    ``audits`` are results of ``audit`` ordered from the smallest dataset.
+    """
+    problems = []
+    for route, method, admin, build in SCENARIOS:
+        name = f'{method.upper()} {route}'
+        records = [records[name] for records in audits]
+        counts = [record['queries'] for record in records]
+        if max(counts[1:], default=0) > counts[0]:
+            problems.append(
+                f'{name}: query count grows with the data {counts}')
+        allowed = ALLOWED_SCANS.get((method, route), set())
+        for record in records:
+            if record['status'] >= 400:
+                problems.append(f'{name}: status {record["status"]}')
+            scans = set(record['scans']) - allowed
+            if scans:
+                problems.append(
+                    f'{name}: full table scan of {", ".join(sorted(scans))}')
+    return sorted(set(problems))
@@ -0,0 +1,190 @@
+"""
+User data sharding.
+
+Every model that hangs off ``Account.user`` or ``Category.user`` lives on
+one database of ``DATABASE_SHARDS``, picked per user and recorded in the
+``UserShard`` directory on the default database. Users, tokens and the
+directory itself stay on the default database, which is also the first
+shard, so a single database setup needs no configuration.
+
+Workers keep the shard of a user in a per-process cache. ``move_user``
+records every change of the directory in the shared cache, where workers
+check for one before trusting their copy.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction as dbtnsac
+
+from personal_finances.api_server.cache import (get_shared_cache,
+    user_shard_cache)
+from personal_finances.api_server.models import (Account, Category,
+    CreditCard, CreditCardExpense, CreditCardInvoice, Subcategory,
+    Transaction, TransactionArchive, Transference, UserShard)
+
+# Sharded models in dependency order with the lookup to their owner
+SHARDED_MODELS = (
+    (Account, 'user'),
+    (Category, 'user'),
+    (Subcategory, 'category__user'),
+    (Transaction, 'account__user'),
+    (CreditCard, 'account__user'),
+    (CreditCardInvoice, 'credit_card__account__user'),
+    (CreditCardExpense, 'invoice__credit_card__account__user'),
+    (Transference, 'from_transaction__account__user'),
+    (TransactionArchive, 'account__user'),
+)
+
+_current_shard = ContextVar('current_shard', default=None)
+
+class ShardNotSelected(Exception):
+    pass
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+def get_current_shard():
+    """Database alias holding the data of the user being served."""
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    shard = _current_shard.get()
+    if shard is None:
+        raise ShardNotSelected(
+            'user data accessed outside of use_shard()')
+    return shard
+
+@contextmanager
+def use_shard(alias):
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+def user_shard_changed_key(user_id):
+    return f'user_shard_changed_{user_id}'
+
+def get_user_shard(user_id):
+    """Return the shard of a user and the one holding a copy of their rows
+    while they are moved, assigning a shard on first use.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS, ''
+    entry = user_shard_cache.get(user_id)
+    if entry is not None:
+        changed_at = get_shared_cache(settings.USER_SHARD_SHARED_CACHE).get(
+            user_shard_changed_key(user_id))
+        if changed_at is not None and entry[2] <= changed_at:
+            entry = None
+    if entry is None:
+        loaded_at = time.time()
+        user_shard, created = UserShard.objects.get_or_create(
+            user_id=user_id,
+            defaults={'alias': placement_for_user(user_id)}
+        )
+        entry = (user_shard.alias, user_shard.copy_alias, loaded_at)
+        user_shard_cache.set(user_id, entry)
+    return entry[:2]
+
+def shard_for_user(user_id):
+    """Return the shard of a user, assigning one on first use."""
+    return get_user_shard(user_id)[0]
+
+def set_user_shard(user_id, **fields):
+    """Update the directory entry of a user for every worker."""
+    UserShard.objects.filter(user_id=user_id).update(**fields)
+    # Outlives the copies loaded before the update
+    get_shared_cache(settings.USER_SHARD_SHARED_CACHE).set(
+        user_shard_changed_key(user_id), time.time(),
+        settings.USER_SHARD_CACHE_TTL)
+    user_shard_cache.delete(user_id)
+
+def placement_for_user(user_id):
+    """Shard a user belongs to when spread evenly over the shards."""
+    return settings.DATABASE_SHARDS[user_id % len(settings.DATABASE_SHARDS)]
+
+def user_atomic():
+    """``atomic`` block on the shard of the user being served."""
+    return dbtnsac.atomic(using=get_current_shard())
+
+def user_rows(model, lookup, user_id, using):
+    return model._base_manager.using(using).filter(**{lookup: user_id})
+
+def delete_user_data(user_id, using):
+    """Delete every sharded row of a user from one database."""
+    with dbtnsac.atomic(using=using):
+        for model, lookup in reversed(SHARDED_MODELS):
+            user_rows(model, lookup, user_id, using).delete()
+
+class ShardConflict(Exception):
+    pass
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def count_user_rows(user_id, using):
+    return [
+        user_rows(model, lookup, user_id, using).count()
+        for model, lookup in SHARDED_MODELS
+    ]
+
+def move_user(user_id, target, chunk_size=500):
+    """Copy the rows of a user to another shard, then drop the originals.
+
+    Primary keys are kept, so the ids clients hold stay valid. The move is
+    refused when one of them is already taken on the target shard. The
+    writes of the user are refused from the start of the copy until the
+    originals are dropped, which happens only when their counts still match
+    the copy. An interrupted move is undone by moving the user again.
+    """
+    shard_for_user(user_id)
+    user_shard = UserShard.objects.get(user_id=user_id)
+    source = user_shard.alias
+    if user_shard.copy_alias:
+        # Before the switch the copy is partial, after it the originals
+        # were copied in full: either way it goes
+        delete_user_data(user_id, user_shard.copy_alias)
+        set_user_shard(user_id, copy_alias='')
+    if source == target:
+        return 0
+    for model, lookup in SHARDED_MODELS:
+        ids = user_rows(model, lookup, user_id, source).values_list(
+            'pk', flat=True).iterator(chunk_size=chunk_size)
+        for chunk in chunked(ids, chunk_size):
+            if model._base_manager.using(target).filter(pk__in=chunk).exists():
+                raise ShardConflict(
+                    f'{model.__name__} ids of user {user_id} already'
+                    f' used on {target}')
+    set_user_shard(user_id, copy_alias=target)
+    try:
+        copied = []
+        with dbtnsac.atomic(using=target):
+            for model, lookup in SHARDED_MODELS:
+                rows = user_rows(model, lookup, user_id, source).iterator(
+                    chunk_size=chunk_size)
+                copied.append(0)
+                for chunk in chunked(rows, chunk_size):
+                    model._base_manager.using(target).bulk_create(chunk)
+                    copied[-1] += len(chunk)
+        if count_user_rows(user_id, source) != copied:
+            raise ShardConflict(
+                f'rows of user {user_id} changed while being moved')
+    except Exception:
+        delete_user_data(user_id, target)
+        set_user_shard(user_id, copy_alias='')
+        raise
+    set_user_shard(user_id, alias=target, copy_alias=source)
+    delete_user_data(user_id, source)
+    set_user_shard(user_id, copy_alias='')
+    return sum(copied)
@@ -1,15 +1,59 @@
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from contextlib import closing
 from datetime import datetime, timedelta
 from decimal import Decimal
-from random import choice
+from io import BytesIO, StringIO
+from pathlib import Path
+from random import Random, choice
 from time import sleep
-from rest_framework.test import APITestCase, APIClient
+from unittest import mock
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db.models import F
+from django.db.models import Sum as dbsum
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.utils import ConnectionHandler
+from django.db import transaction as dbtnsac
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase,
+    TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from personal_finances.api_server.models import (Account, Category, CreditCard,
-    CreditCardExpense, CreditCardInvoice, Subcategory, Transaction, UserExtras)
-from personal_finances.api_server.throttling import PremiumUserRateThrottle
+    CreditCardExpense, CreditCardInvoice, Subcategory, Transaction,
+    TransactionArchive, Transference, UserExtras, UserShard)
+from personal_finances.api_server import (backup, benchmark, billing,
+    dashboard, export, query_audit, sharding, views)
+from personal_finances.api_server.benchmark import Seeder
+from personal_finances.api_server.cache import (token_cache, user_shard_cache,
+    user_tier_cache)
+from personal_finances.api_server.db_routers import replica_reads
+from personal_finances.api_server.metrics import (MetricsRegistry,
+    MmapStore, MmapValues)
+from personal_finances.api_server.middleware import ReplicaRoutingMiddleware
+from personal_finances.api_server.sharding import (delete_user_data,
+    move_user)
+from personal_finances.api_server.throttling import (PremiumUserRateThrottle,
+    get_user_scope)
+
+def clear_caches():
+    # The shared cache is a temporary one, see test_runner.py
+    assert settings.CACHES['shared']['LOCATION'].startswith(
+        tempfile.gettempdir())
+    for alias in settings.CACHES:
+        caches[alias].clear()
 
 class TestUser(APITestCase):
     def setUp(self) -> None:
@@ -80,6 +124,9 @@ class TestUser(APITestCase):
 
 class BaseTestCase(APITestCase):
     def setUp(self) -> None:
+        clear_caches()
+        token_cache.clear()
+        user_tier_cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username='TestUser2', password='testpassword2')
@@ -91,6 +138,307 @@ class TestHome(BaseTestCase):
         response = self.client.get('/v1/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+class TestTokenAuthentication(BaseTestCase):
+    def test_cached_lookup(self):
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_delete_token_invalidates(self):
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete('/v1/delete-token/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_change_password_invalidates(self):
+        response = self.client.post(
+            '/v1/change-password/',
+            {
+                'old_password': 'testpassword2',
+                'new_password': 'an0ther-Passw0rd'
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_user_update_invalidates(self):
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        admin = User.objects.create_user(
+            username='AdminUser',
+            password='admintestpassword',
+            is_superuser=True,
+            is_staff=True
+        )
+        admin_client = APIClient()
+        admin_token = Token.objects.get_or_create(user=admin)
+        admin_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {admin_token[0]}')
+        response = admin_client.patch(
+            f'/v1/user/{self.user.id}/', {'first_name': 'foo'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/v1/')
+        self.assertEqual(
+            response.json()['message'], 'Personal finances API. Welcome foo')
+        response = admin_client.patch(
+            f'/v1/user/{self.user.id}/', {'is_active': False})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_revocation_reaches_other_workers(self):
+        # Recorded in the shared cache even without shared token lookups
+        self.assertIsNone(settings.TOKEN_SHARED_CACHE)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        key = self.token[0].key
+        entry = token_cache.get(key)
+        self.assertNotIn('password', json.dumps(entry, default=str))
+        response = self.client.delete('/v1/delete-token/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # The copy another worker loaded before the revocation
+        token_cache.set(key, entry)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIsNone(token_cache.get(key))
+    
+    def test_user_deletion_reaches_other_workers(self):
+        admin = User.objects.create_user(
+            username='AdminUser', password='admintestpassword',
+            is_superuser=True, is_staff=True)
+        admin_client = APIClient()
+        admin_client.credentials(HTTP_AUTHORIZATION=(
+            f'Token {Token.objects.get_or_create(user=admin)[0]}'))
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        key = self.token[0].key
+        entry = token_cache.get(key)
+        response = admin_client.delete(f'/v1/user/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        token_cache.set(key, entry)
+        response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_expiry_and_rotation(self):
+        with override_settings(TOKEN_TTL=3600):
+            response = self.client.get('/v1/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            Token.objects.filter(user=self.user).update(
+                created=datetime.now().astimezone() - timedelta(hours=2))
+            token_cache.clear()
+            response = self.client.get('/v1/')
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.post(
+                '/v1/login/',
+                {
+                    'username': 'TestUser2',
+                    'password': 'testpassword2'
+                }
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            new_key = response.json()['token']
+            self.assertNotEqual(new_key, self.token[0].key)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {new_key}')
+            response = self.client.post('/v1/rotate-token/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.json()['token'], new_key)
+            response = self.client.get('/v1/')
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class TestSqliteBackend(SimpleTestCase):
+    def setUp(self) -> None:
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = Path(directory) / 'db.sqlite3'
+        handler = ConnectionHandler({
+            DEFAULT_DB_ALIAS: dict(
+                settings.DATABASE_PROFILES['production'], NAME=self.path),
+        })
+        self.connection = handler[DEFAULT_DB_ALIAS]
+        # Reachable by atomic() next to the test databases
+        connections['production'] = self.connection
+        self.addCleanup(connections.__delitem__, 'production')
+        self.addCleanup(self.connection.close)
+    
+    def test_pragmas(self):
+        pragmas = settings.DATABASE_PROFILES['production']['OPTIONS'][
+            'pragmas']
+        with self.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], pragmas['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+    
+    def test_atomic_begins_immediate(self):
+        with CaptureQueriesContext(self.connection) as queries:
+            with dbtnsac.atomic(using='production'):
+                pass
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with dbtnsac.atomic(using='production'):
+            self.connection.cursor().execute('SELECT 1')
+            # The write lock is taken before anything is written
+            with self.assertRaises(sqlite3.OperationalError):
+                other.execute('BEGIN IMMEDIATE')
+    
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class TestReplicaRouting(TransactionTestCase):
+    def setUp(self) -> None:
+        clear_caches()
+    
+    def test_router(self):
+        self.assertEqual(router.db_for_read(Account), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Account), 'replica_0')
+            self.assertEqual(router.db_for_write(Account), 'default')
+            with dbtnsac.atomic():
+                self.assertEqual(router.db_for_read(Account), 'default')
+    
+    def test_middleware_read_your_writes(self):
+        read_databases = []
+        def get_response(request):
+            read_databases.append(router.db_for_read(Account))
+            return HttpResponse()
+        middleware = ReplicaRoutingMiddleware(get_response)
+        factory = RequestFactory()
+        auth = {'HTTP_AUTHORIZATION': 'Token client'}
+        middleware(factory.get('/v1/account/', **auth))
+        middleware(factory.post('/v1/account/', **auth))
+        middleware(factory.get('/v1/account/', **auth))
+        middleware(factory.get(
+            '/v1/account/', HTTP_AUTHORIZATION='Token other'))
+        self.assertEqual(
+            read_databases, ['replica_0', 'default', 'default', 'replica_0'])
+    
+    def test_pin_requires_shared_cache(self):
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get(
+            '/v1/account/', HTTP_AUTHORIZATION='Token client')
+        with override_settings(REPLICA_PIN_CACHE='default'):
+            with self.assertRaises(ImproperlyConfigured):
+                middleware(request)
+    
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_no_pins(self):
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        auth = {'HTTP_AUTHORIZATION': 'Token client'}
+        with mock.patch(
+                'personal_finances.api_server.middleware.get_shared_cache'
+                ) as get_shared_cache:
+            middleware(factory.post('/v1/account/', **auth))
+            middleware(factory.get('/v1/account/', **auth))
+        get_shared_cache.assert_not_called()
+
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+class TestSharding(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shard_dir = tempfile.TemporaryDirectory()
+        connections.settings['shard_1'] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': Path(cls.shard_dir.name) / 'shard_1.sqlite3',
+            }
+        })[DEFAULT_DB_ALIAS]
+        call_command('migrate', database='shard_1', verbosity=0)
+    
+    @classmethod
+    def tearDownClass(cls):
+        connections['shard_1'].close()
+        del connections.settings['shard_1']
+        cls.shard_dir.cleanup()
+        super().tearDownClass()
+    
+    def setUp(self) -> None:
+        clear_caches()
+        token_cache.clear()
+        user_shard_cache.clear()
+        user_tier_cache.clear()
+        self.user = User.objects.create_user(
+            username='ShardedUser', password='testpassword')
+        UserShard.objects.create(user=self.user, alias='shard_1')
+        self.client = APIClient()
+        token = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token[0]}')
+    
+    def test_user_data_on_one_shard(self):
+        response = self.client.post(
+            '/v1/account/', {'name': 'bank1', 'initial_value': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        id = response.json()['id']
+        response = self.client.post(
+            '/v1/transaction/',
+            {
+                'account': id,
+                'name': 'energy',
+                'date_time': '2022-03-10T20:53:00',
+                'value': 50,
+                'type': Transaction.EXPENSE
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Account.objects.using('shard_1').count(), 1)
+        self.assertEqual(Account.objects.using('default').count(), 0)
+        self.assertEqual(
+            Account.objects.using('shard_1').get().balance, Decimal(50))
+        with self.assertNumQueries(0, using='default'):
+            response = self.client.get('/v1/transaction/')
+        self.assertEqual(response.json()['count'], 1)
+        # rebalance
+        self.assertEqual(move_user(self.user.id, 'default'), 2)
+        self.assertEqual(Account.objects.using('shard_1').count(), 0)
+        response = self.client.get(f'/v1/account/{id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['balance'], '50.00')
+    
+    def test_move_across_workers(self):
+        response = self.client.post(
+            '/v1/account/', {'name': 'bank1', 'initial_value': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        id = response.json()['id']
+        stale = user_shard_cache.get(self.user.id)
+        # Writes are refused while the rows are copied, reads go on
+        sharding.set_user_shard(self.user.id, copy_alias='default')
+        response = self.client.post(
+            '/v1/account/', {'name': 'bank2', 'initial_value': 0})
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        response = self.client.get(f'/v1/account/{id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Moving again undoes the interrupted move
+        self.assertEqual(move_user(self.user.id, 'shard_1'), 0)
+        self.assertEqual(
+            UserShard.objects.get(user=self.user).copy_alias, '')
+        # A write landing during the copy aborts the move
+        with mock.patch.object(
+                sharding, 'count_user_rows', return_value=[]):
+            with self.assertRaises(sharding.ShardConflict):
+                move_user(self.user.id, 'default')
+        self.assertEqual(Account.objects.using('default').count(), 0)
+        self.assertEqual(sharding.get_user_shard(self.user.id), (
+            'shard_1', ''))
+        self.assertEqual(move_user(self.user.id, 'default'), 1)
+        # The copy another worker loaded before the move is not trusted
+        user_shard_cache.set(self.user.id, stale)
+        response = self.client.get(f'/v1/account/{id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Account.objects.using('shard_1').count(), 0)
+        self.assertEqual(
+            sharding.get_user_shard(self.user.id), ('default', ''))
+
 class TestAccount(BaseTestCase):
     def test_crud(self):
         # create
@@ -139,6 +487,100 @@ class TestAccount(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.json()['balance'], '10.00')
     
+    def add_history(self, account, category):
+        card = CreditCard.objects.create(
+            account=account,
+            label='Ultra',
+            due_day=10,
+            invoice_day=30,
+            limit=3000
+        )
+        response = self.client.post(
+            f'/v1/credit-card/{card.id}/expense/',
+            {
+                'name': 'Phone',
+                'date_time': '2022-03-21T14:21:00',
+                'value': 300,
+                'repeat': CreditCardExpense.DIVIDED,
+                'total_parts': 3,
+                'category': category.id
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for value in (10, 20):
+            Transaction.objects.create(
+                account=account,
+                name='Item',
+                value=value,
+                type=Transaction.EXPENSE,
+                category=category
+            )
+    
+    def test_background_delete(self):
+        account = Account.objects.create(
+            user=self.user, name='bank1', balance=100)
+        other = Account.objects.create(user=self.user, name='bank2')
+        category = Category.objects.create(
+            user=self.user, name='Home', of_type=Category.EXPENSE)
+        self.add_history(account, category)
+        response = self.client.post('/v1/transference/', {
+            'name': 'Savings',
+            'from_account': account.id,
+            'to_account': other.id,
+            'value': 50,
+            'date_time': '2022-03-22T10:00:00',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(f'/v1/account/{account.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # Hidden at once, removed by the purge
+        response = self.client.get(f'/v1/account/{account.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/v1/transaction/')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(self.client.get('/v1/credit-card/').json(), [])
+        self.assertEqual(
+            Transaction.objects.filter(account=account).count(), 6)
+        call_command('purge_deleted', chunk_size=2, stdout=StringIO())
+        self.assertFalse(Account.objects.filter(id=account.id).exists())
+        for model in (CreditCard, CreditCardInvoice, CreditCardExpense,
+                Transference):
+            self.assertFalse(model.objects.exists(), model.__name__)
+        # The leg in the other account stays, as a plain transaction
+        leg = Transaction.objects.get()
+        self.assertEqual(leg.account_id, other.id)
+        self.assertFalse(leg.is_transference)
+        response = self.client.patch(
+            f'/v1/transaction/{leg.id}/', {'value': 60})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(f'/v1/transaction/{leg.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertTrue(Category.objects.filter(id=category.id).exists())
+    
+    def test_delete_user(self):
+        admin = User.objects.create_user(
+            username='Admin', password='adminpassword', is_staff=True)
+        account = Account.objects.create(user=self.user, name='bank1')
+        category = Category.objects.create(
+            user=self.user, name='Home', of_type=Category.EXPENSE)
+        Subcategory.objects.create(category=category, name='Rent')
+        self.add_history(account, category)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=admin)}')
+        response = self.client.delete(f'/v1/user/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(f'/v1/user/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        call_command('purge_deleted', chunk_size=2, stdout=StringIO())
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        for model in (Account, Category, Subcategory, Transaction,
+                CreditCard, CreditCardInvoice, CreditCardExpense):
+            self.assertFalse(model.objects.exists(), model.__name__)
+    
     def test_total_balance(self):
         balance = Decimal(0)
         for i in range(3):
@@ -155,6 +597,200 @@ class TestAccount(BaseTestCase):
         self.assertEqual(
             Decimal(response.json()['total_balance']), 
             balance)
+    
+    def test_stats(self):
+        now = timezone.now()
+        accounts = [
+            Account.objects.create(user=self.user, name=f'bank{i}')
+            for i in range(3)
+        ]
+        for value, type, transaction_status, date_time in (
+                (100, Transaction.INCOME, Transaction.EXECUTED, now),
+                (30, Transaction.EXPENSE, Transaction.EXECUTED, now),
+                (7, Transaction.EXPENSE, Transaction.EXECUTED,
+                    now - timedelta(days=40)),
+                (20, Transaction.EXPENSE, Transaction.PENDING, now),
+                (5, Transaction.INCOME, Transaction.PENDING, now)):
+            Transaction.objects.create(
+                account=accounts[0],
+                name='Item',
+                value=value,
+                type=type,
+                status=transaction_status,
+                date_time=date_time
+            )
+        Transaction.objects.create(
+            account=accounts[1], name='Item', value=1, type=Transaction.INCOME)
+        self.client.get('/v1/account/')
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/v1/account/', {'with_stats': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = {account['name']: account for account in response.json()}
+        self.assertEqual(stats['bank0']['month_income'], '100.00')
+        self.assertEqual(stats['bank0']['month_expense'], '30.00')
+        self.assertEqual(stats['bank0']['transaction_count'], 5)
+        self.assertEqual(stats['bank0']['pending_total'], '-15.00')
+        self.assertEqual(stats['bank1']['transaction_count'], 1)
+        self.assertEqual(stats['bank2']['transaction_count'], 0)
+        self.assertEqual(stats['bank2']['month_income'], '0.00')
+        self.assertIsNone(stats['bank2']['last_transaction_at'])
+        self.assertNotIn(
+            'transaction_count', self.client.get('/v1/account/').json()[0])
+
+class TestDashboard(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = Account.objects.create(
+            user=self.user, name='bank1', balance=50)
+        Category.objects.create(
+            user=self.user, name='Food', of_type=Category.EXPENSE)
+        CreditCard.objects.create(
+            account=self.account,
+            label='Top master',
+            due_day=9,
+            invoice_day=2,
+            limit=1000
+        )
+        for value, transaction_status, date_time in (
+                (10, Transaction.EXECUTED, timezone.now()),
+                (20, Transaction.PENDING, timezone.now() + timedelta(days=1))):
+            Transaction.objects.create(
+                account=self.account,
+                name='Item',
+                value=value,
+                type=Transaction.EXPENSE,
+                status=transaction_status,
+                date_time=date_time
+            )
+    
+    def test_dashboard(self):
+        self.client.get('/v1/')
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            response = self.client.get('/v1/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 5)
+        data = response.json()
+        self.assertEqual(Decimal(data['total_balance']), 50)
+        self.assertEqual(Decimal(data['month_expense']), 10)
+        self.assertEqual(
+            [account['name'] for account in data['accounts']], ['bank1'])
+        self.assertEqual(len(data['categories']), 1)
+        self.assertEqual(len(data['credit_cards']), 1)
+        self.assertEqual(len(data['transactions']), 2)
+        self.assertEqual(
+            [item['value'] for item in data['upcoming']], ['20.00'])
+        # Cached until the user writes
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get('/v1/dashboard/').json(), data)
+        response = self.client.patch(
+            f'/v1/account/{self.account.id}/', {'name': 'bank2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/v1/dashboard/')
+        self.assertEqual(response.json()['accounts'][0]['name'], 'bank2')
+    
+    def test_batch_jobs_invalidate(self):
+        Transaction.objects.create(
+            account=self.account,
+            name='Old item',
+            value=5,
+            type=Transaction.EXPENSE,
+            status=Transaction.EXECUTED,
+            date_time=timezone.now() - timedelta(days=800)
+        )
+        response = self.client.get('/v1/dashboard/')
+        self.assertEqual(len(response.json()['transactions']), 3)
+        # Seen by every worker
+        self.assertIsNotNone(
+            caches['shared'].get(dashboard.dashboard_key(self.user.id)))
+        call_command('archive_transactions', stdout=StringIO())
+        response = self.client.get('/v1/dashboard/')
+        self.assertEqual(len(response.json()['transactions']), 2)
+        with override_settings(DASHBOARD_CACHE='default'):
+            with self.assertRaises(ImproperlyConfigured):
+                dashboard.get_dashboard(self.user)
+    
+    @override_settings(DASHBOARD_WORKERS=2)
+    def test_concurrent_queries(self):
+        queries = {
+            'accounts': Account.objects.filter(user=self.user),
+            'categories': Category.objects.filter(user=self.user),
+        }
+        with mock.patch(
+                'personal_finances.api_server.dashboard.run_in_thread',
+                side_effect=lambda query: threading.current_thread().name):
+            threads = dashboard.run_queries(queries)
+        self.assertTrue(all(
+            name.startswith('dashboard') for name in threads.values()))
+
+class TestBatch(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = Account.objects.create(
+            user=self.user, name='bank1', balance=50)
+        for value in (10, 20):
+            Transaction.objects.create(
+                account=self.account,
+                name='Item',
+                value=value,
+                type=Transaction.EXPENSE,
+                status=Transaction.EXECUTED,
+                date_time=timezone.now()
+            )
+    
+    def test_batch(self):
+        with mock.patch(
+                'personal_finances.api_server.throttling.get_user_scope',
+                wraps=get_user_scope) as user_scope:
+            response = self.client.post('/v1/batch/', [
+                {'path': 'account/'},
+                {'path': f'account/{self.account.id}/'},
+                {'path': 'transaction/?page=1'},
+                {'path': 'total-balance/'},
+                {'path': f'account/{self.account.id + 1}/'},
+                {'path': 'unknown/'},
+                {'path': 'batch/'},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Only the batch itself is throttled
+        self.assertEqual(user_scope.call_count, 1)
+        responses = response.json()
+        self.assertEqual(
+            [sub['status'] for sub in responses],
+            [200, 200, 200, 200, 404, 404, 404]
+        )
+        self.assertEqual(responses[0]['body'][0]['name'], 'bank1')
+        self.assertEqual(responses[1]['body']['id'], self.account.id)
+        self.assertEqual(responses[2]['body']['count'], 2)
+        self.assertEqual(
+            Decimal(responses[3]['body']['total_balance']), 50)
+        self.assertEqual(responses[6]['path'], 'batch/')
+    
+    def test_sub_requests_are_authorized(self):
+        other = User.objects.create_user(
+            username='Other', password='otherpassword')
+        other_account = Account.objects.create(user=other, name='bank2')
+        response = self.client.post('/v1/batch/', [
+            {'path': f'account/{other_account.id}/'},
+            {'path': 'metrics/'},
+        ], format='json')
+        self.assertEqual(
+            [sub['status'] for sub in response.json()], [404, 403])
+    
+    def test_invalid_batch(self):
+        for data in ([], [{'path': '/v1/account/'}],
+                [{'path': 'account/'}] * (views.MAX_BATCH_REQUESTS + 1)):
+            response = self.client.post('/v1/batch/', data, format='json')
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_keeps_dashboard_cache(self):
+        self.client.get('/v1/dashboard/')
+        self.client.post(
+            '/v1/batch/', [{'path': 'account/'}], format='json')
+        with self.assertNumQueries(0):
+            self.client.get('/v1/dashboard/')
 
 class TestCategory(BaseTestCase):
     def test_crud(self):
@@ -197,7 +833,46 @@ class TestCategory(BaseTestCase):
         # delete
         response = self.client.delete(f'/v1/category/{id}/')
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        
+    
+    def test_tree(self):
+        home = Category.objects.create(
+            user=self.user, name='Home', of_type=Category.EXPENSE)
+        Category.objects.create(
+            user=self.user, name='Salary', of_type=Category.INCOME)
+        for name in ('Maintenance', 'Furniture'):
+            Subcategory.objects.create(category=home, name=name)
+        self.client.get('/v1/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/v1/category/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tree = response.json()
+        self.assertEqual(
+            [category['name'] for category in tree], ['Home', 'Salary'])
+        self.assertEqual(
+            [sub['name'] for sub in tree[0]['subcategories']],
+            ['Maintenance', 'Furniture']
+        )
+        self.assertEqual(tree[1]['subcategories'], [])
+        response = self.client.get(
+            '/v1/category/tree/', {'of_type': Category.INCOME})
+        self.assertEqual(
+            [category['name'] for category in response.json()], ['Salary'])
+        # Unchanged tree
+        etag = self.client.get('/v1/category/tree/')['ETag']
+        response = self.client.get(
+            '/v1/category/tree/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        # Renamed subcategory
+        self.client.patch(
+            f'/v1/subcategory/{tree[0]["subcategories"][0]["id"]}/',
+            {'name': 'Repairs'}
+        )
+        response = self.client.get(
+            '/v1/category/tree/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
 class TestSubcategory(BaseTestCase):
     def test_crud(self):
         # create
@@ -418,6 +1093,277 @@ class TestTransaction(BaseTestCase):
         self.assertEqual(result['count'], 20)
         self.assertEqual(len(result['results']), 5)
 
+class TestTransactionArchive(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = Account.objects.create(
+            user=self.user, name='bank1', balance=100)
+        self.other = Account.objects.create(user=self.user, name='bank2')
+        self.category = Category.objects.create(
+            user=self.user, name='Home', of_type=Category.EXPENSE)
+        now = timezone.now()
+        for days in (1, 40, 400, 401, 402, 500, 700, 701):
+            for minutes, account in enumerate((self.account, self.other)):
+                Transaction.objects.create(
+                    account=account,
+                    name=f'Item {days}',
+                    value=days,
+                    type=(Transaction.INCOME if days % 2
+                        else Transaction.EXPENSE),
+                    date_time=now - timedelta(days=days, minutes=minutes),
+                    category=self.category
+                )
+        # Pending transactions stay live
+        Transaction.objects.create(
+            account=self.account,
+            name='Pending',
+            value=5,
+            type=Transaction.EXPENSE,
+            status=Transaction.PENDING,
+            date_time=now - timedelta(days=450)
+        )
+    
+    def list_ids(self, path='/v1/transaction/', **params):
+        response = self.client.get(path, {'page_size': 3, **params})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            ids.extend(transaction['id'] for transaction in data['results'])
+            if not data['next']:
+                return data['count'], ids
+            response = self.client.get(data['next'])
+    
+    def test_archive(self):
+        old = timezone.now() - timedelta(days=600)
+        queries = [
+            {},
+            {'type': Transaction.INCOME},
+            {'account_id': self.account.id},
+            {'begin_at': old.isoformat(), 'end_at': timezone.now()},
+        ]
+        before = [self.list_ids(**params) for params in queries]
+        accounts = self.client.get(
+            '/v1/account/', {'with_stats': 1}).json()
+        call_command(
+            'archive_transactions', chunk_size=2, stdout=StringIO())
+        self.assertEqual(Transaction.objects.count(), 5)
+        months = TransactionArchive.objects.count()
+        archived = TransactionArchive.objects.filter(
+            account=self.account).aggregate(
+                count=dbsum(F('income_count') + F('expense_count')))
+        self.assertEqual(archived['count'], 6)
+        for params, listed in zip(queries, before):
+            self.assertEqual(self.list_ids(**params), listed, params)
+        self.assertEqual(
+            self.client.get('/v1/account/', {'with_stats': 1}).json(),
+            accounts
+        )
+        # Archived rows keep their columns
+        response = self.client.get('/v1/transaction/', {
+            'account_id': self.account.id, 'page_size': 200})
+        transaction = response.json()['results'][-1]
+        self.assertEqual(transaction['name'], 'Item 701')
+        self.assertEqual(transaction['value'], '701.00')
+        self.assertEqual(transaction['type'], Transaction.INCOME)
+        self.assertEqual(transaction['category'], self.category.id)
+        self.assertEqual(transaction['account'], self.account.id)
+        response = self.client.get(f'/v1/transaction/{transaction["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), transaction)
+        # Running again moves nothing
+        call_command(
+            'archive_transactions', chunk_size=2, stdout=StringIO())
+        self.assertEqual(TransactionArchive.objects.count(), months)
+        self.category.delete()
+        response = self.client.get('/v1/transaction/', {'page_size': 200})
+        self.assertEqual(
+            {t['category'] for t in response.json()['results']}, {None})
+        response = self.client.get(f'/v1/transaction/{transaction["id"]}/')
+        self.assertIsNone(response.json()['category'])
+        other_user = User.objects.create_user(
+            username='Other', password='otherpassword')
+        self.client.credentials(HTTP_AUTHORIZATION=(
+            f'Token {Token.objects.create(user=other_user)}'))
+        response = self.client.get(f'/v1/transaction/{transaction["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_same_date_time(self):
+        # Rows sharing a date_time on both sides of the archive horizon
+        date_time = timezone.now() - timedelta(days=300)
+        for i in range(4):
+            for days in (0, 600):
+                Transaction.objects.create(
+                    account=self.account,
+                    name=f'Tie {i}',
+                    value=1,
+                    type=Transaction.EXPENSE,
+                    date_time=date_time - timedelta(days=days)
+                )
+        before = self.list_ids()
+        call_command('archive_transactions', stdout=StringIO())
+        count, ids = self.list_ids()
+        self.assertEqual((count, ids), before)
+        self.assertEqual(len(set(ids)), count)
+    
+    def test_async_list(self):
+        old = timezone.now() - timedelta(days=600)
+        queries = [
+            {},
+            {'type': Transaction.EXPENSE},
+            {'account_id': self.other.id},
+            {'begin_at': old.isoformat(), 'end_at': timezone.now()},
+        ]
+        before = [self.list_ids(**params) for params in queries]
+        call_command('archive_transactions', stdout=StringIO())
+        for params, listed in zip(queries, before):
+            self.assertEqual(
+                self.list_ids('/v1/async/transaction/', **params),
+                listed,
+                params
+            )
+
+class TestExport(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        account = Account.objects.create(
+            user=self.user, name='bank1', balance=1000)
+        other = Account.objects.create(user=self.user, name='bank2')
+        category = Category.objects.create(
+            user=self.user, name='Home', of_type=Category.EXPENSE)
+        Subcategory.objects.create(category=category, name='Rent')
+        card = CreditCard.objects.create(
+            account=account,
+            label='Ultra',
+            due_day=10,
+            invoice_day=30,
+            limit=3000
+        )
+        self.client.post(f'/v1/credit-card/{card.id}/expense/', {
+            'name': 'Phone',
+            'date_time': '2022-03-21T14:21:00',
+            'value': 300,
+            'repeat': CreditCardExpense.DIVIDED,
+            'total_parts': 3,
+            'category': category.id
+        })
+        self.client.post('/v1/transference/', {
+            'name': 'Savings',
+            'from_account': account.id,
+            'to_account': other.id,
+            'value': 50,
+            'date_time': '2022-03-22T10:00:00',
+        })
+        Transaction.objects.create(
+            account=account,
+            name='Old',
+            value=Decimal('10.25'),
+            type=Transaction.EXPENSE,
+            date_time=timezone.now() - timedelta(days=800, microseconds=7),
+            category=category
+        )
+        call_command('archive_transactions', stdout=StringIO())
+    
+    def snapshot(self):
+        return {
+            model.__name__: list(model.objects.order_by('pk').values())
+            for model, lookup in export.EXPORTED_MODELS
+            if model is not Transaction
+        }
+    
+    def test_export_import(self):
+        transactions = self.client.get(
+            '/v1/transaction/', {'page_size': 200}).json()['results']
+        rows = self.snapshot()
+        response = self.client.get('/v1/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual(manifest['user'], self.user.id)
+        self.assertEqual(manifest['counts'], {
+            'account.ndjson': 2,
+            'category.ndjson': 1,
+            'subcategory.ndjson': 1,
+            'transaction.ndjson': 6,
+            'creditcard.ndjson': 1,
+            'creditcardinvoice.ndjson': 3,
+            'creditcardexpense.ndjson': 3,
+            'transference.ndjson': 1,
+        })
+        delete_user_data(self.user.id, DEFAULT_DB_ALIAS)
+        with tempfile.NamedTemporaryFile(suffix='.zip') as file:
+            file.write(content)
+            file.flush()
+            call_command('import_user', file.name, stdout=StringIO())
+            self.assertEqual(self.snapshot(), rows)
+            # Archived transactions come back live
+            self.assertEqual(Transaction.objects.count(), 6)
+            self.assertEqual(
+                self.client.get(
+                    '/v1/transaction/', {'page_size': 200}
+                ).json()['results'],
+                transactions
+            )
+            with self.assertRaises(CommandError):
+                call_command('import_user', file.name, stdout=StringIO())
+    
+    def import_file(self, content):
+        with tempfile.NamedTemporaryFile(suffix='.zip') as file:
+            file.write(content)
+            file.flush()
+            call_command('import_user', file.name, stdout=StringIO())
+    
+    def test_archived_category_deleted(self):
+        category = Category.objects.create(
+            user=self.user, name='Car', of_type=Category.EXPENSE)
+        Transaction.objects.create(
+            account=Account.objects.get(name='bank1'),
+            name='Gas',
+            value=40,
+            type=Transaction.EXPENSE,
+            date_time=timezone.now() - timedelta(days=800),
+            category=category
+        )
+        call_command('archive_transactions', stdout=StringIO())
+        category.delete()
+        content = b''.join(export.export_user(self.user.id))
+        delete_user_data(self.user.id, DEFAULT_DB_ALIAS)
+        self.import_file(content)
+        self.assertIsNone(Transaction.objects.get(name='Gas').category_id)
+    
+    def test_import_missing_reference(self):
+        content = b''.join(export.export_user(self.user.id))
+        delete_user_data(self.user.id, DEFAULT_DB_ALIAS)
+        output = BytesIO()
+        with zipfile.ZipFile(BytesIO(content)) as source, \
+                zipfile.ZipFile(output, 'w') as target:
+            for name in source.namelist():
+                data = source.read(name)
+                if name == 'subcategory.ndjson':
+                    row = json.loads(data)
+                    row['category_id'] = 9999
+                    data = json.dumps(row).encode()
+                target.writestr(name, data)
+        with self.assertRaisesMessage(CommandError, 'missing'):
+            self.import_file(output.getvalue())
+        self.assertFalse(Account.objects.exists())
+    
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'export.zip'
+            call_command(
+                'export_user', user=self.user.id, output=path,
+                chunk_size=2, stdout=StringIO()
+            )
+            with zipfile.ZipFile(path) as archive:
+                lines = archive.read('transaction.ndjson').splitlines()
+        self.assertEqual(len(lines), 6)
+        old = json.loads(lines[-1])
+        self.assertEqual(old['name'], 'Old')
+        self.assertEqual(old['value'], '10.25')
+
 class TestCreditCard(BaseTestCase):
     def test_crud(self):
         account = Account(
@@ -623,6 +1569,295 @@ class TestCreditCardExpense(BaseTestCase):
         result = response.json()
         self.assertEqual(result['count'], 20)
         self.assertEqual(len(result['results']), 5)
+    
+    def test_invoice_cycle(self):
+        account = Account.objects.create(user=self.user, name='bank4')
+        card = CreditCard.objects.create(
+            account=account,
+            label='Top master',
+            due_day=5,
+            invoice_day=30,
+            limit=30000
+        )
+        for day in ('2022-02-10', '2022-02-27', '2022-02-28'):
+            response = self.client.post(
+                f'/v1/credit-card/{card.id}/expense/',
+                {'name': 'Book', 'date_time': f'{day}T12:00:00', 'value': 10}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        february, march = CreditCardInvoice.objects.filter(
+            credit_card=card).select_related('expense').order_by('cycle')
+        self.assertEqual(february.cycle.isoformat(), '2022-02-01')
+        self.assertEqual(february.period_begin.isoformat(), '2022-01-30')
+        self.assertEqual(february.period_end.isoformat(), '2022-02-27')
+        self.assertEqual(february.expense.value, 20)
+        self.assertEqual(march.period_begin.isoformat(), '2022-02-28')
+        self.assertEqual(march.period_end.isoformat(), '2022-03-29')
+        self.assertEqual(march.expense.value, 10)
+        self.assertEqual(
+            march.expense.date_time,
+            datetime.fromisoformat('2022-04-05T03:00:00+00:00')
+        )
+    
+    def test_invoice_created_concurrently(self):
+        account = Account.objects.create(user=self.user, name='bank5')
+        card = CreditCard.objects.create(
+            account=account,
+            label='Top master',
+            due_day=9,
+            invoice_day=2,
+            limit=30000
+        )
+        expense = {
+            'name': 'Book', 'date_time': '2022-03-23T12:00:00', 'value': 10}
+        self.client.post(f'/v1/credit-card/{card.id}/expense/', expense)
+        invoice = CreditCardInvoice.objects.get(credit_card=card)
+        # Another request creates the invoice between the lookup and insert
+        with mock.patch.object(
+                views, 'find_invoices',
+                side_effect=[{}, {invoice.cycle: invoice}]):
+            response = self.client.post(
+                f'/v1/credit-card/{card.id}/expense/', expense)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            CreditCardInvoice.objects.filter(credit_card=card).count(), 1)
+        self.assertEqual(
+            Transaction.objects.filter(account=account).count(), 1)
+        invoice.expense.refresh_from_db()
+        self.assertEqual(invoice.expense.value, 20)
+
+class TestCreditCardInvoice(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        account = Account.objects.create(user=self.user, name='bank1')
+        self.card = CreditCard.objects.create(
+            account=account,
+            label='Top master',
+            due_day=9,
+            invoice_day=2,
+            limit=30000
+        )
+        self.food = Category.objects.create(
+            user=self.user, name='Food', of_type=Category.EXPENSE)
+    
+    def add_expense(self, day, value, category=None):
+        response = self.client.post(
+            f'/v1/credit-card/{self.card.id}/expense/',
+            {
+                'name': 'Purchase',
+                'date_time': f'{day}T12:00:00',
+                'value': value,
+                **({'category': category.id} if category else {})
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def list_queries(self):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            response = self.client.get(
+                f'/v1/credit-card/{self.card.id}/invoice/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+    
+    def test_invoices(self):
+        self.add_expense('2022-03-10', 30, self.food)
+        queries = self.list_queries()
+        self.add_expense('2022-03-11', 20, self.food)
+        self.add_expense('2022-03-12', 5)
+        self.add_expense('2022-04-10', 7)
+        self.add_expense('2022-05-10', 8)
+        self.assertEqual(self.list_queries(), queries)
+        response = self.client.get(
+            f'/v1/credit-card/{self.card.id}/invoice/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        page = response.json()
+        self.assertEqual(
+            [invoice['period_begin'] for invoice in page['results']],
+            ['2022-05-02', '2022-04-02']
+        )
+        response = self.client.get(page['next'])
+        [march] = response.json()['results']
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(march['period_end'], '2022-04-01')
+        self.assertEqual(march['total'], '55.00')
+        self.assertEqual(march['expense_count'], 3)
+        self.assertEqual(march['status'], CreditCardInvoice.OPEN)
+        self.assertEqual(
+            march['categories'],
+            [
+                {'category': self.food.id, 'name': 'Food', 'total': '50.00',
+                    'expense_count': 2},
+                {'category': None, 'name': None, 'total': '5.00',
+                    'expense_count': 1},
+            ]
+        )
+        response = self.client.get(
+            f'/v1/credit-card/{self.card.id}/invoice/{march["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), march)
+        response = self.client.get(
+            f'/v1/credit-card/{self.card.id + 1}/invoice/{march["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def post_queries(self, data):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            response = self.client.post(
+                f'/v1/credit-card/{self.card.id}/expense/', data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), len(queries)
+    
+    def test_divided_purchase(self):
+        self.add_expense('2022-03-20', 10)
+        purchase = {
+            'name': 'Phone',
+            'date_time': '2022-03-10T12:00:00',
+            'value': 100,
+            'repeat': CreditCardExpense.DIVIDED,
+            'total_parts': 3
+        }
+        first_part, queries = self.post_queries(purchase)
+        self.assertEqual(first_part['part_number'], 1)
+        self.assertEqual(first_part['value'], '33.34')
+        other_purchase, other_queries = self.post_queries(
+            {**purchase, 'total_parts': 12})
+        self.assertEqual(other_queries, queries)
+        self.assertEqual(CreditCardInvoice.objects.count(), 12)
+        response = self.client.delete(
+            f'/v1/credit-card/{self.card.id}/expense/{other_purchase["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        parts = CreditCardExpense.objects.filter(
+            total_parts=3).select_related('invoice__expense').order_by(
+            'part_number')
+        self.assertEqual(
+            [
+                (part.invoice.period_begin.isoformat(), part.value)
+                for part in parts
+            ],
+            [
+                ('2022-03-02', Decimal('33.34')),
+                ('2022-04-02', Decimal('33.33')),
+                ('2022-05-02', Decimal('33.33')),
+            ]
+        )
+        self.assertEqual(parts[0].invoice.expense.value, Decimal('43.34'))
+        # The value of a divided purchase is its total
+        response = self.client.patch(
+            f'/v1/credit-card/{self.card.id}/expense/{parts[1].id}/',
+            {'value': 60, 'name': 'New phone'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['value'], '20.00')
+        self.assertEqual(
+            list(CreditCardInvoice.objects.filter(
+                credit_card=self.card
+            ).order_by('cycle').values_list('expense__value', flat=True)),
+            [Decimal('30.00'), Decimal('20.00'), Decimal('20.00')]
+        )
+        self.assertEqual(
+            CreditCardExpense.objects.filter(name='New phone').count(), 3)
+        response = self.client.patch(
+            f'/v1/credit-card/{self.card.id}/expense/{parts[1].id}/',
+            {'date_time': '2022-03-11T12:00:00'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(
+            f'/v1/credit-card/{self.card.id}/expense/{parts[2].id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        [invoice] = CreditCardInvoice.objects.filter(
+            credit_card=self.card).select_related('expense')
+        self.assertEqual(invoice.expense.value, 10)
+        self.assertEqual(invoice.creditcardexpense_set.count(), 1)
+        response = self.client.post(
+            f'/v1/credit-card/{self.card.id}/expense/',
+            {**purchase, 'total_parts': ''}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_used_limit(self):
+        self.add_expense('2022-03-20', 10)
+        response = self.client.post(
+            f'/v1/credit-card/{self.card.id}/expense/',
+            {
+                'name': 'Phone',
+                'date_time': '2022-03-10T12:00:00',
+                'value': 100,
+                'repeat': CreditCardExpense.DIVIDED,
+                'total_parts': 3
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f'/v1/credit-card/{self.card.id}/')
+        self.assertEqual(response.json()['used_limit'], '110.00')
+        self.assertEqual(response.json()['available_limit'], '29890.00')
+        # Paying an invoice frees its expenses
+        invoice = CreditCardInvoice.objects.filter(
+            credit_card=self.card).order_by('cycle').first()
+        response = self.client.patch(
+            f'/v1/transaction/{invoice.expense_id}/',
+            {'status': Transaction.EXECUTED}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.used_limit, Decimal('66.66'))
+        self.add_expense('2022-03-21', 5)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.used_limit, Decimal('66.66'))
+        with override_settings(CARD_LIMIT_ENFORCED=True):
+            response = self.client.post(
+                f'/v1/credit-card/{self.card.id}/expense/',
+                {'name': 'Car', 'date_time': '2022-04-10T12:00:00',
+                    'value': 29934}
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CreditCardExpense.objects.filter(name='Car').exists())
+        CreditCard.objects.filter(id=self.card.id).update(used_limit=0)
+        call_command('reconcile_card_limits', stdout=StringIO())
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.used_limit, Decimal('66.66'))
+
+    def test_close_invoices(self):
+        for day in ('2022-03-10', '2022-03-11', '2022-04-10', '2022-05-10'):
+            self.add_expense(day, 10)
+        # Stopped after its first chunk, the next run goes on
+        next(billing.close_invoices(
+            DEFAULT_DB_ALIAS, datetime(2022, 5, 3).date(), chunk_size=1))
+        self.assertEqual(
+            CreditCardInvoice.objects.filter(
+                status=CreditCardInvoice.CLOSED).count(),
+            1
+        )
+        call_command('close_invoices', chunk_size=1, stdout=StringIO())
+        invoices = CreditCardInvoice.objects.select_related('expense')
+        self.assertEqual(
+            [
+                (invoice.status, invoice.closed_total, invoice.expense.status)
+                for invoice in invoices.order_by('cycle')
+            ],
+            [
+                (CreditCardInvoice.PAID, 20, Transaction.EXECUTED),
+                (CreditCardInvoice.PAID, 10, Transaction.EXECUTED),
+                (CreditCardInvoice.PAID, 10, Transaction.EXECUTED),
+            ]
+        )
+        self.card.account.refresh_from_db()
+        self.assertEqual(self.card.account.balance, -40)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.used_limit, 0)
+        # Closed invoices are frozen
+        response = self.client.post(
+            f'/v1/credit-card/{self.card.id}/expense/',
+            {'name': 'Late', 'date_time': '2022-03-12T12:00:00', 'value': 5}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        expense = CreditCardExpense.objects.first()
+        response = self.client.delete(
+            f'/v1/credit-card/{self.card.id}/expense/{expense.id}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(
+            f'/v1/credit-card/{self.card.id}/expense/{expense.id}/',
+            {'name': 'Renamed'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 class TestTransference(BaseTestCase):
     def test_transference_create(self):
@@ -692,6 +1927,110 @@ class TestTransference(BaseTestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_transference_history(self):
+        accounts = [
+            Account.objects.create(user=self.user, name=name, balance=500)
+            for name in ('bank1', 'bank2', 'bank3')
+        ]
+        
+        def transfer(from_account, to_account, day):
+            response = self.client.post(
+                '/v1/transference/',
+                {
+                    'from_account': from_account.id,
+                    'to_account': to_account.id,
+                    'name': 'Transference',
+                    'date_time': f'2022-03-{day}T10:00:00',
+                    'value': 10
+                }
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        def history(**params):
+            with CaptureQueriesContext(
+                    connections[DEFAULT_DB_ALIAS]) as queries:
+                response = self.client.get('/v1/transference/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.json(), len(queries)
+        
+        transfer(accounts[0], accounts[1], 10)
+        page, queries = history()
+        transfer(accounts[1], accounts[2], 11)
+        transfer(accounts[2], accounts[0], 12)
+        page, more_queries = history()
+        self.assertEqual(more_queries, queries)
+        self.assertEqual(page['count'], 3)
+        latest = page['results'][0]
+        self.assertEqual(
+            latest['from_transaction']['account']['name'], 'bank3')
+        self.assertEqual(latest['to_transaction']['account']['name'], 'bank1')
+        self.assertEqual(latest['to_transaction']['value'], '10.00')
+        page, queries = history(account_id=accounts[2].id)
+        self.assertEqual(page['count'], 2)
+        page, queries = history(
+            begin_at='2022-03-11T00:00:00', end_at='2022-03-11T23:59:59')
+        self.assertEqual(
+            [item['from_transaction']['account']['name']
+                for item in page['results']],
+            ['bank2']
+        )
+
+    def test_bulk_transferences(self):
+        bank1, bank2, bank3 = (
+            Account.objects.create(
+                user=self.user, name=name, balance=balance)
+            for name, balance in (('bank1', 100), ('bank2', 0), ('bank3', 0))
+        )
+        
+        def transfer(from_account, to_account, value, executed=True):
+            return {
+                'from_account': from_account.id,
+                'to_account': to_account.id,
+                'name': 'Transference',
+                'date_time': '2022-03-10T10:00:00',
+                'value': value,
+                'executed': executed
+            }
+        
+        def post(transfers):
+            with CaptureQueriesContext(
+                    connections[DEFAULT_DB_ALIAS]) as queries:
+                response = self.client.post(
+                    '/v1/transference/bulk/', transfers, format='json')
+            return response, len(queries)
+        
+        self.client.get('/v1/transference/')
+        response, queries = post([transfer(bank1, bank3, 1)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Later transfers can spend what earlier ones moved
+        response, more_queries = post([
+            transfer(bank1, bank2, 60),
+            transfer(bank2, bank3, 50),
+            transfer(bank1, bank3, 30, executed=False),
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(more_queries, queries)
+        for account, balance in ((bank1, 39), (bank2, 10), (bank3, 51)):
+            account.refresh_from_db()
+            self.assertEqual(account.balance, balance)
+        self.assertEqual(Transference.objects.count(), 4)
+        pending = Transference.objects.select_related(
+            'from_transaction', 'to_transaction').get(
+            from_transaction__status=Transaction.PENDING)
+        self.assertEqual(pending.from_transaction.account_id, bank1.id)
+        self.assertEqual(pending.to_transaction.account_id, bank3.id)
+        response, queries = post([
+            transfer(bank3, bank1, 10), transfer(bank1, bank2, 60)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['index'], 1)
+        self.assertEqual(Transference.objects.count(), 4)
+        other = Account.objects.create(
+            user=User.objects.create_user(username='Other', password='other'),
+            name='bank4'
+        )
+        response, queries = post([transfer(bank1, other, 10)])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 class TestUserExtras(BaseTestCase):
     def test_create_update(self):
         self.admin = User.objects.create_user(
@@ -757,3 +2096,401 @@ class TestUserExtras(BaseTestCase):
             )
         self.assertEqual(
             response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    def test_throttling_tier_cached(self):
+        uext = UserExtras(user=self.user, type=UserExtras.STARNDARD)
+        uext.save()
+        request = APIRequestFactory().get('/v1/')
+        request.user = self.user
+        throttle = PremiumUserRateThrottle()
+        with self.assertNumQueries(1):
+            self.assertTrue(throttle.allow_request(request, None))
+        self.assertEqual(throttle.scope, 'user')
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                PremiumUserRateThrottle().allow_request(request, None))
+        # tier changes invalidate the cached scope
+        self.admin = User.objects.create_user(
+            username='AdminUser',
+            password='admintestpassword',
+            is_superuser=True,
+            is_staff=True
+        )
+        token = Token.objects.get_or_create(user=self.admin)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token[0]}')
+        response = self.client.patch(
+            f'/v1/user-extras/user/{self.user.id}/',
+            {'type': UserExtras.PREMIUM}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        throttle = PremiumUserRateThrottle()
+        with self.assertNumQueries(1):
+            throttle.allow_request(request, None)
+        self.assertEqual(throttle.scope, 'premium')
+        with self.assertNumQueries(0):
+            PremiumUserRateThrottle().allow_request(request, None)
+
+class TestAsyncViews(BaseTestCase):
+    def test_same_as_sync_views(self):
+        account = Account(
+            user=self.user,
+            name='Async bank',
+            initial_value=300,
+            balance=300
+        )
+        account.save()
+        Category(
+            user=self.user, name='Home', of_type=Category.EXPENSE).save()
+        for i in range(25):
+            Transaction(
+                account=account,
+                name=f'transaction {i}',
+                date_time=(
+                    datetime.fromisoformat('2022-04-10T16:50:00+03:00')
+                    + timedelta(i)
+                ),
+                value=10 + i,
+                type=choice((Transaction.EXPENSE, Transaction.INCOME))
+            ).save()
+        requests = [
+            ('account/', {}),
+            ('category/', {}),
+            ('category/', {'of_type': Category.INCOME}),
+            ('transaction/', {}),
+            ('transaction/', {'page': 2, 'type': Transaction.EXPENSE}),
+            ('transaction/', {
+                'account_id': account.id,
+                'begin_at': '2022-04-12T00:00:00',
+                'end_at': '2022-04-20T00:00:00'
+            }),
+            ('total-balance/', {}),
+        ]
+        for path, params in requests:
+            response = self.client.get(f'/v1/{path}', params)
+            async_response = self.client.get(f'/v1/async/{path}', params)
+            self.assertEqual(
+                async_response.status_code, response.status_code)
+            data = response.json()
+            async_data = async_response.json()
+            if 'next' in data:
+                for link in ('next', 'previous'):
+                    if data[link]:
+                        data[link] = data[link].replace('/v1/', '/v1/async/')
+            self.assertEqual(async_data, data)
+    
+    def test_requires_authentication(self):
+        self.client.credentials()
+        response = self.client.get('/v1/async/account/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/v1/async/account/')
+        self.assertEqual(
+            response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+class TestBenchmark(TransactionTestCase):
+    def setUp(self) -> None:
+        clear_caches()
+        token_cache.clear()
+        user_tier_cache.clear()
+    
+    def test_seed(self):
+        seeder = Seeder(accounts=2, transactions=20, months=3, seed=1)
+        users = seeder.seed(2)
+        self.assertEqual(len(users), 2)
+        self.assertEqual(seeder.counts['Account'], 4)
+        self.assertEqual(
+            CreditCardInvoice.objects.count(), seeder.counts['CreditCard'] * 3)
+        for account in Account.objects.all():
+            executed = Transaction.objects.filter(
+                account=account, status=Transaction.EXECUTED)
+            incomes = executed.filter(type=Transaction.INCOME).aggregate(
+                total=dbsum('value'))['total'] or 0
+            expenses = executed.filter(type=Transaction.EXPENSE).aggregate(
+                total=dbsum('value'))['total'] or 0
+            self.assertEqual(
+                account.balance, account.initial_value + incomes - expenses)
+        for invoice in CreditCardInvoice.objects.all():
+            self.assertEqual(
+                invoice.expense.value,
+                invoice.creditcardexpense_set.aggregate(
+                    total=dbsum('value'))['total']
+            )
+    
+    def test_run(self):
+        self.assertEqual(benchmark.uncovered_routes(), [])
+        Seeder(accounts=2, transactions=5, months=1, seed=1).seed(2)
+        report = benchmark.run(
+            [1, 2], 4, only=['GET account/', 'GET total-balance/'], seed=1)
+        self.assertEqual(
+            set(report['results']), {'GET account/', 'GET total-balance/'})
+        for levels in report['results'].values():
+            self.assertEqual(set(levels), {'1', '2'})
+            for result in levels.values():
+                self.assertEqual(result['errors'], {})
+                self.assertEqual(result['requests'], 4)
+                self.assertLessEqual(result['p50'], result['p99'])
+        self.assertTrue(list(benchmark.compare(report, report)))
+
+class TestQueryAudit(TransactionTestCase):
+    def setUp(self) -> None:
+        clear_caches()
+    
+    def test_queries_do_not_grow_or_scan(self):
+        admin_token = None
+        audits = []
+        for users, seeder in (
+                (1, Seeder(accounts=2, transactions=10, months=1, seed=1)),
+                (5, Seeder(accounts=4, transactions=60, cards=2, months=6,
+                    seed=2))):
+            user = seeder.seed(users)[0]
+            if admin_token is None:
+                admin_token = benchmark.bench_token(
+                    User.objects.get(username=benchmark.BENCH_ADMIN))
+            audits.append(query_audit.audit(
+                benchmark.BenchUser(user, admin_token, Random(users))))
+        self.assertEqual(query_audit.regressions(audits), [])
+
+class TestInstrumentation(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.account = Account.objects.create(user=self.user, name='Bank')
+        for i in range(3):
+            Transaction.objects.create(
+                account=self.account,
+                name=f'transaction {i}',
+                value=10,
+                type=Transaction.EXPENSE
+            )
+    
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+    
+    @override_settings(
+        PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=True, PERF_LOG_THRESHOLD_MS=0)
+    def test_server_timing_and_log(self):
+        with self.assertLogs('personal_finances.performance') as logs:
+            response = self.client.get('/v1/transaction/')
+            async_response = self.client.get('/v1/async/transaction/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = self.server_timing(response)
+        for phase in ('auth', 'throttle', 'db', 'serialize', 'render'):
+            self.assertIn(phase, metrics)
+            self.assertLessEqual(
+                float(metrics[phase]['dur']), float(metrics['total']['dur']))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['route'], 'v1/transaction/')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+        self.assertEqual(
+            metrics['queries']['desc'], f'"{line["queries"]} queries"')
+        self.assertIn('serialize', self.server_timing(async_response))
+        self.assertEqual(len(logs.records), 2)
+    
+    @override_settings(
+        PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=True,
+        PERF_LOG_THRESHOLD_MS=60000)
+    def test_log_threshold(self):
+        with self.assertNoLogs('personal_finances.performance'):
+            response = self.client.get('/v1/account/')
+        self.assertIn('Server-Timing', response)
+    
+    @override_settings(PERF_SAMPLE_RATE=0, PERF_SERVER_TIMING=True)
+    def test_not_sampled(self):
+        response = self.client.get('/v1/account/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+    
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=False)
+    def test_server_timing_off(self):
+        response = self.client.get('/v1/account/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+class TestMetrics(BaseTestCase):
+    def test_endpoint(self):
+        self.client.get('/v1/account/')
+        response = self.client.get('/v1/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_user(
+            username='MetricsAdmin', password='metricspassword', is_staff=True)
+        token = Token.objects.create(user=admin)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.get('/v1/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn(
+            'http_requests_total{method="GET",route="v1/account/",'
+            'status="200"}',
+            text
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{method="GET",'
+            'route="v1/account/",le="+Inf"}',
+            text
+        )
+        self.assertIn(
+            'db_queries_per_request_count{route="v1/account/"}', text)
+        self.assertIn('local_cache_misses_total{cache="token"}', text)
+    
+    def test_mmap_store_aggregates_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = []
+            for identifier in ('worker_a', 'worker_b'):
+                registry = MetricsRegistry(MmapStore(directory, identifier))
+                workers.append((
+                    registry.counter('requests_total', 'Requests.', ['route']),
+                    registry.histogram(
+                        'latency_seconds', 'Latency.', buckets=[0.1, 1])
+                ))
+            for counter, histogram in workers:
+                counter.inc(route='a/')
+                histogram.observe(0.5)
+            workers[0][0].inc(2, route='b/')
+            # More keys than fit in the initial file size
+            for number in range(2000):
+                workers[1][0].inc(route=f'route/{number}/')
+            text = registry.exposition()
+            self.assertIn('requests_total{route="a/"} 2\n', text)
+            self.assertIn('requests_total{route="b/"} 2\n', text)
+            self.assertIn('requests_total{route="route/1999/"} 1\n', text)
+            self.assertIn('latency_seconds_bucket{le="0.1"} 0\n', text)
+            self.assertIn('latency_seconds_bucket{le="1"} 2\n', text)
+            self.assertIn('latency_seconds_bucket{le="+Inf"} 2\n', text)
+            self.assertIn('latency_seconds_sum 1\n', text)
+            reopened = MmapValues(Path(directory) / 'worker_a.db')
+            reopened.add(
+                json.dumps(['requests_total', '', [['route', 'a/']]]), 1)
+            self.assertIn(
+                'requests_total{route="a/"} 3\n', registry.exposition())
+
+class TestBackup(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = self.directory / 'source.sqlite3'
+        self.db = sqlite3.connect(self.source, isolation_level=None)
+        self.addCleanup(self.db.close)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute(
+            'CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+        self.insert(0, 500)
+    
+    def insert(self, start, stop):
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.executemany(
+            'INSERT INTO item VALUES (?, ?)',
+            [(number, 'x' * 200) for number in range(start, stop)]
+        )
+        self.db.execute('COMMIT')
+    
+    def count(self, path):
+        return backup.verify_database(path)[1]['item']
+    
+    def test_backup_while_writing(self):
+        target = self.directory / 'backup.sqlite3'
+        with mock.patch.object(backup.time, 'time_ns', return_value=1):
+            backup.backup_database(self.source, target, pages=2, sleep=0)
+        problems, counts = backup.verify_database(target)
+        self.assertEqual(problems, [])
+        self.assertEqual(counts, {'item': 500})
+        self.assertEqual(backup.backup_started_at(target), 1)
+        self.assertFalse(Path(f'{target}-wal').exists())
+        with self.assertRaises(backup.BackupError):
+            backup.backup_database(self.source, target)
+        # A write lock held by a writer does not stop the copy
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.execute("INSERT INTO item (name) VALUES ('z')")
+        second = self.directory / 'second.sqlite3'
+        backup.backup_database(self.source, second, pages=1, sleep=0)
+        self.db.execute('COMMIT')
+        self.assertEqual(self.count(second), 500)
+    
+    def test_restore_point_in_time(self):
+        wal = self.directory / 'wal'
+        archiver = backup.WalArchiver(self.source, wal)
+        self.addCleanup(archiver.close)
+        archiver.archive()
+        base = self.directory / 'base.sqlite3'
+        backup.backup_database(self.source, base)
+        self.insert(500, 600)
+        self.assertGreater(archiver.archive(), 0)
+        middle = timezone.now()
+        sleep(0.01)
+        self.insert(600, 700)
+        archiver.archive()
+        self.db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        salts = archiver.state['salts']
+        self.assertEqual(archiver.archive(), 0)
+        # Every frame was archived and checkpointed, the WAL restarts
+        self.insert(700, 800)
+        archiver.archive()
+        self.assertNotEqual(archiver.state['salts'], salts)
+        self.insert(800, 900)
+        self.db.execute('DELETE FROM item WHERE id < 100')
+        archiver.archive()
+        
+        restored = self.directory / 'restored.sqlite3'
+        self.assertEqual(
+            backup.restore_database(base, restored, wal), 4)
+        problems, counts = backup.verify_database(restored)
+        self.assertEqual(problems, [])
+        self.assertEqual(counts, {'item': 800})
+        self.assertEqual(
+            sqlite3.connect(restored).execute(
+                'SELECT min(id), max(id) FROM item').fetchone(),
+            (100, 899)
+        )
+        before = self.directory / 'before.sqlite3'
+        backup.restore_database(base, before, wal, until=middle)
+        self.assertEqual(self.count(before), 600)
+        with self.assertRaises(backup.BackupError):
+            backup.restore_database(base, before, wal)
+    
+    def test_archive_lets_writers_go_on(self):
+        archiver = backup.WalArchiver(self.source, self.directory / 'wal')
+        self.addCleanup(archiver.close)
+        self.insert(500, 5000)
+        waits = []
+        def insert():
+            with closing(sqlite3.connect(
+                    self.source, isolation_level=None, timeout=1)) as db:
+                started = timezone.now()
+                db.execute("INSERT INTO item (name) VALUES ('z')")
+                waits.append(timezone.now() - started)
+        fsync = backup.os.fsync
+        def fsync_while_writing(fd):
+            writer = threading.Thread(target=insert)
+            writer.start()
+            writer.join()
+            fsync(fd)
+        with mock.patch.object(backup.os, 'fsync', fsync_while_writing):
+            self.assertGreater(archiver.archive(), 0)
+        # The write lock is released before the segment is written
+        self.assertEqual(len(waits), 1)
+        self.assertLess(waits[0], timedelta(seconds=0.25))
+        # The row written meanwhile goes to the next segment
+        self.assertGreater(archiver.archive(), 0)
+        self.assertEqual(len(backup.segments(self.directory / 'wal')), 2)
+    
+    def test_restore_command(self):
+        base = self.directory / 'base.sqlite3'
+        backup.backup_database(self.source, base)
+        output = StringIO()
+        call_command('restore_db', str(base), stdout=output)
+        self.assertIn('item: 500 rows', output.getvalue())
+        self.assertIn('is consistent', output.getvalue())
+        with open(base, 'r+b') as file:
+            # The page type of the second page
+            file.seek(4096)
+            file.write(b'\xff')
+        with self.assertRaises(CommandError):
+            call_command('restore_db', str(base), stdout=StringIO())
+    
+    def test_archive_requires_wal(self):
+        self.db.execute('PRAGMA journal_mode = DELETE')
+        with self.assertRaises(backup.BackupError):
+            backup.WalArchiver(self.source, self.directory / 'wal')
@@ -1,26 +1,55 @@
 from rest_framework.throttling import UserRateThrottle
 
+from personal_finances.api_server.cache import user_tier_cache
+from personal_finances.api_server.instrumentation import timed
+from personal_finances.api_server.metrics import THROTTLED
 from personal_finances.api_server.models import UserExtras
 
+_rate_table = (None, {})
+
+def get_rate_table(rates):
+    """Map every throttle scope to its pre-parsed (rate, num, duration).
+
+    The table is built once per rates dict, so the rate strings are not
+    parsed again on each request.
+    """
+    global _rate_table
+    source, table = _rate_table
+    if source is not rates:
+        table = {
+            scope: (rate, *UserRateThrottle.parse_rate(None, rate))
+            for scope, rate in rates.items()
+        }
+        _rate_table = (rates, table)
+    return table
+
+def get_user_scope(user):
+    """Return the throttle scope of a user, cached by user id."""
+    if not user.is_authenticated:
+        return 'anon'
+    if user.is_staff:
+        return 'admin'
+    scope = user_tier_cache.get(user.pk)
+    if scope is None:
+        usertype = UserExtras.objects.filter(
+            user=user.pk).values_list('type', flat=True).first()
+        scope = 'premium' if usertype == UserExtras.PREMIUM else 'user'
+        user_tier_cache.set(user.pk, scope)
+    return scope
+
 class PremiumUserRateThrottle(UserRateThrottle):
     def __init__(self):
         pass
-    
+
     def allow_request(self, request, view):
-        self.rate = self.get_rate()
-        user = request.user
-        if user.is_staff:
-            self.scope = 'admin'
-            self.rate = self.get_rate()
-            self.num_requests, self.duration = self.parse_rate(self.rate)
-            return super().allow_request(request, view)
-        try:
-            usertype = user.userextras.type
-        except UserExtras.DoesNotExist:
-            return self.throttle_failure()
-        if usertype == UserExtras.PREMIUM:
-            self.scope = 'premium'
-            self.rate = self.get_rate()
-            
-        self.num_requests, self.duration = self.parse_rate(self.rate)
-        return super().allow_request(request, view)
\ No newline at end of file
+        # Sub-requests of a batch were counted with the batch
+        if getattr(request, 'batched', False):
+            return True
+        with timed('throttle'):
+            self.scope = get_user_scope(request.user)
+            self.rate, self.num_requests, self.duration = get_rate_table(
+                self.THROTTLE_RATES)[self.scope]
+            allowed = super().allow_request(request, view)
+        if not allowed:
+            THROTTLED.inc(scope=self.scope)
+        return allowed
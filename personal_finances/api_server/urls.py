@@ -1,6 +1,5 @@
 from django.urls import path
-from rest_framework.authtoken import views as authviews
-from personal_finances.api_server import views
+from personal_finances.api_server import async_views, views
 from rest_framework.routers import SimpleRouter
 
 router = SimpleRouter()
@@ -8,13 +7,15 @@ router.register('user', views.UserManagement)
 
 apiurlpatterns = [
     path('', views.home),
-    path('login/', authviews.obtain_auth_token),
+    path('login/', views.LoginView.as_view()),
     path('delete-token/', views.delete_token),
+    path('rotate-token/', views.rotate_auth_token),
     path('change-password/', views.change_password),
     path('account/', views.AccountView.as_view()),
     path('account/<int:id>/', views.AccountView.as_view()),
     path('category/', views.CategoryView.as_view()),
     path('category/<int:id>/', views.CategoryView.as_view()),
+    path('category/tree/', views.get_category_tree),
     path('subcategory/', views.SubcategoryView.as_view()),
     path('subcategory/<int:id>/', views.SubcategoryView.as_view()),
     path('transaction/', views.TransactionView.as_view()),
@@ -29,10 +30,27 @@ apiurlpatterns = [
         'credit-card/<int:credit_card_id>/expense/<int:id>/',
         views.CreditCardExpenseView.as_view()
     ),
-    path('transference/', views.create_transference),
+    path(
+        'credit-card/<int:credit_card_id>/invoice/',
+        views.CreditCardInvoiceView.as_view()
+    ),
+    path(
+        'credit-card/<int:credit_card_id>/invoice/<int:id>/',
+        views.CreditCardInvoiceView.as_view()
+    ),
+    path('transference/', views.TransferenceView.as_view()),
+    path('transference/bulk/', views.create_transferences),
     path('total-balance/', views.get_total_balance),
+    path('dashboard/', views.get_dashboard),
+    path('batch/', views.run_batch),
+    path('export/', views.export_data),
+    path('metrics/', views.get_metrics),
     path('user-extras/', views.UserExtrasView.as_view()),
     path('user-extras/user/<int:user_id>/', views.UserExtrasView.as_view()),
+    path('async/account/', async_views.account_list),
+    path('async/category/', async_views.category_list),
+    path('async/transaction/', async_views.transaction_list),
+    path('async/total-balance/', async_views.total_balance),
 ]
 
 apiurlpatterns.extend(router.urls)
\ No newline at end of file
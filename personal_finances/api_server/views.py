@@ -1,28 +1,49 @@
-from decimal import Decimal
+import hashlib
+from collections import defaultdict
+from decimal import ROUND_DOWN, Decimal
 
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from django.db import transaction as dbtnsac
+from django.db import IntegrityError
+from django.db.models import Count, F, Prefetch, Q
 from django.db.models import Sum as dbsum
 from django.forms import ValidationError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import status, viewsets
 from rest_framework.authtoken.models import Token
-from rest_framework.decorators import api_view
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.decorators import (api_view, permission_classes,
+    throttle_classes)
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from personal_finances.api_server import (archive, batch, dashboard,
+    deletion, export)
+from personal_finances.api_server.authentication import (invalidate_token,
+    invalidate_user_tokens, is_token_expired, rotate_token)
+from personal_finances.api_server.billing import add_by_id
+from personal_finances.api_server.metrics import CONTENT_TYPE, registry
 from personal_finances.api_server.models import (Account, Category, CreditCard,
     CreditCardExpense, CreditCardInvoice, Subcategory, Transaction,
-    Transference)
-from personal_finances.api_server.pagination import PageNumberCustomPagination
+    TransactionArchive, Transference)
+from personal_finances.api_server.pagination import (InvoiceCursorPagination,
+    PageNumberCustomPagination)
+from personal_finances.api_server.sharding import user_atomic
 from personal_finances.serializers import (AccountSerializer,
-    CategorySerializer, CategoryUpdateSerializer, CreditCardExpenseSerializer,
+    AccountStatsSerializer, BatchRequestSerializer, CategorySerializer,
+    CategoryTreeSerializer, CategoryUpdateSerializer,
+    CreditCardExpenseSerializer, CreditCardInvoiceSerializer,
     CreditCardSerializer, PasswordChangeSerializer, PeriodSerializer,
     SubcategorySerializer, SubcategoryUpdateSerializer, TransactionSerializer,
-    TransactionUpdateSerializer, TransferenceSerializer, UserExtrasSerializer,
-    UserSerializer, UserUpdateAsAdminSerializer, UserUpdateSerializer)
+    TransactionUpdateSerializer, TransferenceHistorySerializer,
+    TransferenceSerializer, UserExtrasSerializer, UserSerializer,
+    UserUpdateAsAdminSerializer, UserUpdateSerializer)
 
 
 @api_view(['GET'])
@@ -33,21 +54,42 @@ def home(request):
         status=status.HTTP_200_OK
     )
 
+class LoginView(ObtainAuthToken):
+    authentication_classes = ()
+    
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        if not created and is_token_expired(token):
+            token = rotate_token(user)
+        return Response({'token': token.key})
+
 @api_view(['DELETE'])
 def delete_token(request):
     delete_result = Token.objects.filter(user=request.user).delete()
+    invalidate_token(request.auth.key)
     return Response(
         {'deleted': delete_result[0]},
         status=status.HTTP_204_NO_CONTENT
     )
 
+@api_view(['POST'])
+def rotate_auth_token(request):
+    token = rotate_token(request.user)
+    return Response({'token': token.key}, status=status.HTTP_200_OK)
+
 class UserManagement(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserUpdateSerializer
     def get_queryset(self):
+        users = User.objects.filter(
+            userdeletion__isnull=True
+        ).prefetch_related('groups', 'user_permissions')
         if self.request.user.is_staff:
-            return User.objects.all()
-        return User.objects.filter(id=self.request.user.id)
+            return users.all()
+        return users.filter(id=self.request.user.id)
     def get_permissions(self):
         permission_classes = [IsAuthenticated]
         if self.action in ['create', 'list', 'destroy']:
@@ -59,6 +101,11 @@ class UserManagement(viewsets.ModelViewSet):
                 return UserUpdateAsAdminSerializer
             return UserSerializer
         return self.serializer_class
+    def perform_update(self, serializer):
+        user = serializer.save()
+        invalidate_user_tokens(user.id)
+    def perform_destroy(self, instance):
+        deletion.mark_user_deleted(instance)
 
 @api_view(['POST'])
 def change_password(request):
@@ -81,6 +128,7 @@ def change_password(request):
     user.set_password(pass_srz.validated_data['new_password'])
     user.save()
     Token.objects.filter(user=request.user).delete()
+    invalidate_token(request.auth.key)
     return Response(
             {'message': 'change successful'},
             status=status.HTTP_200_OK)
@@ -95,6 +143,15 @@ class AccountView(APIView):
             return Response(
                 AccountSerializer(account).data, status=status.HTTP_200_OK)
         accounts = Account.objects.filter(user=request.user)
+        if request.query_params.get('with_stats') in ('1', 'true'):
+            month_begin = timezone.localtime().replace(
+                day=1, hour=0, minute=0, second=0, microsecond=0)
+            accounts = accounts.with_stats(
+                month_begin, month_begin + relativedelta(months=1))
+            return Response(
+                AccountStatsSerializer(accounts, many=True).data,
+                status=status.HTTP_200_OK
+            )
         return Response(
             AccountSerializer(accounts, many=True).data,
             status=status.HTTP_200_OK
@@ -126,11 +183,10 @@ class AccountView(APIView):
         return Response(account_srz.data, status=status.HTTP_200_OK)
     
     def delete(self, request, id):
-        try:
-            account = Account.objects.get(id=id, user=request.user)
-        except Account.DoesNotExist:
+        deleted = deletion.mark_accounts_deleted(
+            Account.objects.filter(id=id, user=request.user))
+        if not deleted:
             return Response({}, status=status.HTTP_404_NOT_FOUND)
-        account.delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
 class CategoryView(APIView):
@@ -181,6 +237,30 @@ class CategoryView(APIView):
         category.delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+def conditional_response(request, data):
+    """Answer ``data`` with its ETag, or 304 if the client already has it."""
+    etag = quote_etag(
+        hashlib.sha256(JSONRenderer().render(data)).hexdigest())
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(data, status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    return response
+
+@api_view(['GET'])
+def get_category_tree(request):
+    categories = Category.objects.filter(
+        user=request.user
+    ).order_by('id').prefetch_related(
+        Prefetch('subcategory_set', Subcategory.objects.order_by('id')))
+    of_type = request.query_params.get('of_type')
+    if of_type:
+        categories = categories.filter(of_type=of_type)
+    return conditional_response(
+        request, CategoryTreeSerializer(categories, many=True).data)
+
 class SubcategoryView(APIView):
     def get(self, request, id=None):
         if id:
@@ -243,6 +323,10 @@ class TransactionView(APIView):
                 transaction = Transaction.objects.get(
                     id=id, account__user=request.user)
             except Transaction.DoesNotExist:
+                transaction = archive.archived_transaction(
+                    TransactionArchive.objects.filter(
+                        account__user=request.user), id)
+            if transaction is None:
                 return Response({}, status=status.HTTP_404_NOT_FOUND)
             return Response(
                 TransactionSerializer(transaction).data,
@@ -257,19 +341,25 @@ class TransactionView(APIView):
         if transaction_type == Transaction.EXPENSE:
             transactions = Transaction.expenses.filter(
                 account__user=request.user)
+        archives = TransactionArchive.objects.filter(
+            account__user=request.user)
         account_id = request.query_params.get('account_id')
         if account_id:
             transactions = transactions.filter(account__id=account_id)
+            archives = archives.filter(account__id=account_id)
+        begin_at = end_at = None
         if (request.query_params.get('begin_at')
                 or request.query_params.get('end_at')):
             period_srz = PeriodSerializer(data=request.query_params)
             if not period_srz.is_valid():
                 return Response(
                     period_srz.errors, status=status.HTTP_400_BAD_REQUEST)
+            begin_at = period_srz.validated_data['begin_at']
+            end_at = period_srz.validated_data['end_at']
             transactions = transactions.filter(
-                date_time__gte=period_srz.validated_data['begin_at'],
-                date_time__lte=period_srz.validated_data['end_at']
-            )
+                date_time__gte=begin_at, date_time__lte=end_at)
+        transactions = archive.read_through(
+            transactions, archives, transaction_type, begin_at, end_at)
         pagination = PageNumberCustomPagination()
         return pagination.get_paginated_response(
                 TransactionSerializer(
@@ -284,7 +374,7 @@ class TransactionView(APIView):
         if not transaction_srz.is_valid():
             return Response(
                 transaction_srz.errors, status=status.HTTP_400_BAD_REQUEST)
-        with dbtnsac.atomic():
+        with user_atomic():
             transaction = transaction_srz.save()
             account = transaction.account
             if transaction.status == Transaction.EXECUTED:
@@ -298,8 +388,12 @@ class TransactionView(APIView):
     
     def patch(self, request, id):
         try:
-            transaction = Transaction.objects.get(
-                id=id, account__user=request.user)
+            transaction = Transaction.objects.select_related(
+                'account',
+                'transference_to__to_transaction',
+                'transference_from__from_transaction',
+                'creditcardinvoice'
+            ).get(id=id, account__user=request.user)
         except Transaction.DoesNotExist:
             return Response({}, status=status.HTTP_404_NOT_FOUND)
         transaction_srz = TransactionUpdateSerializer(
@@ -307,8 +401,9 @@ class TransactionView(APIView):
         if not transaction_srz.is_valid():
             return Response(
                 transaction_srz.errors, status=status.HTTP_400_BAD_REQUEST)
-        with dbtnsac.atomic():
+        with user_atomic():
             last_value = transaction.value
+            last_status = transaction.status
             new_transaction = transaction_srz.save()
             account = new_transaction.account
             if transaction.status == Transaction.EXECUTED:
@@ -330,17 +425,29 @@ class TransactionView(APIView):
                         new_transaction.transference_from.from_transaction)
                     from_transaction.value = new_transaction.value
                     from_transaction.save()
+            invoice = getattr(new_transaction, 'creditcardinvoice', None)
+            if invoice and new_transaction.status != last_status:
+                # A paid invoice no longer uses the card limit
+                add_to_used_limit(
+                    invoice.credit_card_id,
+                    -last_value if last_status == Transaction.PENDING
+                        else last_value
+                )
         transaction_srz = TransactionSerializer(new_transaction)
         return Response(transaction_srz.data, status=status.HTTP_200_OK)
     
     def delete(self, request, id):
         try:
-            transaction = Transaction.objects.get(
-                id=id, account__user=request.user)
+            transaction = Transaction.objects.select_related(
+                'account',
+                'transference_to__to_transaction',
+                'transference_from__from_transaction',
+                'creditcardinvoice'
+            ).get(id=id, account__user=request.user)
         except Transaction.DoesNotExist:
             return Response({}, status=status.HTTP_404_NOT_FOUND)
         account = transaction.account
-        with dbtnsac.atomic():
+        with user_atomic():
             if transaction.status == Transaction.EXECUTED:
                 if transaction.type == Transaction.INCOME:
                     account.balance -= transaction.value
@@ -358,6 +465,9 @@ class TransactionView(APIView):
                     from_transaction = transference.from_transaction
                     transference.delete()
                     from_transaction.delete()
+            invoice = getattr(transaction, 'creditcardinvoice', None)
+            if invoice and transaction.status == Transaction.PENDING:
+                add_to_used_limit(invoice.credit_card_id, -transaction.value)
             transaction.delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -422,6 +532,113 @@ class CreditCardView(APIView):
         card.delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+def split_value(value, parts):
+    """``value`` split in ``parts`` cent values, the remainder in the first."""
+    part = (value / parts).quantize(Decimal('0.01'), rounding=ROUND_DOWN)
+    return [value - part * (parts - 1)] + [part] * (parts - 1)
+
+def find_invoices(card, cycles):
+    return {
+        invoice.cycle: invoice
+        for invoice in CreditCardInvoice.objects.select_related(
+            'expense').filter(credit_card=card, cycle__in=cycles)
+    }
+
+def create_invoices(card, periods):
+    """Empty invoices of ``card`` for ``periods``, by cycle."""
+    expenses = Transaction.objects.bulk_create([
+        Transaction(
+            account_id=card.account_id,
+            name=f'{card.name} invoice',
+            date_time=due_time,
+            value=Decimal(0),
+            type=Transaction.EXPENSE,
+            status=Transaction.PENDING,
+            repeat=Transaction.ONE_TIME
+        )
+        for period_begin, period_end, due_time in periods.values()
+    ])
+    invoices = CreditCardInvoice.objects.bulk_create([
+        CreditCardInvoice(
+            credit_card=card,
+            expense=expense,
+            period_begin=period_begin,
+            period_end=period_end,
+            cycle=cycle
+        )
+        for expense, (cycle, (period_begin, period_end, due_time)) in zip(
+            expenses, periods.items())
+    ])
+    return {invoice.cycle: invoice for invoice in invoices}
+
+def get_or_create_invoices(card, dates):
+    """Invoices of ``card`` for purchases on each of ``dates``.
+
+    One query finds the existing invoices and two bulk inserts create the
+    missing ones. When a concurrent request creates one of them first, the
+    unique cycle makes the inserts fail and the lookup runs again.
+    """
+    cycles = []
+    periods = {}
+    for date in dates:
+        cycle, *period = card.invoice_period(date)
+        cycles.append(cycle)
+        periods[cycle] = period
+    for attempt in range(2):
+        invoices = find_invoices(card, periods)
+        missing = {
+            cycle: period for cycle, period in periods.items()
+            if cycle not in invoices
+        }
+        if not missing:
+            break
+        try:
+            with user_atomic():
+                invoices.update(create_invoices(card, missing))
+            break
+        except IntegrityError:
+            if attempt:
+                raise
+    return [invoices[cycle] for cycle in cycles]
+
+def add_to_invoice_totals(amounts):
+    """Add ``amounts``, by invoice transaction id, to the invoice totals."""
+    add_by_id(Transaction.objects.all(), 'value', amounts)
+
+class LimitExceeded(Exception):
+    pass
+
+class InvoiceClosed(Exception):
+    pass
+
+def add_to_used_limit(card_id, amount, enforce_limit=False):
+    """Add ``amount`` to the used limit of a card.
+
+    With ``enforce_limit`` an increase past the card limit raises
+    ``LimitExceeded`` and leaves the counter as it was.
+    """
+    if not amount:
+        return
+    cards = CreditCard.objects.filter(id=card_id)
+    if enforce_limit and amount > 0:
+        cards = cards.filter(used_limit__lte=F('limit') - amount)
+    if not cards.update(used_limit=F('used_limit') + amount) and enforce_limit:
+        raise LimitExceeded
+
+def unpaid(invoice):
+    return invoice.expense.status == Transaction.PENDING
+
+def purchase_parts(card_expense):
+    """Every part of the purchase of ``card_expense``, in order."""
+    if card_expense.repeat != CreditCardExpense.DIVIDED:
+        return [card_expense]
+    first_part = card_expense.first_part_id or card_expense.id
+    return list(CreditCardExpense.objects.select_related(
+        'invoice__expense'
+    ).filter(
+        Q(id=first_part) | Q(first_part_id=first_part)
+    ).order_by('part_number'))
+
 class CreditCardExpenseView(APIView):
     def get(self, request, credit_card_id, id=None):
         if id:
@@ -473,65 +690,70 @@ class CreditCardExpenseView(APIView):
             return Response(
                 {'message': 'credit card not found'},
                 status=status.HTTP_404_NOT_FOUND)
-        with dbtnsac.atomic():
-            try:
-                card_invoice = CreditCardInvoice.objects.get(
-                    credit_card=card,
-                    period_begin__lte=(
-                        expense_srz.validated_data['date_time'].date()),
-                    period_end__gt=(
-                        expense_srz.validated_data['date_time'].date())
-                )
-                card_invoice_expense = card_invoice.expense
-                card_invoice_expense.value += Decimal(
-                    expense_srz.validated_data['value'])
-                card_invoice_expense.save()
-            except CreditCardInvoice.DoesNotExist:
-                invoice_date = (
-                        expense_srz.validated_data['date_time'])
-                invoice_date = invoice_date + relativedelta(
-                    day=card.invoice_day,
-                    hour=0,
-                    minute=0,
-                    second=0
-                )
-                if (
-                        invoice_date
-                        <= expense_srz.validated_data['date_time']):
-                    invoice_date = invoice_date + relativedelta(months=1)
-                due_date = invoice_date + relativedelta(day=card.due_day)
-                if due_date <= invoice_date:
-                    due_date = due_date + relativedelta(months=1)
-                card_invoice_expense = Transaction(
-                    account=card.account,
-                    name=f'{card.name} invoice',
-                    date_time=due_date,
-                    value=Decimal(expense_srz.validated_data['value']),
-                    type=Transaction.EXPENSE,
-                    status=Transaction.PENDING,
-                    repeat=Transaction.ONE_TIME
+        data = expense_srz.validated_data
+        parts = 1
+        if data.get('repeat') == CreditCardExpense.DIVIDED:
+            # Each part goes to the invoice of the following month
+            parts = data['total_parts']
+        values = split_value(Decimal(data['value']), parts)
+        dates = [
+            data['date_time'] + relativedelta(months=number)
+            for number in range(parts)
+        ]
+        try:
+            with user_atomic():
+                invoices = get_or_create_invoices(
+                    card, [date_time.date() for date_time in dates])
+                if any(
+                        invoice.status != CreditCardInvoice.OPEN
+                        for invoice in invoices):
+                    raise InvoiceClosed
+                expense = expense_srz.save(
+                    invoice=invoices[0],
+                    value=values[0],
+                    **({'part_number': 1} if parts > 1 else {})
                 )
-                card_invoice_expense.save()
-                date_begin = (
-                        expense_srz.validated_data['date_time'].date())
-                date_begin = date_begin + relativedelta(
-                    day=card.invoice_day)
-                date_end = date_begin + relativedelta(
-                    months=1, days=-1)
-                card_invoice = CreditCardInvoice(
-                    credit_card=card,
-                    expense=card_invoice_expense,
-                    period_begin=date_begin,
-                    period_end=date_end
+                CreditCardExpense.objects.bulk_create([
+                    CreditCardExpense(**{
+                        **data,
+                        'invoice': invoice,
+                        'value': value,
+                        'date_time': date_time,
+                        'part_number': number,
+                        'first_part': expense,
+                    })
+                    for number, (invoice, value, date_time) in enumerate(
+                        zip(invoices, values, dates), start=1)
+                    if number > 1
+                ])
+                amounts = defaultdict(Decimal)
+                for invoice, value in zip(invoices, values):
+                    amounts[invoice.expense_id] += value
+                add_to_invoice_totals(amounts)
+                add_to_used_limit(
+                    card.id,
+                    sum(
+                        value for invoice, value in zip(invoices, values)
+                        if unpaid(invoice)
+                    ),
+                    enforce_limit=settings.CARD_LIMIT_ENFORCED
                 )
-                card_invoice.save()
-            expense = expense_srz.save(invoice=card_invoice)
+        except LimitExceeded:
+            return Response(
+                {'message': 'credit card limit exceeded'},
+                status=status.HTTP_400_BAD_REQUEST)
+        except InvoiceClosed:
+            return Response(
+                {'message': 'the invoice of this date is closed'},
+                status=status.HTTP_400_BAD_REQUEST)
         expense_srz = CreditCardExpenseSerializer(expense)
         return Response(expense_srz.data, status=status.HTTP_200_OK)
     
     def patch(self, request, credit_card_id, id):
         try:
-            card_expense = CreditCardExpense.objects.get(
+            card_expense = CreditCardExpense.objects.select_related(
+                'invoice__expense'
+            ).get(
                 id=id,
                 invoice__credit_card__id=credit_card_id,
                 invoice__credit_card__account__user=request.user
@@ -543,101 +765,308 @@ class CreditCardExpenseView(APIView):
         if not card_expense_srz.is_valid():
             return Response(
                 card_expense_srz.errors, status=status.HTTP_400_BAD_REQUEST)
-        with dbtnsac.atomic():
-            prev_value = card_expense.value
-            new_expense = card_expense_srz.save()
-            diff_value = new_expense.value - prev_value
-            card_invoice_expense = card_expense.invoice.expense
-            card_invoice_expense.value += diff_value 
-            card_invoice_expense.save()
+        changes = card_expense_srz.validated_data
+        parts = purchase_parts(card_expense)
+        installment_fields = {
+            'date_time', 'repeat', 'total_parts', 'part_number'}
+        if len(parts) > 1 and installment_fields & set(changes):
+            return Response(
+                {'message': 'delete and create the purchase again to change'
+                    ' its date or installments'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # The value of a divided purchase is the total of its parts
+        values = [part.value for part in parts]
+        if 'value' in changes:
+            values = split_value(Decimal(changes['value']), len(parts))
+        amounts = defaultdict(Decimal)
+        used = Decimal(0)
+        for part, value in zip(parts, values):
+            if value == part.value:
+                continue
+            if part.invoice.status != CreditCardInvoice.OPEN:
+                return Response(
+                    {'message': 'part of the purchase is in a closed invoice'},
+                    status=status.HTTP_400_BAD_REQUEST)
+            amounts[part.invoice.expense_id] += value - part.value
+            if unpaid(part.invoice):
+                used += value - part.value
+        for part, value in zip(parts, values):
+            for field, change in changes.items():
+                setattr(part, field, change)
+            part.value = value
+        try:
+            with user_atomic():
+                CreditCardExpense.objects.bulk_update(
+                    parts, list({*changes, 'value'}))
+                add_to_invoice_totals(amounts)
+                add_to_used_limit(
+                    credit_card_id, used,
+                    enforce_limit=settings.CARD_LIMIT_ENFORCED)
+        except LimitExceeded:
+            return Response(
+                {'message': 'credit card limit exceeded'},
+                status=status.HTTP_400_BAD_REQUEST)
+        new_expense = next(part for part in parts if part.id == id)
         card_expense_srz = CreditCardExpenseSerializer(new_expense)
         return Response(card_expense_srz.data, status=status.HTTP_200_OK)
     
     def delete(self, request, credit_card_id, id):
         try:
-            card_expense = CreditCardExpense.objects.get(
+            card_expense = CreditCardExpense.objects.select_related(
+                'invoice__expense'
+            ).get(
                 id=id,
                 invoice__credit_card__id=credit_card_id,
                 invoice__credit_card__account__user=request.user
             )
         except CreditCardExpense.DoesNotExist:
             return Response({}, status=status.HTTP_404_NOT_FOUND)
-        with dbtnsac.atomic():
-            card_invoice_expense = card_expense.invoice.expense
-            card_invoice_expense.value -= card_expense.value
-            if card_invoice_expense.value == Decimal(0):
-                card_invoice_expense.delete()
-            else:
-                card_invoice_expense.save()
-            card_expense.delete()
+        parts = purchase_parts(card_expense)
+        if any(
+                part.invoice.status != CreditCardInvoice.OPEN
+                for part in parts):
+            return Response(
+                {'message': 'part of the purchase is in a closed invoice'},
+                status=status.HTTP_400_BAD_REQUEST)
+        amounts = defaultdict(Decimal)
+        for part in parts:
+            amounts[part.invoice.expense_id] -= part.value
+        with user_atomic():
+            add_to_invoice_totals(amounts)
+            add_to_used_limit(credit_card_id, -sum(
+                part.value for part in parts if unpaid(part.invoice)))
+            CreditCardExpense.objects.filter(
+                id__in=[part.id for part in parts]).delete()
+            # Invoices left without expenses go with their transaction
+            Transaction.objects.filter(
+                id__in=amounts,
+                creditcardinvoice__creditcardexpense__isnull=True
+            ).delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
-@api_view(['POST'])
-def create_transference(request):
-    transf_srz = TransferenceSerializer(data=request.data)
-    if not transf_srz.is_valid():
+def add_category_totals(invoices):
+    """Set the expense total and count by category of ``invoices``.
+
+    One grouped query covers all of them.
+    """
+    categories = defaultdict(list)
+    rows = CreditCardExpense.objects.filter(
+        invoice__in=invoices
+    ).values(
+        'invoice_id', 'category_id', 'category__name'
+    ).annotate(
+        total=dbsum('value'), expense_count=Count('id')
+    ).order_by('invoice_id', '-total')
+    for row in rows:
+        categories[row['invoice_id']].append({
+            'category': row['category_id'],
+            'name': row['category__name'],
+            'total': row['total'],
+            'expense_count': row['expense_count'],
+        })
+    for invoice in invoices:
+        invoice.categories = categories[invoice.id]
+    return invoices
+
+class CreditCardInvoiceView(APIView):
+    def get(self, request, credit_card_id, id=None):
+        invoices = CreditCardInvoice.objects.filter(
+            credit_card__id=credit_card_id,
+            credit_card__account__user=request.user
+        ).select_related('expense').annotate(
+            total=dbsum('creditcardexpense__value'),
+            expense_count=Count('creditcardexpense')
+        )
+        if id:
+            try:
+                invoice = invoices.get(id=id)
+            except CreditCardInvoice.DoesNotExist:
+                return Response({}, status=status.HTTP_404_NOT_FOUND)
+            add_category_totals([invoice])
+            return Response(
+                CreditCardInvoiceSerializer(invoice).data,
+                status=status.HTTP_200_OK
+            )
+        pagination = InvoiceCursorPagination()
+        page = add_category_totals(
+            pagination.paginate_queryset(invoices, request, self))
+        return pagination.get_paginated_response(
+            CreditCardInvoiceSerializer(page, many=True).data)
+
+# Transfers accepted by one request to transference/bulk/
+MAX_BULK_TRANSFERS = 1000
+
+class TransferenceView(APIView):
+    def get(self, request):
+        transferences = Transference.objects.select_related(
+            'from_transaction__account',
+            'to_transaction__account'
+        ).filter(
+            from_transaction__account__user=request.user
+        ).order_by('-from_transaction__date_time', '-id')
+        account_id = request.query_params.get('account_id')
+        if account_id:
+            transferences = transferences.filter(
+                Q(from_transaction__account__id=account_id)
+                | Q(to_transaction__account__id=account_id)
+            )
+        if (request.query_params.get('begin_at')
+                or request.query_params.get('end_at')):
+            period_srz = PeriodSerializer(data=request.query_params)
+            if not period_srz.is_valid():
+                return Response(
+                    period_srz.errors, status=status.HTTP_400_BAD_REQUEST)
+            transferences = transferences.filter(
+                from_transaction__date_time__gte=(
+                    period_srz.validated_data['begin_at']),
+                from_transaction__date_time__lte=(
+                    period_srz.validated_data['end_at'])
+            )
+        pagination = PageNumberCustomPagination()
+        return pagination.get_paginated_response(
+                TransferenceHistorySerializer(
+                    pagination.paginate_queryset(
+                        transferences, request, self)
+                    , many=True
+                ).data
+            )
+    
+    def post(self, request):
+        transf_srz = TransferenceSerializer(data=request.data)
+        if not transf_srz.is_valid():
             return Response(
                 transf_srz.errors, status=status.HTTP_400_BAD_REQUEST)
-    try:
-        from_account = Account.objects.get(
-            id=transf_srz.validated_data['from_account'],
-            user=request.user
-        )
-    except Account.DoesNotExist:
-        return Response(
-            {'message': 'account from where to transfer not found'},
-            status=status.HTTP_404_NOT_FOUND
-        )
-    try:
-        to_account = Account.objects.get(
-            id=transf_srz.validated_data['to_account'],
-            user=request.user
+        try:
+            from_account = Account.objects.get(
+                id=transf_srz.validated_data['from_account'],
+                user=request.user
+            )
+        except Account.DoesNotExist:
+            return Response(
+                {'message': 'account from where to transfer not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        try:
+            to_account = Account.objects.get(
+                id=transf_srz.validated_data['to_account'],
+                user=request.user
+            )
+        except Account.DoesNotExist:
+            return Response(
+                {'message': 'account to receive transfer not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        exp_transaction = Transaction(
+            account = from_account,
+            name = transf_srz.validated_data['name'],
+            date_time = transf_srz.validated_data['date_time'],
+            value = transf_srz.validated_data['value'],
+            type = Transaction.EXPENSE,
+            is_transference = True
         )
-    except Account.DoesNotExist:
-        return Response(
-            {'message': 'account to receive transfer not found'},
-            status=status.HTTP_404_NOT_FOUND
+        inc_transaction = Transaction(
+            account = to_account,
+            name = transf_srz.validated_data['name'],
+            date_time = transf_srz.validated_data['date_time'],
+            value = transf_srz.validated_data['value'],
+            type = Transaction.INCOME,
+            is_transference = True
         )
-    exp_transaction = Transaction(
-        account = from_account,
-        name = transf_srz.validated_data['name'],
-        date_time = transf_srz.validated_data['date_time'],
-        value = transf_srz.validated_data['value'],
-        type = Transaction.EXPENSE,
-        is_transference = True
-    )
-    inc_transaction = Transaction(
-        account = to_account,
-        name = transf_srz.validated_data['name'],
-        date_time = transf_srz.validated_data['date_time'],
-        value = transf_srz.validated_data['value'],
-        type = Transaction.INCOME,
-        is_transference = True
+        from_account.balance -= exp_transaction.value
+        to_account.balance += inc_transaction.value
+        if (exp_transaction.status == Transaction.EXECUTED
+                and from_account.balance < exp_transaction.value):
+            return Response(
+                {'message': 'account from where to transfer have not'\
+                    ' enought money'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with user_atomic():
+            if not transf_srz.validated_data['executed']:
+                exp_transaction.status = Transaction.PENDING
+                inc_transaction.status = Transaction.PENDING
+            else:
+                from_account.save()
+                to_account.save()
+            exp_transaction.save()
+            inc_transaction.save()
+            transference = Transference(
+                from_transaction=exp_transaction,
+                to_transaction=inc_transaction
+            )
+            transference.save()
+        return Response({'message': 'transfered'}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def create_transferences(request):
+    transf_srz = TransferenceSerializer(
+        data=request.data,
+        many=True,
+        allow_empty=False,
+        max_length=MAX_BULK_TRANSFERS
     )
-    from_account.balance -= exp_transaction.value
-    to_account.balance += inc_transaction.value
-    if (exp_transaction.status == Transaction.EXECUTED
-            and from_account.balance < exp_transaction.value):
+    if not transf_srz.is_valid():
         return Response(
-            {'message': 'account from where to transfer have not'\
-                ' enought money'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    with dbtnsac.atomic():
-        if not transf_srz.validated_data['executed']:
-            exp_transaction.status = Transaction.PENDING
-            inc_transaction.status = Transaction.PENDING
-        else:
-            from_account.save()
-            to_account.save()
-        exp_transaction.save()
-        inc_transaction.save()
-        transference = Transference(
-            from_transaction=exp_transaction,
-            to_transaction=inc_transaction
-        )
-        transference.save()
-    return Response({'message': 'transfered'}, status=status.HTTP_200_OK)
+            transf_srz.errors, status=status.HTTP_400_BAD_REQUEST)
+    transfers = transf_srz.validated_data
+    with user_atomic():
+        accounts = Account.objects.filter(user=request.user).in_bulk({
+            id
+            for transfer in transfers
+            for id in (transfer['from_account'], transfer['to_account'])
+        })
+        balances = {id: account.balance for id, account in accounts.items()}
+        net = defaultdict(Decimal)
+        transactions = []
+        for index, transfer in enumerate(transfers):
+            from_id, to_id = transfer['from_account'], transfer['to_account']
+            if from_id not in accounts or to_id not in accounts:
+                return Response(
+                    {'message': 'account not found', 'index': index},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            transaction_status = Transaction.PENDING
+            if transfer['executed']:
+                # Funds are checked against the balance left by the
+                # transfers before this one
+                if balances[from_id] < transfer['value']:
+                    return Response(
+                        {'message': 'account from where to transfer have not'
+                            ' enought money', 'index': index},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                transaction_status = Transaction.EXECUTED
+                for id, amount in (
+                        (from_id, -transfer['value']),
+                        (to_id, transfer['value'])):
+                    balances[id] += amount
+                    net[id] += amount
+            transactions.extend(
+                Transaction(
+                    account_id=account_id,
+                    name=transfer['name'],
+                    date_time=transfer['date_time'],
+                    value=transfer['value'],
+                    type=transaction_type,
+                    status=transaction_status,
+                    is_transference=True
+                )
+                for account_id, transaction_type in (
+                    (from_id, Transaction.EXPENSE),
+                    (to_id, Transaction.INCOME)
+                )
+            )
+        transactions = Transaction.objects.bulk_create(transactions)
+        Transference.objects.bulk_create([
+            Transference(from_transaction=from_t, to_transaction=to_t)
+            for from_t, to_t in zip(transactions[::2], transactions[1::2])
+        ])
+        add_by_id(Account.objects.all(), 'balance', net)
+    return Response(
+        {'message': 'transfered', 'count': len(transfers)},
+        status=status.HTTP_200_OK
+    )
 
 @api_view(['GET'])
 def get_total_balance(request):
@@ -649,6 +1078,41 @@ def get_total_balance(request):
         status=status.HTTP_200_OK
     )
 
+@api_view(['GET'])
+def get_dashboard(request):
+    return Response(
+        dashboard.get_dashboard(request.user), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def export_data(request):
+    response = StreamingHttpResponse(
+        export.export_user(request.user.pk), content_type='application/zip')
+    response['Content-Disposition'] = (
+        'attachment; filename="personal-finances.zip"')
+    return response
+
+MAX_BATCH_REQUESTS = 20
+
+@api_view(['POST'])
+def run_batch(request):
+    batch_srz = BatchRequestSerializer(
+        data=request.data,
+        many=True,
+        allow_empty=False,
+        max_length=MAX_BATCH_REQUESTS
+    )
+    if not batch_srz.is_valid():
+        return Response(batch_srz.errors, status=status.HTTP_400_BAD_REQUEST)
+    paths = [sub_request['path'] for sub_request in batch_srz.validated_data]
+    return Response(
+        batch.run_batch(request, paths), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@throttle_classes([])
+def get_metrics(request):
+    return HttpResponse(registry.exposition(), content_type=CONTENT_TYPE)
+
 class UserExtrasView(APIView):
     permission_classes = [IsAdminUser]
     
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_finances.api_server import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the executed transactions older than ARCHIVE_AFTER_MONTHS '
+        'whole months to the compressed archive. Run it periodically, an '
+        'interrupted run is resumed by the next one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='transactions moved per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to wait between chunks, leaving the write lock '
+                'to the API'
+        )
+
+    def handle(self, *args, **options):
+        if settings.ARCHIVE_AFTER_MONTHS < 2:
+            raise CommandError('ARCHIVE_AFTER_MONTHS must be 2 or more')
+        cutoff = archive.archive_cutoff()
+        for alias in settings.DATABASE_SHARDS:
+            moved = 0
+            for count in archive.archive_transactions(
+                    alias, cutoff, options['chunk_size']):
+                moved += count
+                time.sleep(options['pause'])
+            self.stdout.write(f'{alias}: {moved} transactions archived')
@@ -0,0 +1,54 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from personal_finances.api_server import backup
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the WAL frames of every shard database to gzipped segments, '
+        'for restore_db to replay up to a point in time. Keep it running '
+        'next to the API, from before the backups it completes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir', required=True,
+            help='directory of the segments, one subdirectory per shard'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=10,
+            help='seconds between copies, the point in time granularity'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='copy the frames written so far and stop'
+        )
+
+    def handle(self, *args, **options):
+        output_dir = Path(options['output_dir'])
+        archivers = {}
+        try:
+            for alias in settings.DATABASE_SHARDS:
+                if connections[alias].vendor != 'sqlite':
+                    raise CommandError('only SQLite databases are archived')
+                archivers[alias] = backup.WalArchiver(
+                    connections[alias].settings_dict['NAME'],
+                    output_dir / alias)
+            while True:
+                for alias, archiver in archivers.items():
+                    copied = archiver.archive()
+                    if copied:
+                        self.stdout.write(f'{alias}: {copied} bytes archived')
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except backup.BackupError as error:
+            raise CommandError(error)
+        finally:
+            for archiver in archivers.values():
+                archiver.close()
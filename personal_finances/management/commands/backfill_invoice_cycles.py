@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from personal_finances.api_server.models import CreditCardInvoice
+
+
+class Command(BaseCommand):
+    help = (
+        'Set the cycle of the credit card invoices created before invoices '
+        'were keyed by card and cycle. Invoices overlapping another of the '
+        'same cycle are left without one and listed.'
+    )
+
+    def handle(self, *args, **options):
+        for alias in settings.DATABASE_SHARDS:
+            invoices = CreditCardInvoice.objects.using(alias).filter(
+                cycle__isnull=True).order_by('id')
+            updated = 0
+            for invoice in list(invoices):
+                # Invoices close the day after the last day of their period
+                invoice.cycle = (
+                    invoice.period_end + timedelta(days=1)).replace(day=1)
+                try:
+                    with transaction.atomic(using=alias):
+                        invoice.save(using=alias, update_fields=['cycle'])
+                except IntegrityError:
+                    self.stderr.write(
+                        f'{alias}: invoice {invoice.id} of card '
+                        f'{invoice.credit_card_id} overlaps the cycle '
+                        f'{invoice.cycle:%Y-%m}'
+                    )
+                else:
+                    updated += 1
+            self.stdout.write(f'{alias}: {updated} invoices updated')
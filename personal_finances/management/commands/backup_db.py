@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from personal_finances.api_server import backup
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy every shard database to a backup file while the API keeps '
+        'writing. In WAL mode writers are never blocked by the copy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir', required=True,
+            help='directory of the backup files'
+        )
+        parser.add_argument(
+            '--pages', type=int, default=64,
+            help='pages copied per step'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.01,
+            help='seconds to wait between steps'
+        )
+
+    def handle(self, *args, **options):
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for alias in settings.DATABASE_SHARDS:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('only SQLite databases can be backed up')
+            target = output_dir / backup.backup_name(alias)
+            try:
+                backup.backup_database(
+                    connections[alias].settings_dict['NAME'], target,
+                    pages=options['pages'], sleep=options['sleep'])
+            except backup.BackupError as error:
+                raise CommandError(error)
+            self.stdout.write(f'{alias}: backed up to {target}')
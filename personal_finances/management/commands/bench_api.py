@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_finances.api_server import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test every API route in process at the given concurrency '
+        'levels and report throughput and p50/p95/p99 latency as JSON. '
+        'Run seed_benchmark first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8])
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='requests per endpoint and concurrency level'
+        )
+        parser.add_argument(
+            '--only', nargs='+',
+            help='only these endpoints, e.g. "GET account/"'
+        )
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output', help='write the JSON report here')
+        parser.add_argument(
+            '--compare', help='JSON report of a previous run to compare with')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as report_file:
+                previous = json.load(report_file)
+        try:
+            report = benchmark.run(
+                options['concurrency'],
+                options['requests'],
+                only=options['only'],
+                seed=options['seed'],
+                log=self.log
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        for name, reason in report['skipped'].items():
+            self.stderr.write(f'skipped {name}: {reason}')
+        for route in report['uncovered']:
+            self.stderr.write(f'no benchmark scenario for {route}')
+        if previous:
+            for line in benchmark.compare(previous, report):
+                self.stderr.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def log(self, name, concurrency, result):
+        self.stderr.write(
+            f'{name} @{concurrency}: {result["throughput"]:.1f} req/s,'
+            f' p50 {result["p50"] * 1000:.1f} ms,'
+            f' p95 {result["p95"] * 1000:.1f} ms,'
+            f' p99 {result["p99"] * 1000:.1f} ms,'
+            f' errors {sum(result["errors"].values())}'
+        )
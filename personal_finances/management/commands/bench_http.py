@@ -0,0 +1,96 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test running servers with concurrent HTTP GETs, for example '
+        'the WSGI and the ASGI deployment of the same endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True)
+        parser.add_argument('--token')
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument(
+            '--slow-client', type=float, default=0,
+            help='seconds each client waits between request line and headers'
+        )
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        results = {
+            url: asyncio.run(self.run(url, options))
+            for url in options['url']
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for url, result in results.items():
+            self.stdout.write(
+                f'{url}: {result["requests"]} requests,'
+                f' {result["errors"]} errors,'
+                f' {result["throughput"]:.1f} req/s,'
+                f' p50 {result["p50"] * 1000:.1f} ms,'
+                f' p99 {result["p99"] * 1000:.1f} ms'
+            )
+
+    async def run(self, url, options):
+        latencies = []
+        errors = 0
+        remaining = iter(range(options['requests']))
+
+        async def client():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    status_code = await self.get(url, options)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    status_code = None
+                if status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(client() for _ in range(options['concurrency'])))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput': len(latencies) / elapsed,
+            'p50': statistics.median(latencies) if latencies else 0,
+            'p99': (
+                latencies[int(len(latencies) * 0.99)] if latencies else 0),
+        }
+
+    async def get(self, url, options):
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, parts.port or 80)
+        try:
+            path = parts.path + (f'?{parts.query}' if parts.query else '')
+            writer.write(f'GET {path} HTTP/1.1\r\n'.encode())
+            if options['slow_client']:
+                await writer.drain()
+                await asyncio.sleep(options['slow_client'])
+            headers = f'Host: {parts.netloc}\r\nConnection: close\r\n'
+            if options['token']:
+                headers += f'Authorization: Token {options["token"]}\r\n'
+            writer.write(f'{headers}\r\n'.encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            status_code = int(status_line.split()[1])
+            await reader.read()
+            return status_code
+        finally:
+            writer.close()
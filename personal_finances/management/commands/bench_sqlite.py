@@ -0,0 +1,171 @@
+import random
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db import transaction as dbtnsac
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of DATABASE_PROFILES under concurrent '
+        'readers and writers on a scratch SQLite file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+', default=list(settings.DATABASE_PROFILES))
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5)
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+        parser.add_argument('--accounts', type=int, default=50)
+        parser.add_argument('--transactions', type=int, default=200)
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profiles']:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                results[profile] = self.run_profile(
+                    profile, Path(tmpdir) / 'bench.sqlite3', options)
+            self.stdout.write(self.format_result(profile, results[profile]))
+        baseline_profile = options['profiles'][0]
+        baseline = results[baseline_profile]['throughput']
+        for profile, result in results.items():
+            if profile != baseline_profile and baseline:
+                self.stdout.write(
+                    f'{profile}: {result["throughput"] / baseline:.2f}x'
+                    f' throughput of {baseline_profile}'
+                )
+
+    def run_profile(self, profile, path, options):
+        alias = f'bench_{profile}'
+        settings_dict = dict(settings.DATABASE_PROFILES[profile], NAME=path)
+        connections.settings[alias] = connections.configure_settings(
+            {DEFAULT_DB_ALIAS: settings_dict})[DEFAULT_DB_ALIAS]
+        try:
+            self.seed(alias, options['accounts'], options['transactions'])
+            stats = {'latencies': [], 'errors': 0}
+            lock = threading.Lock()
+            stop_at = time.monotonic() + options['duration']
+            workers = [
+                threading.Thread(
+                    target=self.worker,
+                    args=(alias, options, stop_at, stats, lock)
+                )
+                for _ in range(options['threads'])
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+        latencies = sorted(stats['latencies'])
+        return {
+            'requests': len(latencies),
+            'errors': stats['errors'],
+            'throughput': len(latencies) / options['duration'],
+            'p50': statistics.median(latencies) if latencies else 0,
+            'p95': (
+                latencies[int(len(latencies) * 0.95)] if latencies else 0),
+        }
+
+    def seed(self, alias, accounts, transactions):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bench_account ('
+                'id INTEGER PRIMARY KEY, balance DECIMAL NOT NULL)'
+            )
+            cursor.execute(
+                'CREATE TABLE bench_transaction ('
+                'id INTEGER PRIMARY KEY, account_id INTEGER NOT NULL,'
+                ' value DECIMAL NOT NULL, date_time REAL NOT NULL)'
+            )
+            cursor.execute(
+                'CREATE INDEX bench_transaction_account'
+                ' ON bench_transaction (account_id, date_time)'
+            )
+            cursor.executemany(
+                'INSERT INTO bench_account (id, balance) VALUES (%s, %s)',
+                [(i, '0') for i in range(accounts)]
+            )
+            cursor.executemany(
+                'INSERT INTO bench_transaction (account_id, value, date_time)'
+                ' VALUES (%s, %s, %s)',
+                [
+                    (i % accounts, '10.00', time.time())
+                    for i in range(accounts * transactions)
+                ]
+            )
+        connections[alias].close()
+
+    def worker(self, alias, options, stop_at, stats, lock):
+        connection = connections[alias]
+        rng = random.Random()
+        while time.monotonic() < stop_at:
+            account_id = rng.randrange(options['accounts'])
+            started = time.perf_counter()
+            try:
+                if rng.random() < options['write_ratio']:
+                    self.write_request(alias, account_id)
+                else:
+                    self.read_request(alias, account_id)
+            except OperationalError:
+                with lock:
+                    stats['errors'] += 1
+            else:
+                with lock:
+                    stats['latencies'].append(time.perf_counter() - started)
+            # What request_finished does at the end of every request
+            connection.close_if_unusable_or_obsolete()
+        connection.close()
+
+    def read_request(self, alias, account_id):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*), SUM(value) FROM bench_transaction'
+                ' WHERE account_id = %s',
+                [account_id]
+            )
+            cursor.fetchone()
+            cursor.execute(
+                'SELECT id, value, date_time FROM bench_transaction'
+                ' WHERE account_id = %s ORDER BY date_time DESC LIMIT 20',
+                [account_id]
+            )
+            cursor.fetchall()
+
+    def write_request(self, alias, account_id):
+        value = Decimal(random.randint(1, 10000)) / 100
+        with dbtnsac.atomic(using=alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute(
+                    'SELECT balance FROM bench_account WHERE id = %s',
+                    [account_id]
+                )
+                balance = Decimal(cursor.fetchone()[0]) - value
+                cursor.execute(
+                    'INSERT INTO bench_transaction'
+                    ' (account_id, value, date_time) VALUES (%s, %s, %s)',
+                    [account_id, str(value), time.time()]
+                )
+                cursor.execute(
+                    'UPDATE bench_account SET balance = %s WHERE id = %s',
+                    [str(balance), account_id]
+                )
+
+    def format_result(self, profile, result):
+        return (
+            f'{profile}: {result["requests"]} requests,'
+            f' {result["errors"]} errors,'
+            f' {result["throughput"]:.1f} req/s,'
+            f' p50 {result["p50"] * 1000:.2f} ms,'
+            f' p95 {result["p95"] * 1000:.2f} ms'
+        )
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from personal_finances.api_server import billing
+
+
+class Command(BaseCommand):
+    help = (
+        'Close the credit card invoices whose period ended and pay the '
+        'closed ones that are due. Run it periodically, an interrupted run '
+        'is resumed by the next one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='invoices written per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to wait between chunks, leaving the write lock '
+                'to the API'
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        chunk_size, pause = options['chunk_size'], options['pause']
+        for alias in settings.DATABASE_SHARDS:
+            closed = self.run_chunks(billing.close_invoices(
+                alias, timezone.localdate(now), chunk_size), pause)
+            paid = self.run_chunks(
+                billing.settle_invoices(alias, now, chunk_size), pause)
+            self.stdout.write(
+                f'{alias}: {closed} invoices closed, {paid} invoices paid')
+
+    def run_chunks(self, chunks, pause):
+        total = 0
+        for count in chunks:
+            total += count
+            time.sleep(pause)
+        return total
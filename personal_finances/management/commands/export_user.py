@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from personal_finances.api_server.export import export_user
+
+
+class Command(BaseCommand):
+    help = (
+        'Write everything a user owns to a zip of NDJSON files, the format '
+        'of the export route, readable by import_user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True)
+        parser.add_argument('--output', required=True, help='zip file path')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='rows read per query'
+        )
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'wb') as output:
+            for piece in export_user(
+                    options['user'], chunk_size=options['chunk_size']):
+                output.write(piece)
+        self.stdout.write(f'user {options["user"]} exported')
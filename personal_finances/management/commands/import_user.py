@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_finances.api_server.export import ImportConflict, import_user
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert the data of a user exported by export_user or the export '
+        'route, keeping its ids. Nothing is inserted when one is taken or '
+        'a row it references is missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='zip file path')
+        parser.add_argument(
+            '--user', type=int,
+            help='owner of the imported rows, the exported user by default'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='rows inserted per query'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            counts = import_user(
+                options['path'], options['user'], options['chunk_size'])
+        except ImportConflict as e:
+            raise CommandError(e)
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count} rows imported')
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from personal_finances.api_server.sharding import SHARDED_MODELS
+
+# Width of the primary key range reserved for each shard
+SHARD_ID_SPAN = 2 ** 40
+
+
+class Command(BaseCommand):
+    help = (
+        'Migrate every database of DATABASE_SHARDS and give each shard its '
+        'own primary key range, so users can move between shards keeping '
+        'their ids.'
+    )
+
+    def handle(self, *args, **options):
+        for index, alias in enumerate(settings.DATABASE_SHARDS):
+            self.stdout.write(f'Migrating {alias}')
+            call_command(
+                'migrate',
+                database=alias,
+                interactive=False,
+                verbosity=options['verbosity']
+            )
+            if index and connections[alias].vendor == 'sqlite':
+                self.reserve_id_range(alias, index * SHARD_ID_SPAN)
+
+    def reserve_id_range(self, alias, floor):
+        with connections[alias].cursor() as cursor:
+            for model, lookup in SHARDED_MODELS:
+                table = model._meta.db_table
+                cursor.execute(
+                    'UPDATE sqlite_sequence SET seq = %s'
+                    ' WHERE name = %s AND seq < %s',
+                    [floor, table, floor]
+                )
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s'
+                    ' WHERE NOT EXISTS'
+                    ' (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                    [table, floor, table]
+                )
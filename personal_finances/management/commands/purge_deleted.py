@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from personal_finances.api_server import deletion
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove the accounts and users deleted through the API with all '
+        'their rows. Run it periodically, an interrupted run is resumed by '
+        'the next one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to wait between chunks, leaving the write lock '
+                'to the API'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size, pause = options['chunk_size'], options['pause']
+        for alias in settings.DATABASE_SHARDS:
+            rows = self.run_chunks(
+                deletion.purge_accounts(alias, chunk_size), pause)
+            self.stdout.write(f'{alias}: {rows} account rows deleted')
+        rows = self.run_chunks(deletion.purge_users(chunk_size), pause)
+        self.stdout.write(f'{rows} user rows deleted')
+
+    def run_chunks(self, chunks, pause):
+        total = 0
+        for count in chunks:
+            total += count
+            time.sleep(pause)
+        return total
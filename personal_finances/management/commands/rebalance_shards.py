@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_finances.api_server.models import UserShard
+from personal_finances.api_server.sharding import (ShardConflict,
+    is_sharded, move_user, placement_for_user)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move users to another shard. Without --to, users whose shard '
+        'differs from the even placement over DATABASE_SHARDS are moved '
+        'there, which spreads users onto newly added shards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='+', dest='users')
+        parser.add_argument('--to', dest='target')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError('no shards configured, set DB_SHARDS')
+        target = options['target']
+        if target and target not in settings.DATABASE_SHARDS:
+            raise CommandError(f'{target} is not one of DATABASE_SHARDS')
+        directory = UserShard.objects.order_by('user_id')
+        if options['users']:
+            directory = directory.filter(user_id__in=options['users'])
+        for user_shard in directory.iterator():
+            user_target = target or placement_for_user(user_shard.user_id)
+            if user_shard.alias == user_target:
+                continue
+            self.stdout.write(
+                f'user {user_shard.user_id}:'
+                f' {user_shard.alias} -> {user_target}'
+            )
+            if options['dry_run']:
+                continue
+            try:
+                moved = move_user(
+                    user_shard.user_id, user_target, options['chunk_size'])
+            except ShardConflict as e:
+                self.stderr.write(str(e))
+                continue
+            self.stdout.write(f'  moved {moved} rows')
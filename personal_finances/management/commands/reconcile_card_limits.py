@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from personal_finances.api_server.models import CreditCard
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the used limit of every credit card from the expenses '
+        'of its unpaid invoices, fixing the cards whose counter drifted.'
+    )
+
+    def handle(self, *args, **options):
+        for alias in settings.DATABASE_SHARDS:
+            updated = CreditCard.objects.using(alias).reconcile_used_limit()
+            self.stdout.write(f'{alias}: {updated} cards reconciled')
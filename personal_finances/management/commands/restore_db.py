@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from personal_finances.api_server import backup
+
+
+class Command(BaseCommand):
+    help = (
+        'Check a backup made by backup_db, or restore it to a new file '
+        'replaying the WAL segments of archive_wal, then check the result.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', help='backup file')
+        parser.add_argument(
+            '--output',
+            help='database file to create, the backup is only checked '
+                'without it'
+        )
+        parser.add_argument(
+            '--wal-dir', help='segments of the backed up shard to replay'
+        )
+        parser.add_argument(
+            '--until',
+            help='ISO 8601 time, segments written after it are not replayed'
+        )
+
+    def handle(self, *args, **options):
+        until = options['until']
+        if until:
+            until = datetime.fromisoformat(until)
+            if timezone.is_naive(until):
+                until = timezone.make_aware(until)
+        path = options['backup']
+        try:
+            if options['output']:
+                replayed = backup.restore_database(
+                    path, options['output'], options['wal_dir'], until)
+                path = options['output']
+                self.stdout.write(f'{replayed} WAL segments replayed')
+            problems, counts = backup.verify_database(path)
+        except backup.BackupError as error:
+            raise CommandError(error)
+        for table, count in counts.items():
+            self.stdout.write(f'{table}: {count} rows')
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(f'{path} is consistent')
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_finances.api_server.benchmark import (BENCH_ADMIN,
+    BENCH_PASSWORD, Seeder)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create benchmark users, each with accounts, transactions, credit '
+        'card invoices and transferences, for bench_api.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument(
+            '--accounts', type=int, default=3, help='accounts per user')
+        parser.add_argument(
+            '--transactions', type=int, default=100,
+            help='transactions per account'
+        )
+        parser.add_argument(
+            '--cards', type=int, default=1, help='credit cards per user')
+        parser.add_argument(
+            '--categories', type=int, default=8, help='categories per user')
+        parser.add_argument(
+            '--months', type=int, default=12,
+            help='months of history, one invoice per card and month'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        if options['accounts'] < 1:
+            raise CommandError('every user needs at least one account')
+        seeder = Seeder(
+            accounts=options['accounts'],
+            transactions=options['transactions'],
+            cards=options['cards'],
+            categories=options['categories'],
+            months=options['months'],
+            batch_size=options['batch_size'],
+            seed=options['seed']
+        )
+        started = time.perf_counter()
+        seeder.seed(options['users'])
+        elapsed = time.perf_counter() - started
+        for model, count in seeder.counts.items():
+            self.stdout.write(f'{model}: {count}')
+        self.stdout.write(
+            f'Seeded in {elapsed:.1f}s. Users log in with password'
+            f' "{BENCH_PASSWORD}", admin routes use "{BENCH_ADMIN}".'
+        )
@@ -1,10 +1,19 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
+from personal_finances.api_server.instrumentation import (
+    TimedSerializerMixin)
 from personal_finances.api_server.models import (Account, Category,
-    CreditCard, CreditCardExpense, Subcategory, Transaction, UserExtras)
+    CreditCard, CreditCardExpense, CreditCardInvoice, Subcategory, Transaction,
+    Transference, UserExtras)
 
-class UserSerializer(serializers.ModelSerializer):
+# Installments of a divided credit card purchase
+MAX_PARTS = 120
+
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+class UserSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
@@ -12,71 +21,120 @@ class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         return User.objects.create_user(**validated_data)
 
-class UserUpdateSerializer(serializers.ModelSerializer):
+class UserUpdateSerializer(TimedModelSerializer):
     class Meta:
         model = User
         exclude = ['is_superuser', 'is_staff', 'password', 'date_joined']
         read_only_fields = ['id']
 
-class UserUpdateAsAdminSerializer(serializers.ModelSerializer):
+class UserUpdateAsAdminSerializer(TimedModelSerializer):
     class Meta:
         model = User
         exclude = ['password']
         read_only_fields = ['id']
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(TimedModelSerializer):
     class Meta:
         model = Account
         exclude = ['user']
         read_only_fields = ['id', 'value']
 
-class CategorySerializer(serializers.ModelSerializer):
+class AccountStatsSerializer(AccountSerializer):
+    month_income = serializers.DecimalField(
+        max_digits=12, decimal_places=2, source='period_income')
+    month_expense = serializers.DecimalField(
+        max_digits=12, decimal_places=2, source='period_expense')
+    transaction_count = serializers.IntegerField()
+    last_transaction_at = serializers.DateTimeField()
+    pending_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class CategorySerializer(TimedModelSerializer):
     class Meta:
         model = Category
         exclude = ['user']
         read_only_fields = ['id']
 
-class CategoryUpdateSerializer(serializers.ModelSerializer):
+class CategoryUpdateSerializer(TimedModelSerializer):
     class Meta:
         model = Category
         exclude = ['user', 'of_type']
         read_only_fields = ['id']
 
-class SubcategorySerializer(serializers.ModelSerializer):
+class SubcategorySerializer(TimedModelSerializer):
     class Meta:
         model = Subcategory
         fields = '__all__'
         read_only_fields = ['id']
 
-class SubcategoryUpdateSerializer(serializers.ModelSerializer):
+class SubcategoryTreeSerializer(TimedModelSerializer):
+    class Meta:
+        model = Subcategory
+        fields = ['id', 'name']
+
+class CategoryTreeSerializer(TimedModelSerializer):
+    subcategories = SubcategoryTreeSerializer(
+        many=True, source='subcategory_set')
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'of_type', 'subcategories']
+
+class SubcategoryUpdateSerializer(TimedModelSerializer):
     class Meta:
         model = Subcategory
         exclude = ['category']
         read_only_fields = ['id']
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
         read_only_fields = ['id', 'transference']
 
-class TransactionUpdateSerializer(serializers.ModelSerializer):
+class TransactionUpdateSerializer(TimedModelSerializer):
     class Meta:
         model = Transaction
         exclude = ['type']
         read_only_fields = ['id', 'transference']
 
-class CreditCardSerializer(serializers.ModelSerializer):
+class CreditCardSerializer(TimedModelSerializer):
+    available_limit = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True)
     class Meta:
         model = CreditCard
         fields = '__all__'
-        read_only_fields = ['id']
+        read_only_fields = ['id', 'used_limit']
 
-class CreditCardExpenseSerializer(serializers.ModelSerializer):
+class CreditCardExpenseSerializer(TimedModelSerializer):
     class Meta:
         model = CreditCardExpense
         fields = '__all__'
-        read_only_fields = ['id', 'invoice']
+        read_only_fields = ['id', 'invoice', 'first_part']
+    def validate(self, data):
+        if (data.get('repeat') == CreditCardExpense.DIVIDED
+                and not 1 <= (data.get('total_parts') or 0) <= MAX_PARTS):
+            raise serializers.ValidationError(
+                f'divided purchases need total_parts from 1 to {MAX_PARTS}')
+        return data
+
+class InvoiceCategorySerializer(serializers.Serializer):
+    category = serializers.IntegerField(allow_null=True)
+    name = serializers.CharField(allow_null=True)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    expense_count = serializers.IntegerField()
+
+class CreditCardInvoiceSerializer(TimedModelSerializer):
+    due_date = serializers.DateTimeField(source='expense.date_time')
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    expense_count = serializers.IntegerField()
+    categories = InvoiceCategorySerializer(many=True)
+    class Meta:
+        model = CreditCardInvoice
+        fields = [
+            'id', 'credit_card', 'cycle', 'period_begin', 'period_end',
+            'due_date', 'status', 'closed_total', 'total', 'expense_count',
+            'categories'
+        ]
+        read_only_fields = fields
 
 class TransferenceSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=40)
@@ -86,6 +144,27 @@ class TransferenceSerializer(serializers.Serializer):
     date_time = serializers.DateTimeField()
     executed = serializers.BooleanField(default=True)
 
+class BatchRequestSerializer(serializers.Serializer):
+    path = serializers.CharField(max_length=2000)
+    def validate_path(self, value):
+        if value.startswith('/'):
+            raise serializers.ValidationError(
+                'path must be relative to the API root')
+        return value
+
+class TransferenceLegSerializer(TimedModelSerializer):
+    account = AccountSerializer()
+    class Meta:
+        model = Transaction
+        fields = ['id', 'account', 'name', 'date_time', 'value', 'status']
+
+class TransferenceHistorySerializer(TimedModelSerializer):
+    from_transaction = TransferenceLegSerializer()
+    to_transaction = TransferenceLegSerializer()
+    class Meta:
+        model = Transference
+        fields = ['id', 'from_transaction', 'to_transaction']
+
 class PeriodSerializer(serializers.Serializer):
     begin_at = serializers.DateTimeField()
     end_at = serializers.DateTimeField()
@@ -104,7 +183,7 @@ class PasswordChangeSerializer(serializers.Serializer):
                 'old password cannot be equal to new password')
         return data
 
-class UserExtrasSerializer(serializers.ModelSerializer):
+class UserExtrasSerializer(TimedModelSerializer):
     class Meta:
         model = UserExtras
         fields = '__all__'
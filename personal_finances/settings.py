@@ -44,7 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'personal_finances.api_server.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'personal_finances.api_server.middleware.ReplicaRoutingMiddleware',
+    'personal_finances.api_server.middleware.ShardRoutingMiddleware',
+    'personal_finances.api_server.middleware.DashboardCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,13 +81,106 @@ WSGI_APPLICATION = 'personal_finances.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
+# DB_PROFILE selects one of DATABASE_PROFILES. The production profile keeps
+# connections open between requests and tunes SQLite for concurrent
+# workers: WAL lets readers run alongside the writer, busy_timeout makes
+# writers wait for the lock instead of failing and BEGIN IMMEDIATE takes
+# the write lock when an atomic block starts.
+
+DB_PROFILE = ENV.get('DB_PROFILE', 'default')
+
+DATABASE_PROFILES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'sqlitedb' / 'db.sqlite3',
-    }
+    },
+    'production': {
+        'ENGINE': 'personal_finances.sqlite_backend',
+        'NAME': BASE_DIR / 'sqlitedb' / 'db.sqlite3',
+        'CONN_MAX_AGE': int(ENV.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': int(ENV.get('DB_BUSY_TIMEOUT', 5000)),
+                'mmap_size': int(ENV.get('DB_MMAP_SIZE', 268435456)),
+                'cache_size': int(ENV.get('DB_CACHE_SIZE', -65536)),
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DB_PROFILE],
+}
+
+# DB_REPLICAS is a comma separated list of read replica database files.
+# Safe-method requests read from them, see api_server/middleware.py. A
+# client that wrote something reads from the primary for
+# REPLICA_PIN_SECONDS afterwards. Locally a replica can be any SQLite file
+# refreshed with ./manage.py sync_replicas.
+
+DATABASE_REPLICAS = []
+
+for index, name in enumerate(filter(None, ENV.get('DB_REPLICAS', '').split(','))):
+    DATABASES[f'replica_{index}'] = dict(
+        DATABASE_PROFILES[DB_PROFILE],
+        NAME=BASE_DIR / name.strip(),
+        TEST={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+# DB_SHARDS is a comma separated list of extra database files for user
+# data. Each user is placed on one shard, the default database included,
+# see api_server/sharding.py. Create the schema on every shard with
+# ./manage.py migrate_shards and move users with ./manage.py rebalance_shards.
+
+DATABASE_SHARDS = ['default']
+
+for index, name in enumerate(
+        filter(None, ENV.get('DB_SHARDS', '').split(',')), start=1):
+    DATABASES[f'shard_{index}'] = dict(
+        DATABASE_PROFILES[DB_PROFILE], NAME=BASE_DIR / name.strip())
+    DATABASE_SHARDS.append(f'shard_{index}')
+
+DATABASE_ROUTERS = [
+    'personal_finances.api_server.db_routers.ShardRouter',
+    'personal_finances.api_server.db_routers.ReplicaRouter',
+]
+
+# The 'shared' cache is seen by every worker, for state a client must find
+# whichever worker serves it. Files next to the database by default,
+# enough for the workers of one server; the file backend unpickles what it
+# finds there, so the directory must be private to the API, it is created
+# with mode 0700. Set SHARED_CACHE_BACKEND and SHARED_CACHE_LOCATION to a
+# memcached or Redis cache for several servers. The 'default' cache is
+# local to each process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': ENV.get('SHARED_CACHE_BACKEND')
+            or 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': ENV.get('SHARED_CACHE_LOCATION')
+            or str(BASE_DIR / 'sqlitedb' / 'cache'),
+        # Above it a third of the entries is dropped at random
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
 
+TEST_RUNNER = 'personal_finances.test_runner.TestRunner'
+
+REPLICA_PIN_SECONDS = int(ENV.get('REPLICA_PIN_SECONDS', 5))
+
+# Must name a shared cache, a client pinned by one worker reads from
+# another
+REPLICA_PIN_CACHE = 'shared'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -131,7 +228,11 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'personal_finances.api_server.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'personal_finances.api_server.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
         'personal_finances.api_server.throttling.PremiumUserRateThrottle'
@@ -142,4 +243,102 @@ REST_FRAMEWORK = {
         'admin': ENV['ADMIN_RATE'],
         'premium': ENV['PREMIUM_RATE']
     }
-}
\ No newline at end of file
+}
+
+# Throttle tier cache
+# Per-process LRU of user id to throttle scope, see api_server/throttling.py
+
+THROTTLE_TIER_CACHE_SIZE = int(ENV.get('THROTTLE_TIER_CACHE_SIZE', 4096))
+
+THROTTLE_TIER_CACHE_TTL = int(ENV.get('THROTTLE_TIER_CACHE_TTL', 60))
+
+
+
+# Token authentication
+# TOKEN_TTL is the token lifetime in seconds, unset for tokens that never
+# expire. Token lookups are cached per process for TOKEN_CACHE_TTL seconds
+# and, when TOKEN_SHARED_CACHE names an alias of CACHES, in that cache for
+# TOKEN_SHARED_CACHE_TTL seconds. Revoked tokens are always recorded in the
+# shared TOKEN_REVOCATION_CACHE, which every worker checks before trusting
+# its own copy of a lookup.
+
+TOKEN_TTL = int(ENV['TOKEN_TTL']) if ENV.get('TOKEN_TTL') else None
+
+TOKEN_CACHE_SIZE = int(ENV.get('TOKEN_CACHE_SIZE', 4096))
+
+TOKEN_CACHE_TTL = int(ENV.get('TOKEN_CACHE_TTL', 10))
+
+TOKEN_SHARED_CACHE = ENV.get('TOKEN_SHARED_CACHE') or None
+
+TOKEN_SHARED_CACHE_TTL = int(ENV.get('TOKEN_SHARED_CACHE_TTL', 300))
+
+TOKEN_REVOCATION_CACHE = 'shared'
+
+
+# Per-process cache of the user to shard directory
+
+USER_SHARD_CACHE_SIZE = int(ENV.get('USER_SHARD_CACHE_SIZE', 4096))
+
+USER_SHARD_CACHE_TTL = int(ENV.get('USER_SHARD_CACHE_TTL', 60))
+
+# Moves of users between shards are announced in this shared cache, every
+# worker checks it before trusting its own copy of the shard of a user
+USER_SHARD_SHARED_CACHE = 'shared'
+
+
+# Request instrumentation, see api_server/instrumentation.py
+# PERF_SAMPLE_RATE is the fraction of requests measured, from 0 to 1.
+# PERF_SERVER_TIMING sends their timings to the clients, off by default as
+# they tell how the server spends its time.
+
+PERF_SAMPLE_RATE = float(ENV.get('PERF_SAMPLE_RATE') or 0)
+
+PERF_SERVER_TIMING = bool(ENV.get('PERF_SERVER_TIMING', 'False') == 'True')
+
+PERF_LOG_THRESHOLD_MS = float(ENV.get('PERF_LOG_THRESHOLD_MS') or 500)
+
+# Dashboard, see api_server/dashboard.py
+# DASHBOARD_WORKERS threads run its queries concurrently, 0 runs them in
+# the request thread.
+
+DASHBOARD_WORKERS = int(ENV.get('DASHBOARD_WORKERS') or 0)
+
+# Must name a shared cache, writes served by one worker drop the
+# dashboards the others would serve
+DASHBOARD_CACHE = 'shared'
+
+DASHBOARD_CACHE_TTL = int(ENV.get('DASHBOARD_CACHE_TTL', 60))
+
+# Executed transactions older than ARCHIVE_AFTER_MONTHS whole months are
+# moved to the archive by archive_transactions, see api_server/archive.py.
+# Keep it at 2 or more, account stats only sum the current month live.
+
+ARCHIVE_AFTER_MONTHS = int(ENV.get('ARCHIVE_AFTER_MONTHS', 12))
+
+# Refuse credit card expenses that would take the used limit of the card
+# past its limit.
+
+CARD_LIMIT_ENFORCED = bool(ENV.get('CARD_LIMIT_ENFORCED') == 'True')
+
+# Prometheus metrics, see api_server/metrics.py
+# Set METRICS_DIR to an empty directory shared by the workers of a server
+# to expose the metrics of all of them.
+
+METRICS_ENABLED = bool(ENV.get('METRICS_ENABLED', 'True') == 'True')
+
+METRICS_DIR = ENV.get('METRICS_DIR') or None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'personal_finances.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,46 @@
+"""
+SQLite backend tuned for serving the API from several gunicorn workers.
+
+Besides the stock sqlite3 backend options, ``OPTIONS`` accepts:
+
+``pragmas``
+    Mapping of PRAGMA name to value applied on every new connection, for
+    example ``{'journal_mode': 'WAL', 'busy_timeout': 5000}``.
+``transaction_mode``
+    ``DEFERRED`` (SQLite default), ``IMMEDIATE`` or ``EXCLUSIVE``. Used when
+    ``atomic`` opens a transaction. ``IMMEDIATE`` takes the write lock up
+    front, so a transaction waits on ``busy_timeout`` instead of failing
+    with "database is locked" when it upgrades from read to write.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pragmas', None)
+        conn_params.pop('transaction_mode', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', {})
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get(
+            'transaction_mode', 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f'transaction_mode must be one of {TRANSACTION_MODES}')
+        return mode
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
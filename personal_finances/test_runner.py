@@ -0,0 +1,33 @@
+"""
+Test runner keeping the tests away from the caches of a running server.
+
+The 'shared' cache of the settings is on disk, where a development server
+keeps its pins, revocations and dashboards. The tests get their own in a
+temporary directory, which they may clear at will.
+"""
+
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_settings = override_settings(CACHES=dict(
+            settings.CACHES,
+            shared={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_dir.name,
+            }
+        ))
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        self.cache_dir.cleanup()
+        super().teardown_test_environment(**kwargs)